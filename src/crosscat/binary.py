@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 MIT Probabilistic Computing Project
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+This module converts the metadata of cgpm.crosscat.State and Engine to and
+from a binary columnar format, stored as a directory with the contents
+
+    metadata.json   Everything except the dataset and the partitions.
+    X.npy           Dataset as a float64 array, shared by all states.
+    Zv.npy          View of each output in each state, int32 array.
+    Zrv-<s>.npy     Cluster of each row in each view of state s, int32 array.
+
+Arrays are loaded with np.load(mmap_mode='r'), so that the dataset is paged in
+from disk when the states read it rather than parsed upfront.
+
+LazyStates exposes the states of a container as a list which builds each
+State on first access, and keeps at most a given number of them in memory,
+spilling modified states to temporary files.
+'''
+
+import cPickle as pickle
+import json
+import os
+import shutil
+import tempfile
+
+from collections import MutableSequence
+from collections import OrderedDict
+
+import numpy as np
+
+
+FORMAT_VERSION = 1
+
+ENGINE_FACTORY = ('cgpm.crosscat.engine', 'Engine')
+
+
+def save_metadata(path, metadata):
+    """Write metadata of a State or Engine to the directory at path."""
+    engine = tuple(metadata['factory']) == ENGINE_FACTORY
+    states = metadata['states'] if engine else [metadata]
+    if not os.path.exists(path):
+        os.makedirs(path)
+    np.save(_path_X(path), np.asarray(metadata['X'], dtype=float))
+    Zvs = []
+    records = []
+    for s, state in enumerate(states):
+        Zv = dict(state['Zv'])
+        Zvs.append([Zv[c] for c in state['outputs']])
+        views = sorted(dict(state['Zrv']))
+        Zrv = dict(state['Zrv'])
+        np.save(_path_Zrv(path, s), _as_int32([Zrv[v] for v in views]))
+        record = {
+            key: value for key, value in state.iteritems()
+            if key not in ['X', 'Zv', 'Zrv']
+        }
+        record['views'] = views
+        records.append(record)
+    np.save(_path_Zv(path), _as_int32(Zvs))
+    header = {
+        'format_version': FORMAT_VERSION,
+        'factory': metadata['factory'],
+        'states': records,
+    }
+    with open(_path_header(path), 'w') as f:
+        json.dump(header, f)
+
+
+def load_metadata(path, mmap_mode='r'):
+    """Read metadata of a State or Engine from the directory at path."""
+    header, X, Zvs = load_container(path, mmap_mode)
+    states = [
+        load_state_metadata(path, s, record, X, Zvs[s], mmap_mode)
+        for s, record in enumerate(header['states'])
+    ]
+    if tuple(header['factory']) == ENGINE_FACTORY:
+        return {'X': X, 'states': states, 'factory': header['factory']}
+    assert len(states) == 1
+    return states[0]
+
+
+def load_container(path, mmap_mode='r'):
+    """Read the header, dataset, and view partitions at path."""
+    with open(_path_header(path), 'r') as f:
+        header = json.load(f)
+    if header['format_version'] != FORMAT_VERSION:
+        raise ValueError(
+            'Unknown binary format version: %s' % (header['format_version'],))
+    X = np.load(_path_X(path), mmap_mode=mmap_mode)
+    Zvs = np.load(_path_Zv(path), mmap_mode=mmap_mode)
+    return header, X, Zvs
+
+
+def load_state_metadata(path, s, record, X, Zv, mmap_mode='r'):
+    """Assemble the metadata of state s from its record and arrays."""
+    Zrv = np.load(_path_Zrv(path, s), mmap_mode=mmap_mode)
+    metadata = {
+        key: value for key, value in record.iteritems()
+        if key != 'views'
+    }
+    metadata['X'] = X
+    metadata['Zv'] = zip(record['outputs'], Zv.tolist())
+    metadata['Zrv'] = zip(record['views'], Zrv.tolist())
+    return metadata
+
+
+class LazyStates(MutableSequence):
+    """List of states which are built from disk on first access.
+
+    Each slot holds the index of a state in the container, the path of a
+    state spilled to a temporary file, or nothing for states added in
+    memory. At most max_resident states (None for unbounded) are held in a
+    least recently used cache. Evicted states are built again by
+    loader(index) from the container, or unpickled from their spill file.
+    Assigned and inserted states are dirty, and are pickled to a spill file
+    when they are evicted; mutating a state in place without assigning it
+    back does not mark it dirty, so the mutation is lost on eviction.
+    """
+
+    def __init__(self, loader, num_states, max_resident=None):
+        if max_resident is not None and max_resident < 1:
+            raise ValueError('max_resident must be positive: %s'
+                % (max_resident,))
+        self.loader = loader
+        self.max_resident = max_resident
+        self.slots = [_Slot('disk', s) for s in xrange(num_states)]
+        # Map from slot to state and dirty flag, least recent first.
+        self.resident = OrderedDict()
+        self.spill_dir = None
+
+    def __del__(self):
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        slot = self.slots[index]
+        if slot in self.resident:
+            state, dirty = self.resident.pop(slot)
+        elif slot.kind == 'disk':
+            state, dirty = self.loader(slot.value), False
+        else:
+            assert slot.kind == 'spill'
+            with open(slot.value, 'rb') as f:
+                state, dirty = pickle.load(f), False
+        self._cache(slot, state, dirty)
+        return state
+
+    def __setitem__(self, index, state):
+        if isinstance(index, slice):
+            indexes = xrange(*index.indices(len(self)))
+            states = list(state)
+            if len(states) != len(indexes):
+                raise ValueError('Cannot resize LazyStates by assignment.')
+            for i, s in zip(indexes, states):
+                self[i] = s
+            return
+        slot = self.slots[index]
+        self.resident.pop(slot, None)
+        self._cache(slot, state, True)
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            for i in sorted(xrange(*index.indices(len(self))), reverse=True):
+                del self[i]
+            return
+        slot = self.slots.pop(index)
+        self.resident.pop(slot, None)
+        if slot.kind == 'spill':
+            os.remove(slot.value)
+
+    def insert(self, index, state):
+        slot = _Slot('memory', None)
+        self.slots.insert(index, slot)
+        self._cache(slot, state, True)
+
+    def num_resident(self):
+        """Return the number of states currently held in memory."""
+        return len(self.resident)
+
+    def resident_states(self):
+        """Return the states currently held in memory, without loading."""
+        return [state for state, _dirty in self.resident.itervalues()]
+
+    def _cache(self, slot, state, dirty):
+        self.resident[slot] = (state, dirty)
+        if self.max_resident is not None:
+            while len(self.resident) > self.max_resident:
+                evicted, (evicted_state, evicted_dirty) = \
+                    self.resident.popitem(last=False)
+                if evicted_dirty:
+                    self._spill(evicted, evicted_state)
+
+    def _spill(self, slot, state):
+        if slot.kind != 'spill':
+            if self.spill_dir is None:
+                self.spill_dir = tempfile.mkdtemp(prefix='gpmcc-states')
+            fd, path = tempfile.mkstemp(suffix='.pkl', dir=self.spill_dir)
+            os.close(fd)
+            slot.kind, slot.value = 'spill', path
+        with open(slot.value, 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+
+
+class _Slot(object):
+    # Location of a state of LazyStates, compared by identity.
+    def __init__(self, kind, value):
+        self.kind = kind
+        self.value = value
+
+
+def _as_int32(array):
+    array = np.asarray(array)
+    if array.size and np.max(np.abs(array)) >= 2**31:
+        raise ValueError('Partition labels exceed int32.')
+    return array.astype(np.int32)
+
+def _path_header(path):
+    return os.path.join(path, 'metadata.json')
+
+def _path_X(path):
+    return os.path.join(path, 'X.npy')
+
+def _path_Zv(path):
+    return os.path.join(path, 'Zv.npy')
+
+def _path_Zrv(path, s):
+    return os.path.join(path, 'Zrv-%d.npy' % (s,))
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 MIT Probabilistic Computing Project
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+This module records the inference progress of a cgpm.crosscat.State or
+Engine as a log of delta checkpoints, appended to a file with one JSON
+record per line. A delta holds only what transitions change since the
+previous checkpoint: the column partition, the row partition of each view,
+the hyperparameters, the CRP concentrations, and the diagnostics.
+
+Replaying the log onto the metadata of a base snapshot, taken when the log
+was started, yields the metadata of the latest checkpoint:
+
+    metadata = engine.to_metadata()
+    log = DeltaLog(path, engine)
+    engine.transition(N=100)
+    log.append(engine)
+    ...
+    engine = Engine.from_metadata(replay(metadata, path))
+
+The metadata of composed cgpms is recorded whenever it changes. Changes to
+the dataset or to the structure of the model, such as the rows, columns,
+statistical types, and the outputs and inputs of composed cgpms, cannot be
+represented by a delta and require a new base snapshot.
+'''
+
+import json
+
+from cgpm.crosscat.binary import ENGINE_FACTORY
+
+
+# Metadata which transitions do not change.
+STRUCTURE = [
+    'outputs', 'cctypes', 'distargs', 'Cd', 'Ci', 'loom_path', 'factory',
+]
+
+# Metadata of composed cgpms which transitions do not change.
+HOOKED_STRUCTURE = ['factory', 'outputs', 'inputs']
+
+
+class DeltaLog(object):
+    """Appendable log of delta checkpoints of a State or Engine."""
+
+    def __init__(self, path, model):
+        """Start a log at path, relative to the current metadata of model."""
+        self.path = path
+        self.metadata = get_metadata(model, suffstats=False)
+
+    def append(self, model):
+        """Append the changes to model since the last checkpoint."""
+        metadata = get_metadata(model, suffstats=False)
+        delta = _diff_metadata(self.metadata, metadata)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(delta))
+            f.write('\n')
+        # Advance the last checkpoint by the delta, which only touches the
+        # metadata that changed, rather than keeping the new metadata.
+        self.metadata = patch_metadata(self.metadata, delta)
+        return delta
+
+
+def get_metadata(model, suffstats=True):
+    """Return metadata of model without the dataset, in JSON normal form."""
+    if hasattr(model, 'states'):
+        metadata = {
+            'states': [
+                s._to_metadata_without_data(suffstats=suffstats)
+                for s in model.states
+            ],
+            'factory': ENGINE_FACTORY,
+        }
+    else:
+        metadata = model._to_metadata_without_data(suffstats=suffstats)
+    return _normalize(metadata)
+
+
+def diff_metadata(old, new):
+    """Return the delta which patches metadata old into metadata new."""
+    return _diff_metadata(_normalize(old), _normalize(new))
+
+
+def _diff_metadata(old, new):
+    # Delta between metadata old and new, which are in JSON normal form.
+    if tuple(old['factory']) != tuple(new['factory']):
+        raise ValueError('Cannot diff metadata of different models.')
+    if tuple(new['factory']) == ENGINE_FACTORY:
+        if len(old['states']) != len(new['states']):
+            raise ValueError('Number of states changed, take a new snapshot.')
+        return {'states': [
+            diff_state_metadata(s_old, s_new)
+            for s_old, s_new in zip(old['states'], new['states'])
+        ]}
+    return diff_state_metadata(old, new)
+
+
+def diff_state_metadata(old, new):
+    """Return the delta which patches state metadata old into new."""
+    for key in STRUCTURE:
+        if old.get(key) != new.get(key):
+            raise ValueError('Metadata %s changed, take a new snapshot.'
+                % (key,))
+    hooked_old = old.get('hooked_cgpms', {})
+    hooked_new = new.get('hooked_cgpms', {})
+    if _hooked_structure(hooked_old) != _hooked_structure(hooked_new):
+        raise ValueError('Composed cgpms changed, take a new snapshot.')
+    delta = dict()
+    # Column partition.
+    Zv_old = dict(old['Zv'])
+    delta['Zv'] = [(c, v) for c, v in new['Zv'] if Zv_old[c] != v]
+    # Row partitions, as the changed rows or the full partition of new views.
+    Zrv_old = dict(old['Zrv'])
+    Zrv_new = dict(new['Zrv'])
+    n_rows = len(Zrv_old.values()[0])
+    if any(len(Zr) != n_rows for Zr in Zrv_new.itervalues()):
+        raise ValueError('Number of rows changed, take a new snapshot.')
+    delta['Zrv'] = []
+    for v, Zr in new['Zrv']:
+        if v not in Zrv_old:
+            delta['Zrv'].append((v, None, Zr))
+            continue
+        rows = [r for r in xrange(n_rows) if Zrv_old[v][r] != Zr[r]]
+        if rows:
+            delta['Zrv'].append((v, rows, [Zr[r] for r in rows]))
+    delta['views_removed'] = [v for v in Zrv_old if v not in Zrv_new]
+    # Hyperparameters and concentrations.
+    delta['hypers'] = [
+        (i, hypers) for i, (hypers, hypers_old)
+        in enumerate(zip(new['hypers'], old['hypers']))
+        if hypers != hypers_old
+    ]
+    delta['alpha'] = new['alpha']
+    delta['view_alphas'] = new['view_alphas']
+    # Metadata of the composed cgpms which changed.
+    delta['hooked_cgpms'] = [
+        (token, metadata) for token, metadata in sorted(hooked_new.items())
+        if metadata != hooked_old[token]
+    ]
+    # Diagnostics, as the new entries of each trace.
+    delta['diagnostics'] = dict()
+    delta['diagnostics_appended'] = dict()
+    for key, value in new['diagnostics'].iteritems():
+        value_old = old['diagnostics'].get(key)
+        if value == value_old:
+            continue
+        if isinstance(value, list) and isinstance(value_old, list) \
+                and value[:len(value_old)] == value_old:
+            delta['diagnostics_appended'][key] = value[len(value_old):]
+        else:
+            delta['diagnostics'][key] = value
+    return delta
+
+
+def patch_metadata(metadata, delta):
+    """Return metadata with the delta applied, leaving metadata unchanged."""
+    if tuple(metadata['factory']) == ENGINE_FACTORY:
+        assert len(metadata['states']) == len(delta['states'])
+        patched = dict(metadata)
+        patched['states'] = [
+            patch_state_metadata(m, d)
+            for m, d in zip(metadata['states'], delta['states'])
+        ]
+        return patched
+    return patch_state_metadata(metadata, delta)
+
+
+def patch_state_metadata(metadata, delta):
+    """Return state metadata with the delta applied."""
+    patched = dict(metadata)
+    # The saved suffstats describe the base partitions, so drop them.
+    patched.pop('suffstats', None)
+    Zv = dict(metadata['Zv'])
+    Zv.update(delta['Zv'])
+    patched['Zv'] = [(c, Zv[c]) for c, _v in metadata['Zv']]
+    Zrv = dict(metadata['Zrv'])
+    for v in delta['views_removed']:
+        del Zrv[v]
+    for v, rows, clusters in delta['Zrv']:
+        if rows is None:
+            Zrv[v] = list(clusters)
+        else:
+            Zrv[v] = list(Zrv[v])
+            for r, k in zip(rows, clusters):
+                Zrv[v][r] = k
+    patched['Zrv'] = sorted(Zrv.items())
+    patched['hypers'] = list(metadata['hypers'])
+    for i, hypers in delta['hypers']:
+        patched['hypers'][i] = hypers
+    patched['alpha'] = delta['alpha']
+    patched['view_alphas'] = delta['view_alphas']
+    if delta.get('hooked_cgpms'):
+        # Tokens of the delta are strings, after its round trip through JSON.
+        hooked = dict(metadata['hooked_cgpms'])
+        tokens = {str(token): token for token in hooked}
+        for token, cgpm_metadata in delta['hooked_cgpms']:
+            hooked[tokens[str(token)]] = cgpm_metadata
+        patched['hooked_cgpms'] = hooked
+    patched['diagnostics'] = dict(metadata['diagnostics'])
+    patched['diagnostics'].update(delta['diagnostics'])
+    for key, value in delta['diagnostics_appended'].iteritems():
+        patched['diagnostics'][key] = \
+            list(patched['diagnostics'][key]) + value
+    return patched
+
+
+def read_deltas(path):
+    """Return the list of deltas in the log at path."""
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def replay(metadata, path):
+    """Return metadata of the last checkpoint in the log at path.
+
+    The metadata must be the base snapshot taken when the log was started.
+    """
+    for delta in read_deltas(path):
+        metadata = patch_metadata(metadata, delta)
+    return metadata
+
+
+def _hooked_structure(hooked_cgpms):
+    return {
+        token: [metadata.get(key) for key in HOOKED_STRUCTURE]
+        for token, metadata in hooked_cgpms.iteritems()
+    }
+
+def _normalize(metadata):
+    # Round trip through JSON, so that the metadata does not alias the model
+    # and compares equal to metadata which was read back from disk.
+    return json.loads(json.dumps(metadata))
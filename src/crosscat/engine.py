@@ -22,6 +22,7 @@ from collections import namedtuple
 
 import numpy as np
 
+from cgpm.crosscat import binary
 from cgpm.crosscat.state import State
 from cgpm.utils import general as gu
 from cgpm.utils.parallel_map import parallel_map
@@ -57,16 +58,36 @@ def _compose((method, state, cgpm_metadata, args)):
 def _evaluate((method, state, args)):
     return getattr(state, method)(*args)
 
+def _incorporate_predictive((state, rowids, observations)):
+    # Incorporate the rows one at a time, accumulating the predictive density
+    # of each row given the earlier rows.
+    logp = 0
+    for rowid, observation in zip(rowids, observations):
+        targets = {c: v for c, v in observation.iteritems()
+            if c in state.outputs}
+        logp += state.logpdf(-1, targets)
+        state.incorporate(rowid, observation)
+    return state, logp
+
 
 class Engine(object):
     """Multiprocessing engine for a stochastic ensemble of parallel States."""
 
     def __init__(self, X, num_states=1, rng=None, multiprocess=1, **kwargs):
-        mapper = parallel_map if multiprocess else map
         self.rng = gu.gen_rng(1) if rng is None else rng
         X = np.asarray(X)
-        args = [(X, seed, kwargs) for seed in self._get_seeds(num_states)]
-        self.states = mapper(_intialize, args)
+        seeds = self._get_seeds(num_states)
+        if multiprocess:
+            args = [(X, seed, kwargs) for seed in seeds]
+            self.states = parallel_map(_intialize, args)
+        else:
+            # Build the states after the first against its dataset columns.
+            self.states = []
+            for seed in seeds:
+                X_state = self.states[0].share_dataset() if self.states else X
+                self.states.append(_intialize((X_state, seed, kwargs)))
+        # States built by workers hold their own dataset.
+        self._share_dataset()
 
     # --------------------------------------------------------------------------
     # External
@@ -75,27 +96,19 @@ class Engine(object):
             self, N=None, S=None, kernels=None, rowids=None, cols=None,
             views=None, progress=True, checkpoint=None, statenos=None,
             multiprocess=1):
-        mapper = parallel_map if multiprocess else map
         statenos = statenos or xrange(self.num_states())
-        args = [('transition', self.states[s],
-                (N, S, kernels, rowids, cols, views, progress, checkpoint))
-                for s in statenos]
-        states = mapper(_modify, args)
-        for s, state in zip(statenos, states):
-            self.states[s] = state
+        self._modify_states(_modify, statenos, multiprocess, lambda s:
+            ('transition', self.states[s],
+                (N, S, kernels, rowids, cols, views, progress, checkpoint)))
 
     def transition_lovecat(
             self, N=None, S=None, kernels=None, rowids=None,
             cols=None, progress=None, checkpoint=None, statenos=None,
             multiprocess=1):
-        mapper = parallel_map if multiprocess else map
         statenos = statenos or xrange(self.num_states())
-        args = [('transition_lovecat', self.states[s],
-                (N, S, kernels, rowids, cols, progress, checkpoint))
-                for s in statenos]
-        states = mapper(_modify, args)
-        for s, state in zip(statenos, states):
-            self.states[s] = state
+        self._modify_states(_modify, statenos, multiprocess, lambda s:
+            ('transition_lovecat', self.states[s],
+                (N, S, kernels, rowids, cols, progress, checkpoint)))
 
     def transition_loom(self, N=None, S=None, kernels=None,
             progress=None, checkpoint=None, multiprocess=1):
@@ -107,87 +120,121 @@ class Engine(object):
 
     def transition_foreign(self, N=None, S=None, cols=None, progress=True,
             statenos=None, multiprocess=1):
-        mapper = parallel_map if multiprocess else map
         statenos = statenos or xrange(self.num_states())
-        args = [('transition_foreign', self.states[s],
-                (N, S, cols, progress))
-                for s in statenos]
-        states = mapper(_modify, args)
-        for s, state in zip(statenos, states):
-            self.states[s] = state
+        self._modify_states(_modify, statenos, multiprocess, lambda s:
+            ('transition_foreign', self.states[s],
+                (N, S, cols, progress)))
 
     def incorporate_dim(self, T, outputs, inputs=None, cctype=None,
             distargs=None, v=None, multiprocess=1):
-        mapper = parallel_map if multiprocess else map
         statenos = xrange(self.num_states())
-        args = [('incorporate_dim', self.states[s],
-                (T, outputs, inputs, cctype, distargs, v))
-                for s in statenos]
-        self.states = mapper(_modify, args)
+        self._modify_states(_modify, statenos, multiprocess, lambda s:
+            ('incorporate_dim', self.states[s],
+                (T, outputs, inputs, cctype, distargs, v)))
 
     def unincorporate_dim(self, col, multiprocess=1):
-        mapper = parallel_map if multiprocess else map
         statenos = xrange(self.num_states())
-        args = [('unincorporate_dim', self.states[s],
-                (col,))
-                for s in statenos]
-        self.states = mapper(_modify, args)
+        self._modify_states(_modify, statenos, multiprocess, lambda s:
+            ('unincorporate_dim', self.states[s],
+                (col,)))
 
     def incorporate(self, rowid, observation, inputs=None, multiprocess=1):
-        mapper = parallel_map if multiprocess else map
         statenos = xrange(self.num_states())
-        args = [('incorporate', self.states[s],
-                (rowid, observation, inputs))
-                for s in statenos]
-        self.states = mapper(_modify, args)
+        self._modify_states(_modify, statenos, multiprocess, lambda s:
+            ('incorporate', self.states[s],
+                (rowid, observation, inputs)))
 
     def incorporate_bulk(self, rowids, observations, inputs=None, multiprocess=1):
-        mapper = parallel_map if multiprocess else map
         statenos = xrange(self.num_states())
-        args = [('incorporate_bulk', self.states[s],
-                (rowids, observations, inputs))
-                for s in statenos]
-        self.states = mapper(_modify, args)
+        self._modify_states(_modify, statenos, multiprocess, lambda s:
+            ('incorporate_bulk', self.states[s],
+                (rowids, observations, inputs)))
+
+    def incorporate_smc(self, rowids, observations, log_weights=None,
+            ess_threshold=.5, N=1, kernels=None, multiprocess=1):
+        """Incorporate a batch of rows treating the states as SMC particles.
+
+        Each state incorporates the batch one row at a time and is reweighted
+        by the predictive density of the batch, the product of the density of
+        each row given the earlier rows. The states are then resampled if the
+        effective sample size falls below `ess_threshold * num_states`, and
+        finally rejuvenated with N transitions of `kernels` on the new rows
+        only.
+
+        Parameters
+        ----------
+        rowids, observations : list
+            Batch of fresh rows, as for `incorporate_bulk`.
+        log_weights : list<float>, optional
+            Log weights of the states returned by the previous batch, defaults
+            to uniform weights.
+        ess_threshold : float, optional
+            Fraction of num_states under which the states are resampled. Use 1
+            to always resample, so that the states are equally weighted as
+            assumed by the other queries of the Engine.
+        N : int, optional
+            Number of rejuvenation transitions.
+        kernels : list<str>, optional
+            Rejuvenation kernels of State.transition, defaults to ['rows'].
+
+        Returns
+        -------
+        log_weights : np.array
+            Normalized log weights of the states, to pass to the next batch.
+        """
+        num_states = self.num_states()
+        log_weights = np.zeros(num_states) if log_weights is None \
+            else np.asarray(log_weights, dtype=float)
+        assert len(log_weights) == num_states
+        # Incorporate the batch and reweight by its predictive density.
+        logps = self._modify_states(
+            _incorporate_predictive, xrange(num_states), multiprocess,
+            lambda s: (self.states[s], rowids, observations), values=True)
+        log_weights = gu.log_normalize(log_weights + np.asarray(logps))
+        # Resample if the effective sample size is too low.
+        ess = np.exp(-gu.logsumexp(2*log_weights))
+        if ess < ess_threshold * num_states:
+            indexes = gu.log_pflip(
+                log_weights, size=num_states, rng=self.rng)
+            self._resample_states(indexes)
+            log_weights = np.full(num_states, -np.log(num_states))
+        # Rejuvenate the new rows.
+        if N:
+            kernels = kernels or ['rows']
+            self._modify_states(_modify, xrange(num_states), multiprocess,
+                lambda s: ('transition', self.states[s],
+                    (N, None, kernels, rowids, None, None, False)))
+        return log_weights
 
     def unincorporate(self, rowid, multiprocess=1):
-        mapper = parallel_map if multiprocess else map
         statenos = xrange(self.num_states())
-        args = [('unincorporate', self.states[s],
-                (rowid,))
-                for s in statenos]
-        self.states = mapper(_modify, args)
+        self._modify_states(_modify, statenos, multiprocess, lambda s:
+            ('unincorporate', self.states[s],
+                (rowid,)))
 
     def force_cell(self, rowid, observation, multiprocess=1):
-        mapper = parallel_map if multiprocess else map
         statenos = xrange(self.num_states())
-        args = [('force_cell', self.states[s],
-                (rowid, observation))
-                for s in statenos]
-        self.states = mapper(_modify, args)
+        self._modify_states(_modify, statenos, multiprocess, lambda s:
+            ('force_cell', self.states[s],
+                (rowid, observation)))
 
     def force_cell_bulk(self, rowids, queries, multiprocess=1):
-        mapper = parallel_map if multiprocess else map
         statenos = xrange(self.num_states())
-        args = [('force_cell_bulk', self.states[s],
-                (rowids, queries))
-                for s in statenos]
-        self.states = mapper(_modify, args)
+        self._modify_states(_modify, statenos, multiprocess, lambda s:
+            ('force_cell_bulk', self.states[s],
+                (rowids, queries)))
 
     def update_cctype(self, col, cctype, distargs=None, multiprocess=1):
-        mapper = parallel_map if multiprocess else map
         statenos = xrange(self.num_states())
-        args = [('update_cctype', self.states[s],
-                (col, cctype, distargs))
-                for s in statenos]
-        self.states = mapper(_modify, args)
+        self._modify_states(_modify, statenos, multiprocess, lambda s:
+            ('update_cctype', self.states[s],
+                (col, cctype, distargs)))
 
     def compose_cgpm(self, cgpms, multiprocess=1):
-        mapper = parallel_map if multiprocess else map
         statenos = xrange(self.num_states())
-        args = [('compose_cgpm', self.states[s], cgpms[s].to_metadata(),
-                ())
-                for s in statenos]
-        self.states = mapper(_compose, args)
+        self._modify_states(_compose, statenos, multiprocess, lambda s:
+            ('compose_cgpm', self.states[s], cgpms[s].to_metadata(),
+                ()))
 
     def logpdf(self, rowid, targets, constraints=None, inputs=None,
             accuracy=None, statenos=None, multiprocess=1):
@@ -228,37 +275,41 @@ class Engine(object):
         return logpdf_likelihoods
 
     def simulate(self, rowid, targets, constraints=None, inputs=None, N=None,
-            accuracy=None, statenos=None, multiprocess=1):
-        self._seed_states()
+            accuracy=None, statenos=None, multiprocess=1, columnar=None):
         mapper = parallel_map if multiprocess else map
         statenos = statenos or xrange(self.num_states())
-        args = [('simulate', self.states[s],
-                (rowid, targets, constraints, inputs, N, accuracy))
-                for s in statenos]
+        seeds = self._get_seeds(len(statenos))
+        args = [('simulate', self._seed_state(s, seed),
+                (rowid, targets, constraints, inputs, N, accuracy, columnar))
+                for s, seed in zip(statenos, seeds)]
         samples = mapper(_evaluate, args)
         return samples
 
     def simulate_bulk(self, rowids, targets_list, constraints_list=None,
-            inputs_list=None, Ns=None, statenos=None, multiprocess=1):
+            inputs_list=None, Ns=None, statenos=None, multiprocess=1,
+            columnar=None):
         """Returns list of simualate_bulk, one for each state."""
-        self._seed_states()
         mapper = parallel_map if multiprocess else map
         statenos = statenos or xrange(self.num_states())
-        args = [('simulate_bulk', self.states[s],
-                (rowids, targets_list, constraints_list, inputs_list, Ns))
-                for s in statenos]
+        seeds = self._get_seeds(len(statenos))
+        args = [('simulate_bulk', self._seed_state(s, seed),
+                (rowids, targets_list, constraints_list, inputs_list, Ns,
+                    columnar))
+                for s, seed in zip(statenos, seeds)]
         samples = mapper(_evaluate, args)
         return samples
 
     def mutual_information(self, col0, col1, constraints=None, T=None, N=None,
-            progress=None, statenos=None, multiprocess=1):
+            progress=None, statenos=None, multiprocess=1, joint=None,
+            control_variate=None, stderr=None):
         """Returns list of mutual information estimates, one for each state."""
-        self._seed_states()
         mapper = parallel_map if multiprocess else map
         statenos = statenos or xrange(self.num_states())
-        args = [('mutual_information', self.states[s],
-                (col0, col1, constraints, T, N, progress))
-                for s in statenos]
+        seeds = self._get_seeds(len(statenos))
+        args = [('mutual_information', self._seed_state(s, seed),
+                (col0, col1, constraints, T, N, progress, joint,
+                    control_variate, stderr))
+                for s, seed in zip(statenos, seeds)]
         mis = mapper(_evaluate, args)
         return mis
 
@@ -312,12 +363,9 @@ class Engine(object):
 
     def alter(self, funcs, statenos=None, multiprocess=1):
         """Apply generic funcs on states in parallel."""
-        mapper = parallel_map if multiprocess else map
         statenos = statenos or xrange(self.num_states())
-        args = [(funcs, self.states[s]) for s in statenos]
-        states = mapper(_alter, args)
-        for s, state in zip(statenos, states):
-            self.states[s] = state
+        self._modify_states(_alter, statenos, multiprocess, lambda s:
+            (funcs, self.states[s]))
 
     def get_state(self, index):
         return self.states[index]
@@ -328,7 +376,7 @@ class Engine(object):
     def num_states(self):
         return len(self.states)
 
-    def add_state(self, count=1, multiprocess=1, **kwargs):
+    def add_state(self, count=1, multiprocess=1, warm_start=None, **kwargs):
         mapper = parallel_map if multiprocess else map
         # XXX Temporarily disallow adding states for composite CGPM.
         if self.states[0].is_composite():
@@ -337,27 +385,95 @@ class Engine(object):
         forbidden = [ 'X', 'outputs', 'cctypes', 'distargs']
         if [f for f in forbidden if f in kwargs]:
             raise ValueError('Cannot specify arguments for: %s.' % (forbidden,))
-        X = self.states[0].data_array()
+        seeds = self._get_seeds(count)
+        # Fork the new states from the state at index warm_start.
+        if warm_start is not None:
+            if kwargs:
+                raise ValueError('Cannot specify arguments with warm_start: %s.'
+                    % (kwargs.keys(),))
+            state = self.states[warm_start]
+            new_states = [state.fork(rng=gu.gen_rng(seed)) for seed in seeds]
+            self.states.extend(new_states)
+            return
+        # Build the new states against the dataset columns of the first state.
+        X = self.states[0].share_dataset()
         kwargs['cctypes'] = self.states[0].cctypes()
         kwargs['distargs'] = self.states[0].distargs()
         kwargs['outputs'] = self.states[0].outputs
-        args = [(X, seed, kwargs) for seed in self._get_seeds(count)]
+        args = [(X, seed, kwargs) for seed in seeds]
         new_states = mapper(_intialize, args)
+        for state in new_states:
+            state._adopt_dataset(X)
         self.states.extend(new_states)
 
 
     # --------------------------------------------------------------------------
     # Internal
 
-    def _seed_states(self):
-        seeds = self._get_seeds()
-        for seed, state in zip(seeds, self.states):
-            state.rng.seed(seed)
+    def _seed_state(self, s, seed):
+        # Reseed the state at index s, assigning it back so that LazyStates
+        # keeps the seed once the state is evicted.
+        state = self.states[s]
+        state.rng.seed(seed)
+        self.states[s] = state
+        return state
+
+    def _share_dataset(self):
+        # Point the states at the dataset columns of the first state, instead
+        # of holding one copy of the dataset per state. States which are not
+        # loaded by LazyStates are skipped.
+        states = self.states.resident_states() \
+            if isinstance(self.states, binary.LazyStates) else self.states
+        if states:
+            X = states[0].share_dataset()
+            for state in states[1:]:
+                state._adopt_dataset(X)
 
     def _get_seeds(self, N=None):
         num_draws = N if N is not None else self.num_states()
         return self.rng.randint(low=1, high=2**32-1, size=num_draws)
 
+    def _resample_states(self, indexes):
+        # Replace the states by copies of states[indexes], reseeding repeated
+        # copies so that they do not evolve identically. Each resampled state
+        # keeps its index and its copies replace the states not resampled, so
+        # that only one source state is needed in memory at a time.
+        counts = np.bincount(indexes, minlength=self.num_states())
+        free = list(np.flatnonzero(counts == 0))
+        for i in np.flatnonzero(counts > 1):
+            state = self.states[i]
+            for _copy in xrange(counts[i] - 1):
+                self.states[free.pop()] = state.fork(
+                    rng=gu.gen_rng(self._get_seeds(1)[0]))
+        assert not free
+
+    def _modify_states(self, func, statenos, multiprocess, make_args,
+            values=False):
+        # Map func over the arguments make_args(s) of the states at statenos,
+        # and assign the returned states back. With values, func returns a
+        # state and a value, and the list of values is returned. States loaded
+        # lazily are mapped max_resident at a time, so that the states built
+        # from disk fit in memory. States returned by workers, or which copied
+        # columns to update them, hold their own dataset, so the states share
+        # it again after each chunk.
+        mapper = parallel_map if multiprocess else map
+        statenos = list(statenos)
+        size = len(statenos) or 1
+        if isinstance(self.states, binary.LazyStates) \
+                and self.states.max_resident is not None:
+            size = self.states.max_resident
+        results = []
+        for start in xrange(0, len(statenos), size):
+            chunk = statenos[start:start+size]
+            returned = mapper(func, [make_args(s) for s in chunk])
+            if values:
+                returned, chunk_values = zip(*returned)
+                results.extend(chunk_values)
+            for s, state in zip(chunk, returned):
+                self.states[s] = state
+            self._share_dataset()
+        return results if values else None
+
     def _likelihood_weighted_integrate(self, logpdfs, rowid, constraints=None,
             inputs=None, statenos=None, multiprocess=1):
         # Computes an importance sampling integral with likelihood weight.
@@ -374,13 +490,27 @@ class Engine(object):
             inputs=None, statenos=None, multiprocess=1):
         assert len(samples) == \
             len(self.states) if statenos is None else len(statenos)
-        assert all(len(s) == len(samples[0]) for s in samples[1:])
-        N = len(samples[0])
+        # Samples from each state are either lists of dicts, or dicts of arrays
+        # as returned by simulate with columnar=True.
+        columnar = isinstance(samples[0], dict)
+        lengths = [len(s.itervalues().next()) if columnar else len(s)
+            for s in samples]
+        assert all(n == lengths[0] for n in lengths[1:])
+        N = lengths[0]
         weights = np.zeros(len(samples)) if not constraints else \
             self.logpdf(rowid, constraints, inputs,
                 statenos=statenos, multiprocess=multiprocess)
         n_model = np.bincount(gu.log_pflip(weights, size=N, rng=self.rng))
         indexes = [self.rng.choice(N, size=n, replace=False) for n in n_model]
+        if columnar:
+            return {
+                c: np.concatenate([
+                    np.asarray(s[c])[index]
+                    for s, index in zip(samples, indexes)
+                    if len(index) > 0
+                ])
+                for c in samples[0]
+            }
         resamples = [
             [s[i] for i in index]
             for s, index in zip(samples, indexes)
@@ -394,9 +524,9 @@ class Engine(object):
     def to_metadata(self):
         metadata = dict()
         metadata['X'] = self.states[0].data_array().tolist()
-        metadata['states'] = [s.to_metadata() for s in self.states]
-        for m in metadata['states']:
-            del m['X']
+        metadata['states'] = [
+            s._to_metadata_without_data() for s in self.states
+        ]
         metadata['factory'] = ('cgpm.crosscat.engine', 'Engine')
         return metadata
 
@@ -419,12 +549,52 @@ class Engine(object):
         engine.states = mapper(
             retrieve_state,
             zip(metadata['states'], engine._get_seeds(num_states)))
+        engine._share_dataset()
         return engine
 
     def to_pickle(self, fileptr):
         metadata = self.to_metadata()
         pickle.dump(metadata, fileptr)
 
+    def to_binary(self, path):
+        metadata = dict()
+        metadata['X'] = self.states[0].data_array()
+        metadata['states'] = [
+            s._to_metadata_without_data() for s in self.states
+        ]
+        metadata['factory'] = ('cgpm.crosscat.engine', 'Engine')
+        binary.save_metadata(path, metadata)
+
+    @classmethod
+    def from_binary(cls, path, rng=None, multiprocess=1, lazy=False,
+            max_resident=None):
+        if not lazy:
+            metadata = binary.load_metadata(path)
+            return cls.from_metadata(
+                metadata, rng=rng, multiprocess=multiprocess)
+        # Build each state from disk when it is first accessed, keeping at
+        # most max_resident states built from disk in memory.
+        if rng is None:
+            rng = gu.gen_rng(0)
+        header, X, Zvs = binary.load_container(path)
+        engine = cls(X=X, num_states=0, rng=rng, multiprocess=multiprocess)
+        records = header['states']
+        seeds = engine._get_seeds(len(records))
+        # Columns of the dataset, converted once and shared by the states.
+        columns = {}
+        def retrieve_state(s):
+            metadata = binary.load_state_metadata(
+                path, s, records[s], X, Zvs[s])
+            if not columns:
+                columns.update(
+                    (c, X[:,i].tolist())
+                    for i, c in enumerate(records[s]['outputs']))
+            metadata['X'] = columns
+            return State.from_metadata(metadata, rng=gu.gen_rng(seeds[s]))
+        engine.states = binary.LazyStates(
+            retrieve_state, len(records), max_resident=max_resident)
+        return engine
+
     @classmethod
     def from_pickle(cls, fileptr, rng=None):
         if isinstance(fileptr, str):
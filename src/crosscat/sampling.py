@@ -20,8 +20,6 @@ cgpm.crosscat, avoiding overhead of recursive implementations using the
 importance network on the sub-cgpms that comprise cgpm.crosscat.State.
 '''
 
-from itertools import chain
-
 import numpy as np
 
 from cgpm.primitives.crp import Crp
@@ -30,10 +28,15 @@ from cgpm.utils.general import log_normalize
 from cgpm.utils.general import log_pflip
 from cgpm.utils.general import logsumexp
 from cgpm.utils.general import merged
+from cgpm.utils.general import rows_from_columns
 
 from cgpm.utils.validation import partition_query_evidence
 
 
+# Maximum number of constraint signatures cached per view.
+LP_CLUSTER_CACHE_SIZE = 1024
+
+
 def state_logpdf(state, rowid, targets, constraints=None):
     targets_lookup, constraints_lookup = partition_query_evidence(
         state.Zv(), targets, constraints)
@@ -49,12 +52,47 @@ def state_logpdf(state, rowid, targets, constraints=None):
     return sum(logps)
 
 
+def state_logpdf_bulk(state, rowids, targets_list, constraints_list):
+    """Return array of logpdf of many queries, batching the observed rows.
+
+    Queries about observed rows do not depend on the constraints, so all the
+    targets of a given column that fall in the same cluster are evaluated
+    with a single vectorized call to the cached predictive of that cluster.
+    The remaining queries about hypothetical rows use `state_logpdf`.
+    """
+    logps = np.zeros(len(rowids))
+    groups = {}
+    for i, (rowid, targets, constraints) in \
+            enumerate(zip(rowids, targets_list, constraints_list)):
+        if state.hypothetical(rowid):
+            logps[i] = state_logpdf(state, rowid, targets, constraints)
+            continue
+        for c, x in targets.iteritems():
+            k = state.views[state.Zv(c)].Zr(rowid)
+            indexes, values = groups.setdefault((c, k), ([], []))
+            indexes.append(i)
+            values.append(x)
+    for (c, k), (indexes, values) in groups.iteritems():
+        view = state.views[state.Zv(c)]
+        lp = view.dims[c].logpdf_array(values, {view.outputs[0]: k})
+        np.add.at(logps, indexes, lp)
+    return logps
+
+
 def state_simulate(state, rowid, targets, constraints=None, N=None):
+    N_sim = N if N is not None else 1
+    columns = state_simulate_array(state, rowid, targets, constraints, N_sim)
+    samples = rows_from_columns(columns)
+    return samples if N is not None else samples[0]
+
+
+def state_simulate_array(state, rowid, targets, constraints=None, N=None):
+    """Return dict mapping each target to an array of N samples."""
     targets_lookup, constraints_lookup = partition_query_evidence(
         state.Zv(), targets, constraints)
     N_sim = N if N is not None else 1
     draws = (
-        view_simulate(
+        view_simulate_array(
             view=state.views[v],
             rowid=rowid,
             targets=targets_lookup[v],
@@ -63,28 +101,51 @@ def state_simulate(state, rowid, targets, constraints=None, N=None):
         )
         for v in targets_lookup
     )
-    samples = [merged(*l) for l in zip(*draws)]
-    return samples if N is not None else samples[0]
+    return merged(*draws)
 
 
 def view_logpdf(view, rowid, targets, constraints):
     if not view.hypothetical(rowid):
         return _logpdf_row(view, targets, view.Zr(rowid))
-    Nk = view.Nk()
-    N_rows = len(view.Zr())
-    K = view.crp.clusters[0].gibbs_tables(-1)
-    lp_crp = [Crp.calc_predictive_logp(k, N_rows, Nk, view.alpha()) for k in K]
-    lp_constraints = [_logpdf_row(view, constraints, k) for k in K]
-    if all(np.isinf(lp_constraints)):
-        raise ValueError('Zero density constraints: %s' % (constraints,))
-    lp_cluster = log_normalize(np.add(lp_crp, lp_constraints))
+    K, lp_cluster = view_cluster_weights(view, constraints)
     lp_targets = [_logpdf_row(view, targets, k) for k in K]
     return logsumexp(np.add(lp_cluster, lp_targets))
 
 
 def view_simulate(view, rowid, targets, constraints, N):
+    columns = view_simulate_array(view, rowid, targets, constraints, N)
+    return rows_from_columns(columns)
+
+
+def view_simulate_array(view, rowid, targets, constraints, N):
     if not view.hypothetical(rowid):
         return _simulate_row(view, targets, view.Zr(rowid), N)
+    K, lp_cluster = view_cluster_weights(view, constraints)
+    ks = np.asarray(log_pflip(lp_cluster, array=K, size=N, rng=view.rng))
+    # Sample each cluster in one batch, then restore the order of the draws.
+    clusters = np.unique(ks)
+    indexes = [np.flatnonzero(ks == k) for k in clusters]
+    draws = [_simulate_row(view, targets, k, len(index))
+        for k, index in zip(clusters, indexes)]
+    order = np.argsort(np.concatenate(indexes))
+    return {
+        c: np.concatenate([d[c] for d in draws])[order]
+        for c in targets
+    }
+
+
+def view_cluster_weights(view, constraints):
+    """Return tables and normalized log posterior of a hypothetical row.
+
+    The weights depend only on the row CRP and on the Dims of the constrained
+    columns, so they are cached under the constraints together with the
+    versions of these Dims, and recomputed once any of the versions changes.
+    """
+    key = tuple(sorted(constraints.iteritems()))
+    versions = (view.crp.version,) + tuple(view.dims[c].version for c, _x in key)
+    cached = view.lp_cluster_cache.get(key)
+    if cached is not None and cached[0] == versions:
+        return cached[1], cached[2]
     Nk = view.Nk()
     N_rows = len(view.Zr())
     K = view.crp.clusters[0].gibbs_tables(-1)
@@ -92,11 +153,11 @@ def view_simulate(view, rowid, targets, constraints, N):
     lp_constraints = [_logpdf_row(view, constraints, k) for k in K]
     if all(np.isinf(lp_constraints)):
         raise ValueError('Zero density constraints: %s' % (constraints,))
-    lp_cluster = np.add(lp_crp, lp_constraints)
-    ks = log_pflip(lp_cluster, array=K, size=N, rng=view.rng)
-    counts = {k:n for k,n in enumerate(np.bincount(ks)) if n > 0}
-    samples = (_simulate_row(view, targets, k, counts[k]) for k in counts)
-    return chain.from_iterable(samples)
+    lp_cluster = log_normalize(np.add(lp_crp, lp_constraints))
+    if len(view.lp_cluster_cache) >= LP_CLUSTER_CACHE_SIZE:
+        view.lp_cluster_cache.clear()
+    view.lp_cluster_cache[key] = (versions, K, lp_cluster)
+    return K, lp_cluster
 
 
 def _logpdf_row(view, targets, cluster):
@@ -108,9 +169,8 @@ def _logpdf_row(view, targets, cluster):
 
 
 def _simulate_row(view, targets, cluster, N):
-    """Return sample of the targets in a fixed cluster."""
-    samples = (
-        view.dims[c].simulate(None, [c], None, {view.outputs[0]: cluster}, N)
+    """Return arrays of N samples of the targets in a fixed cluster."""
+    return {
+        c: view.dims[c].simulate_array(None, N, {view.outputs[0]: cluster})
         for c in targets
-    )
-    return (merged(*l) for l in zip(*samples))
+    }
@@ -28,6 +28,7 @@ from math import isnan
 import numpy as np
 
 from cgpm.cgpm import CGpm
+from cgpm.crosscat import binary
 from cgpm.crosscat import sampling
 from cgpm.mixtures.dim import Dim
 from cgpm.mixtures.view import View
@@ -48,7 +49,7 @@ class State(CGpm):
             self, X, outputs=None, inputs=None, cctypes=None,
             distargs=None, Zv=None, Zrv=None, alpha=None, view_alphas=None,
             hypers=None, Cd=None, Ci=None, Rd=None, Ri=None, diagnostics=None,
-            loom_path=None, rng=None):
+            loom_path=None, suffstats=None, rng=None):
         # -- Seed --------------------------------------------------------------
         self.rng = gu.gen_rng() if rng is None else rng
 
@@ -58,16 +59,29 @@ class State(CGpm):
         self.inputs = []
 
         # -- Dataset and outputs -----------------------------------------------
-        X = np.asarray(X)
-        if not outputs:
-            outputs = range(X.shape[1])
+        if isinstance(X, dict):
+            # Columns of another State, see `share_dataset`.
+            if not outputs:
+                outputs = X.keys()
+            else:
+                assert set(outputs) == set(X)
+                assert all(o >= 0 for o in outputs)
+            self.set_outputs(outputs)
+            self.X = OrderedDict((c, X[c]) for c in self.outputs)
+            self.X_shared = set(self.outputs)
         else:
-            assert len(outputs) == X.shape[1]
-            assert all(o >= 0 for o in outputs)
-        self.set_outputs(outputs)
-        self.X = OrderedDict()
-        for i, c in enumerate(self.outputs):
-            self.X[c] = X[:,i].tolist()
+            X = np.asarray(X)
+            if not outputs:
+                outputs = range(X.shape[1])
+            else:
+                assert len(outputs) == X.shape[1]
+                assert all(o >= 0 for o in outputs)
+            self.set_outputs(outputs)
+            self.X = OrderedDict()
+            for i, c in enumerate(self.outputs):
+                self.X[c] = X[:,i].tolist()
+            # Columns of X whose list is shared with a fork, see `fork`.
+            self.X_shared = set()
 
         # -- Column CRP --------------------------------------------------------
         # Retrieve the dependence constraints.
@@ -109,18 +123,13 @@ class State(CGpm):
                     # the exchangeable version of the constrained crp.
                     Zv = gu.simulate_crp_constrained_dependent(
                         self.n_cols(), self.alpha(), self.Cd, self.rng)
-                # Incorporate hte the data.
-                for c, z in zip(self.outputs, Zv):
-                    self.crp.incorporate(c, {self.crp_id: z}, {-1:0})
             # Otherwise simulate an unconstrained CRP.
             else:
-                for c in self.outputs:
-                    z = self.crp.simulate(c, [self.crp_id], None, {-1:0})
-                    self.crp.incorporate(c, z, {-1:0})
-        # Load the provided Zv without simulation.
-        else:
-            for c, z in Zv.iteritems():
-                self.crp.incorporate(c, {self.crp_id: z}, {-1:0})
+                Zv = gu.simulate_crp_array(
+                    self.n_cols(), self.alpha(), rng=self.rng)
+            Zv = OrderedDict(zip(self.outputs, Zv))
+        # Incorporate the column partition.
+        self.crp.incorporate_array(Zv.keys(), Zv.values(), [0]*len(Zv))
 
         assert len(self.Zv()) == len(self.outputs)
 
@@ -128,6 +137,7 @@ class State(CGpm):
         cctypes = cctypes or [None] * len(self.outputs)
         distargs = distargs or [None] * len(self.outputs)
         hypers = hypers or [None] * len(self.outputs)
+        suffstats = suffstats or [None] * len(self.outputs)
         view_alphas = view_alphas or {}
 
         # If the user specifies Zrv, then the keys of Zrv must match the views
@@ -145,6 +155,7 @@ class State(CGpm):
             v_cctypes = [cctypes[self.outputs.index(c)] for c in v_outputs]
             v_distargs = [distargs[self.outputs.index(c)] for c in v_outputs]
             v_hypers = [hypers[self.outputs.index(c)] for c in v_outputs]
+            v_suffstats = [suffstats[self.outputs.index(c)] for c in v_outputs]
             view = View(
                 self.X,
                 outputs=[self.crp_id_view+v] + v_outputs,
@@ -154,6 +165,7 @@ class State(CGpm):
                 cctypes=v_cctypes,
                 distargs=v_distargs,
                 hypers=v_hypers,
+                suffstats=v_suffstats,
                 rng=self.rng
             )
             self.views[v] = view
@@ -265,14 +277,9 @@ class State(CGpm):
             raise ValueError('Only contiguous rowids supported: %d' % (rowid,))
         if inputs:
             raise ValueError('Cannot incorporate with inputs: %s' % inputs)
-        valid_clusters = set([self.views[v].outputs[0] for v in self.views])
-        query_clusters = [q for q in observation if q in valid_clusters]
-        query_outputs = [q for q in observation if q not in query_clusters]
-        if not all(q in self.outputs for q in query_outputs):
-            raise ValueError('Invalid observation: %s' % observation)
-        if any(isnan(v) for v in observation.values()):
-            raise ValueError('Cannot incorporate nan: %s.' % observation)
+        self._validate_observation(observation)
         # Append the observation to dataset.
+        self._own_columns(self.outputs)
         for c in self.outputs:
             self.X[c].append(observation.get(c, float('nan')))
         # Pick a fresh rowid.
@@ -297,6 +304,7 @@ class State(CGpm):
         if self.n_rows() == 1:
             raise ValueError('Cannot unincorporate last rowid.')
         # Remove the observation from the dataset.
+        self._own_columns(self.outputs)
         for c in self.outputs:
             self.X[c].pop()
         # Tell the views.
@@ -311,6 +319,7 @@ class State(CGpm):
             raise ValueError('Force observation requires existing rowid.')
         if not all(np.isnan(self.X[c][rowid]) for c in observation):
             raise ValueError('Force observations requires NaN cells.')
+        self._own_columns(observation.keys())
         for col, value in observation.iteritems():
             self.X[col][rowid] = value
         queries = vu.partition_list(
@@ -405,15 +414,22 @@ class State(CGpm):
     # Simulate
 
     def simulate(self, rowid, targets, constraints=None, inputs=None,
-            N=None, accuracy=None):
+            N=None, accuracy=None, columnar=None):
         assert isinstance(targets, (list, tuple))
         assert inputs is None or isinstance(inputs, dict)
         self._validate_cgpm_query(rowid, targets, constraints)
         if not self._composite:
             assert not inputs
+            if columnar:
+                return sampling.state_simulate_array(
+                    self, rowid, targets, constraints, N)
             return sampling.state_simulate(self, rowid, targets, constraints, N)
         constraints = self._populate_constraints(rowid, targets, constraints)
         network = self.build_network(accuracy=accuracy)
+        if columnar:
+            N_sim = N if N is not None else 1
+            samples = network.simulate(rowid, targets, constraints, inputs, N_sim)
+            return gu.columns_from_rows(samples)
         return network.simulate(rowid, targets, constraints, inputs, N)
 
     # --------------------------------------------------------------------------
@@ -444,6 +460,15 @@ class State(CGpm):
         }
         return gu.merged(constraints, data)
 
+    def _validate_observation(self, observation):
+        valid_clusters = set([self.views[v].outputs[0] for v in self.views])
+        query_clusters = [q for q in observation if q in valid_clusters]
+        query_outputs = [q for q in observation if q not in query_clusters]
+        if not all(q in self.outputs for q in query_outputs):
+            raise ValueError('Invalid observation: %s' % observation)
+        if any(isnan(v) for v in observation.values()):
+            raise ValueError('Cannot incorporate nan: %s.' % observation)
+
     def _validate_cgpm_query(self, rowid, targets, constraints):
         # Is the rowid fresh?
         fresh = self.hypothetical(rowid)
@@ -479,7 +504,7 @@ class State(CGpm):
     # Bulk operations for multiprocessing performance.
 
     def simulate_bulk(self, rowids, targets_list, constraints_list=None,
-            inputs_list=None, Ns=None):
+            inputs_list=None, Ns=None, columnar=None):
         """Evaluate multiple queries at once, used by Engine."""
         if constraints_list is None:
             constraints_list = [{} for i in xrange(len(rowids))]
@@ -492,7 +517,7 @@ class State(CGpm):
         assert len(rowids) == len(inputs_list)
         assert len(rowids) == len(Ns)
         return [
-            self.simulate(r, t, c, i, n)
+            self.simulate(r, t, c, i, n, columnar=columnar)
             for (r, t, c, i, n) in zip(
                 rowids,
                 targets_list,
@@ -512,6 +537,14 @@ class State(CGpm):
         assert len(rowids) == len(targets_list)
         assert len(rowids) == len(constraints_list)
         assert len(rowids) == len(inputs_list)
+        if not self._composite and not any(inputs_list):
+            for (r, t, c) in zip(rowids, targets_list, constraints_list):
+                assert isinstance(t, dict)
+                assert c is None or isinstance(c, dict)
+                self._validate_cgpm_query(r, t, c)
+            constraints_list = [c or {} for c in constraints_list]
+            return list(sampling.state_logpdf_bulk(
+                self, rowids, targets_list, constraints_list))
         return [
             self.logpdf(r, t, c, i)
             for (r, t, c, i) in zip(
@@ -523,9 +556,38 @@ class State(CGpm):
         ]
 
     def incorporate_bulk(self, rowids, observations, inputs=None):
-        """Incorporate multiple observations at once, used by Engine."""
-        for rowid, observation in zip(rowids, observations):
-            self.incorporate(rowid, observation, inputs)
+        """Incorporate multiple observations at once, used by Engine.
+
+        The rows are appended to the dataset as one block, and each View
+        assigns clusters to the whole block with `View.incorporate_bulk`.
+        """
+        if self._composite or inputs or len(rowids) == 0:
+            for rowid, observation in zip(rowids, observations):
+                self.incorporate(rowid, observation, inputs)
+            return
+        n_rows = self.n_rows()
+        if list(rowids) != range(n_rows, n_rows + len(rowids)):
+            raise ValueError('Only contiguous rowids supported: %s' % (rowids,))
+        for observation in observations:
+            self._validate_observation(observation)
+        # Append the observations to dataset.
+        self._own_columns(self.outputs)
+        for c in self.outputs:
+            self.X[c].extend(
+                obs.get(c, float('nan')) for obs in observations)
+        # Tell the views.
+        for v in self.views:
+            view = self.views[v]
+            crp_v = view.outputs[0]
+            observations_v = [
+                gu.merged(
+                    {crp_v: observation[crp_v]} if crp_v in observation else {},
+                    {d: self.X[d][rowid] for d in view.dims})
+                for rowid, observation in zip(rowids, observations)
+            ]
+            view.incorporate_bulk(rowids, observations_v)
+        # Validate.
+        self._check_partitions()
 
     def force_cell_bulk(self, rowids, queries):
         """Force multiple cell values at once, used by Engine."""
@@ -611,6 +673,7 @@ class State(CGpm):
         rowid_hypothetical = range(
             self.n_rows(), self.n_rows() + len(hypotheticals))
         # Incorporate hypothetical rows.
+        self._own_columns(view.dims.keys() if hypotheticals else [])
         for rowid, query in zip(rowid_hypothetical, hypotheticals):
             for d in view.dims:
                 self.X[d].append(query[d])
@@ -632,7 +695,7 @@ class State(CGpm):
     # Mutual information
 
     def mutual_information(self, col0, col1, constraints=None, T=None, N=None,
-            progress=None):
+            progress=None, joint=None, control_variate=None, stderr=None):
         if constraints is None:
             constraints = dict()
         # Disallow duplicated variables in constraints and targets.
@@ -644,66 +707,120 @@ class State(CGpm):
         # Partition the query into independent blocks.
         blocks = self._partition_mutual_information_query(
             col0, col1, constraints)
-        return sum(
-            self._compute_mutual_information(c0, c1, const, T, N, progress)
+        estimates = [
+            self._compute_mutual_information(
+                c0, c1, const, T, N, progress, joint, control_variate)
             for c0, c1, const in blocks
             if c0 and c1
-        )
+        ]
+        # Estimates from independent blocks add, and so do their variances.
+        mi = sum(e[0] for e in estimates)
+        se = np.sqrt(sum(e[1]**2 for e in estimates))
+        return (mi, se) if stderr else mi
 
     def _compute_mutual_information(self, col0, col1, constraints, T=None,
-            N=None, progress=None):
+            N=None, progress=None, joint=None, control_variate=None):
         N = N or 100
         T = T or 100
         # Partition constraints into equality (e) and marginalization (m) forms.
         e_constraints = {e:x for e,x in constraints.iteritems() if x is not None}
         m_constraints = [e for e,x in constraints.iteritems() if x is None]
         # Determine the estimator to use.
-        estimator = self._compute_mi if set(col0) != set(col1) \
-            else self._compute_entropy
+        entropy = set(col0) == set(col1)
+        estimator = self._compute_mi if not entropy else self._compute_entropy
         # No marginalization constraints.
         if not m_constraints:
-            return estimator(col0, col1, constraints, N)
+            terms = estimator(col0, col1, constraints, N)
+            return self._mean_stderr(terms, entropy, control_variate)
+        # Compute CMI by jointly sampling constraints and targets.
+        if joint:
+            return self._compute_mutual_information_joint(
+                col0, col1, e_constraints, m_constraints, T, control_variate)
         # Compute CMI by Monte Carlo.
         def compute_one(i, sample):
             const = gu.merged(e_constraints, sample)
-            m = estimator(col0, col1, const, N)
+            m = np.mean(estimator(col0, col1, const, N))
             if progress:
                 self._progress(float(i)/T)
             return m
         if progress:
             self._progress(0./T)
         m_samples = self.simulate(None, m_constraints, N=T)
-        mi = sum(compute_one(i, samp) for i, samp in enumerate(m_samples))
-        return mi / float(T)
+        mis = [compute_one(i, samp) for i, samp in enumerate(m_samples)]
+        return self._mean_stderr(mis, True, False)
+
+    def _compute_mutual_information_joint(self, col0, col1, e_constraints,
+            m_constraints, T, control_variate):
+        # Draw T samples of (constraints, targets) in one simulate call, then
+        # score each target sample under its own sampled constraint, so each
+        # constraint sample contributes one term rather than an inner estimate.
+        entropy = set(col0) == set(col1)
+        targets = col0 if entropy else col0 + col1
+        samples = self.simulate(
+            None, m_constraints + targets, e_constraints, None, T)
+        constraints_list = [
+            gu.merged(e_constraints, {m: s[m] for m in m_constraints})
+            for s in samples
+        ]
+        targets_list = [{t: s[t] for t in targets} for s in samples]
+        terms = self._compute_entropy_terms(col0, targets_list, constraints_list)\
+            if entropy else \
+            self._compute_mi_terms(col0, col1, targets_list, constraints_list)
+        return self._mean_stderr(terms, entropy, control_variate)
 
     def _compute_mi(self, col0, col1, constraints, N):
         samples = self.simulate(None, col0 + col1, constraints, None, N)
+        return self._compute_mi_terms(col0, col1, samples, [constraints]*N)
+
+    def _compute_entropy(self, col0, col1, constraints, N):
+        assert set(col0) == set(col1)
+        samples = self.simulate(-1, col0, constraints, None, N)
+        return self._compute_entropy_terms(col0, samples, [constraints]*N)
+
+    def _compute_mi_terms(self, col0, col1, samples, constraints_list):
+        """Return log p(x,y|z) - log p(x|z) - log p(y|z) for each sample."""
+        N = len(samples)
         PXY = self.logpdf_bulk(
             rowids=[-1]*N,
             targets_list=samples,
-            constraints_list=[constraints]*N
+            constraints_list=constraints_list,
         )
         PX = self.logpdf_bulk(
             rowids=[-1]*N,
             targets_list=[{c0: s[c0] for c0 in col0} for s in samples],
-            constraints_list=[constraints]*N,
+            constraints_list=constraints_list,
         )
         PY = self.logpdf_bulk(
             rowids=[-1]*N,
             targets_list=[{c1: s[c1] for c1 in col1} for s in samples],
-            constraints_list=[constraints]*N,
+            constraints_list=constraints_list,
         )
-        return (np.sum(PXY) - np.sum(PX) - np.sum(PY)) / N
+        return np.subtract(PXY, np.add(PX, PY))
 
-    def _compute_entropy(self, col0, col1, constraints, N):
-        assert set(col0) == set(col1)
-        samples = self.simulate(-1, col0, constraints, None, N)
+    def _compute_entropy_terms(self, col0, samples, constraints_list):
+        """Return -log p(x|z) for each sample."""
+        N = len(samples)
         PX = self.logpdf_bulk(
             rowids=[-1]*N,
             targets_list=[{c0: s[c0] for c0 in col0} for s in samples],
-            constraints_list=[constraints]*N,
+            constraints_list=constraints_list,
         )
-        return -np.sum(PX) / N
+        return np.negative(PX)
+
+    @staticmethod
+    def _mean_stderr(terms, entropy, control_variate):
+        """Return Monte Carlo mean and standard error of the terms."""
+        terms = np.asarray(terms, dtype=float)
+        n = len(terms)
+        # The ratio p(x|z)p(y|z)/p(x,y|z) = exp(-term) has expectation one
+        # under the joint, so it serves as a control variate for the MI terms.
+        if control_variate and not entropy and n > 1:
+            ratios = np.exp(-terms)
+            cov = np.cov(terms, ratios)
+            if cov[1,1] > 0:
+                terms = terms - (cov[0,1] / cov[1,1]) * (ratios - 1.)
+        stderr = np.std(terms, ddof=1) / np.sqrt(n) if n > 1 else 0.
+        return np.mean(terms), stderr
 
     def _partition_mutual_information_query(self, col0, col1, constraints):
         cgpms = self.build_cgpms()
@@ -721,6 +838,64 @@ class State(CGpm):
             blocks[component][2][variable] = constraints[variable]
         return blocks.values()
 
+    # --------------------------------------------------------------------------
+    # Fork
+
+    def fork(self, rng=None):
+        """Return a copy of the State which shares its dataset.
+
+        The columns of the dataset, and the data recorded in each cluster, are
+        shared until either copy updates them; the partitions, hyperparameters
+        and sufficient statistics are copied. The fork uses a copy of the
+        entropy source by default, as `copy.deepcopy`. States with composed
+        cgpms are deep copied.
+        """
+        rng = copy.deepcopy(self.rng) if rng is None else rng
+        if self.hooked_cgpms:
+            state = copy.deepcopy(self)
+            state.rng = rng
+            return state
+        state = copy.copy(self)
+        state.rng = rng
+        state.set_outputs(self.outputs)
+        state.X = OrderedDict(self.X)
+        state.X_shared = set(self.X)
+        self.X_shared.update(self.X)
+        state.Cd = copy.deepcopy(self.Cd)
+        state.Ci = copy.deepcopy(self.Ci)
+        state.crp = self.crp.fork(rng)
+        state.views = OrderedDict(
+            (v, view.fork(state.X, rng)) for v, view in self.views.iteritems())
+        state.token_generator = copy.copy(self.token_generator)
+        state.hooked_cgpms = dict()
+        state.diagnostics = defaultdict(list, {
+            key: copy.copy(value)
+            for key, value in self.diagnostics.iteritems()
+        })
+        return state
+
+    def share_dataset(self):
+        """Return the columns of the dataset, to construct States sharing them.
+
+        As with `fork`, either State copies a column before changing it.
+        """
+        self.X_shared.update(self.X)
+        return OrderedDict(self.X)
+
+    def _adopt_dataset(self, X):
+        # Replace the columns of the dataset by the equal columns X, returned
+        # by `share_dataset` of another State.
+        for c in self.X:
+            assert len(X[c]) == len(self.X[c])
+            self.X[c] = X[c]
+        self.X_shared.update(self.X)
+
+    def _own_columns(self, cols):
+        # Copy the columns of the dataset which are shared with a fork.
+        for c in self.X_shared.intersection(cols):
+            self.X[c] = list(self.X[c])
+        self.X_shared.difference_update(cols)
+
     # --------------------------------------------------------------------------
     # Inference
 
@@ -1042,10 +1217,10 @@ class State(CGpm):
     def _dim_get_proposal(self, view, dim):
         """Get a dim object propose to the view."""
         # If collapsed dim, reuse the dim object. Otherwise uncollapsed dim,
-        # create copy to preserve uncollapsed state (can optimize).
+        # fork it to preserve uncollapsed state.
         if dim.is_collapsed() or self._dim_is_member(view, dim):
             return dim
-        return copy.deepcopy(dim)
+        return dim.fork()
 
     def _gibbs_transition_dim(self, col, m):
         """Gibbs on col assignment to Views, with m auxiliary parameters"""
@@ -1187,10 +1362,14 @@ class State(CGpm):
     # Serialize
 
     def to_metadata(self):
+        metadata = self._to_metadata_without_data()
+        metadata['X'] = self.data_array().tolist()
+        return metadata
+
+    def _to_metadata_without_data(self, suffstats=True):
         metadata = dict()
 
         # Dataset.
-        metadata['X'] = self.data_array().tolist()
         metadata['outputs'] = self.outputs
 
         # View partition data.
@@ -1201,7 +1380,8 @@ class State(CGpm):
         metadata['cctypes'] = []
         metadata['hypers'] = []
         metadata['distargs'] = []
-        metadata['suffstats'] = []
+        if suffstats:
+            metadata['suffstats'] = []
         for dim in self.dims():
             metadata['cctypes'].append(dim.cctype)
             metadata['hypers'].append(dim.hypers)
@@ -1209,7 +1389,8 @@ class State(CGpm):
             # distargs['inputs']['indexes']; instead create a separate metadata
             # entry for the dimension inputs.
             metadata['distargs'].append(dim.distargs)
-            metadata['suffstats'].append(dim.get_suffstats().items())
+            if suffstats:
+                metadata['suffstats'].append(dim.get_suffstats().items())
 
         # Dependence constraints.
         metadata['Cd'] = self.Cd
@@ -1243,14 +1424,25 @@ class State(CGpm):
         metadata = self.to_metadata()
         pickle.dump(metadata, fileptr)
 
+    def to_binary(self, path):
+        metadata = self._to_metadata_without_data()
+        metadata['X'] = self.data_array()
+        binary.save_metadata(path, metadata)
+
     @classmethod
     def from_metadata(cls, metadata, rng=None):
         if rng is None:
             rng = gu.gen_rng(0)
         to_dict = lambda val: None if val is None else dict(val)
-        # Build the State.
+        # Restore the clusters from their sufficient statistics, which are
+        # only valid for the saved row partitions.
+        suffstats = None
+        if metadata.get('Zrv') is not None and 'suffstats' in metadata:
+            suffstats = [to_dict(stats) for stats in metadata['suffstats']]
+        # Build the State, sharing the columns of the dataset if given.
+        X = metadata['X']
         state = cls(
-            np.asarray(metadata['X']),
+            X if isinstance(X, dict) else np.asarray(X),
             outputs=metadata.get('outputs', None),
             cctypes=metadata.get('cctypes', None),
             distargs=metadata.get('distargs', None),
@@ -1259,6 +1451,7 @@ class State(CGpm):
             Zrv=to_dict(metadata.get('Zrv', None)),
             view_alphas=to_dict(metadata.get('view_alphas', None)),
             hypers=metadata.get('hypers', None),
+            suffstats=suffstats,
             Cd=metadata.get('Cd', None),
             Ci=metadata.get('Ci', None),
             diagnostics=metadata.get('diagnostics', None),
@@ -1274,6 +1467,11 @@ class State(CGpm):
             state.compose_cgpm(cgpm)
         return state
 
+    @classmethod
+    def from_binary(cls, path, rng=None):
+        metadata = binary.load_metadata(path)
+        return cls.from_metadata(metadata, rng=rng)
+
     @classmethod
     def from_pickle(cls, fileptr, rng=None):
         if isinstance(fileptr, str):
@@ -20,8 +20,10 @@ def load_docstrings(module):
 
         Parameters
         ----------
-        X : np.ndarray
+        X : np.ndarray or dict{int:list}
             Data matrix, each row is an observation and each column a variable.
+            Alternatively, the columns returned by `share_dataset` of another
+            State, which are shared rather than copied.
         outputs : list<int>, optional
             Unique non-negative ID for each column in X, and used to refer to
             the column for all future queries. Defaults to range(0, X.shape[1])
@@ -133,6 +135,37 @@ def load_docstrings(module):
     """
 
 
+    # --------------------------------------------------------------------------
+    # Simulate
+
+    module.State.simulate.__func__.__doc__ = """
+        Simulate the targets, optionally given constraints.
+
+        Parameters
+        ----------
+        rowid : int
+            Identifier of an observed row, or a hypothetical rowid such as -1.
+        targets : list<int>
+            Output variables to simulate.
+        constraints : dict{int:value}, optional
+            Values of output variables to condition on.
+        inputs : dict{int:value}, optional
+            Values of the input variables of composed cgpms.
+        N : int, optional
+            Number of samples. If None then a single sample is returned rather
+            than a list of samples.
+        accuracy : int, optional
+            Number of importance samples used by composite states.
+        columnar : bool, optional
+            If True, return a dict mapping each target to a numpy array of
+            samples, instead of a list of dicts. When N is None, the arrays
+            have length one. Avoids constructing a dict per sample.
+
+        Returns
+        -------
+        samples : list<dict> or dict or dict{int:np.ndarray}
+        """
+
     # --------------------------------------------------------------------------
     # logpdf_score
 
@@ -173,11 +206,23 @@ def load_docstrings(module):
             Number of samples to use in the outer (marginalization) estimator.
         N : int, optional.
             Number of samples to use in the inner Monte Carlo estimator.
+        joint : bool, optional.
+            If True, the marginalized constraints and the targets are sampled
+            jointly in one batch of size `T`, and each target sample is scored
+            under its own constraint sample, which replaces the T nested
+            estimators of size `N`. Defaults to False.
+        control_variate : bool, optional.
+            If True, reduce the variance of the mutual information estimate
+            using the control variate p(x|z)p(y|z)/p(x,y|z), whose expectation
+            under the joint is one. Not used for entropy.
+        stderr : bool, optional.
+            If True, also return the Monte Carlo standard error.
 
         Returns
         -------
         mi : float
-            A point estimate of the mutual information.
+            A point estimate of the mutual information. If `stderr` is True,
+            then the tuple (mi, stderr) is returned instead.
 
         Examples
         -------
@@ -189,6 +234,9 @@ def load_docstrings(module):
         >>> State.mutual_information(col_x, col_y, {col_w:None})
         # Compute MI(X:Y|Z=1, W)
         >>> State.mutual_information(col_x, col_y, {col_z: 1, col_w:None})
+        # Compute MI(X:Y|W) by joint sampling, with its standard error.
+        >>> State.mutual_information(
+        ...     col_x, col_y, {col_w:None}, T=1000, joint=True, stderr=True)
         """
 
     # --------------------------------------------------------------------------
@@ -25,6 +25,17 @@ from cgpm.utils import general as gu
 from cgpm.utils import mvnormal as multivariate_normal
 
 
+# Convergence tolerance on the log likelihood, and maximum iterations, of EM.
+EM_TOL = 1e-2
+EM_MAX_ITER = 1000
+
+# Number of old rows refreshed by each iteration of an incremental transition.
+EM_BATCH_SIZE = 100
+
+# Lower bound on the noise variances, relative to the data variances.
+MIN_NOISE = 1e-6
+
+
 class FactorAnalysis(CGpm):
     """Factor analysis model with continuous latent variables z in a low
     dimensional space. The generative model for a vector x is
@@ -68,6 +79,12 @@ class FactorAnalysis(CGpm):
     conditioning directly on the joint [z,x] using Schur complement
     (Hint: see test suite).
 
+    The parameters are learned by EM over the observed entries of each row
+    (Ghahramani and Hinton 1996; Neal and Hinton 1998), where the E-step is
+    the posterior z|x_obs from the joint [z,x]. The expected sufficient
+    statistics of each row are kept across transitions, so that a
+    transition may refresh only the new rows and a minibatch of old ones.
+
     The latent variables are exposed as output variables, but may not be
     incorporated.
     """
@@ -128,6 +145,15 @@ class FactorAnalysis(CGpm):
         self.W = np.asarray(W)
         # Parameters of joint distribution [x,z].
         self.mu, self.cov = self.joint_parameters()
+        # Conditional distributions by (query, evidence) indexes.
+        self._conditionals = {}
+        # Posterior expectations E[z'], E[z'z'^T] of each row for z' = [z,1],
+        # and their expected sufficient statistics for each observable.
+        self._expectations = {}
+        self._stats_zz = np.zeros((D, L+1, L+1))
+        self._stats_xz = np.zeros((D, L+1))
+        self._stats_xx = np.zeros(D)
+        self._stats_n = np.zeros(D)
         # Internal factor analysis model.
         self.fa = None
 
@@ -155,52 +181,59 @@ class FactorAnalysis(CGpm):
         self.N += 1
 
     def unincorporate(self, rowid):
-        try:
-            del self.data[rowid]
-        except KeyError:
+        if rowid not in self.data:
             raise ValueError('No such observation: %d.' % rowid)
+        if rowid in self._expectations:
+            self._update_stats(rowid, -1)
+            del self._expectations[rowid]
+        del self.data[rowid]
         self.N -= 1
 
     def logpdf(self, rowid, targets, constraints=None, inputs=None):
-        # XXX Deal with observed rowid.
-        constraints = self.populate_constraints(rowid, targets, constraints)
-        if inputs:
-            raise ValueError('Prohibited inputs: %s' % (inputs,))
-        if not targets:
-            raise ValueError('No targets: %s' % (targets,))
-        if any(q not in self.outputs for q in targets):
-            raise ValueError('Unknown targets: %s' % (targets,))
-        if any(q in constraints for q in targets):
-            raise ValueError('Duplicate variable: %s, %s'
-                % (targets, constraints,))
-        # Reindex variables.
-        targets_r = self.reindex(targets)
-        constraints_r = self.reindex(constraints)
-        # Retrieve conditional distribution.
-        muG, covG = FactorAnalysis.mvn_condition(
-            self.mu, self.cov, targets_r.keys(), constraints_r)
-        # Compute log density.
-        x = np.array(targets_r.values())
-        return multivariate_normal.logpdf(x, muG, covG)
+        return self.logpdf_bulk([rowid], [targets], [constraints], [inputs])[0]
+
+    def logpdf_bulk(self, rowids, targets_list, constraints_list=None,
+            inputs_list=None):
+        """Evaluate multiple queries at once, used by Engine.
+
+        Queries with the same target and constraint variables share one
+        conditional distribution, and their densities are computed together.
+        """
+        if constraints_list is None:
+            constraints_list = [None for i in xrange(len(rowids))]
+        if inputs_list is None:
+            inputs_list = [None for i in xrange(len(rowids))]
+        assert len(rowids) == len(targets_list)
+        assert len(rowids) == len(constraints_list)
+        assert len(rowids) == len(inputs_list)
+        # Group the queries by the indexes of their variables.
+        groups = OrderedDict()
+        for i, (rowid, targets, constraints, inputs) in enumerate(zip(
+                rowids, targets_list, constraints_list, inputs_list)):
+            targets_r, constraints_r = self.preprocess(
+                rowid, targets, constraints, inputs)
+            query, evidence = sorted(targets_r), sorted(constraints_r)
+            groups.setdefault((tuple(query), tuple(evidence)), []).append((i,
+                [targets_r[q] for q in query],
+                [constraints_r[e] for e in evidence]))
+        logps = np.zeros(len(rowids))
+        for (query, evidence), queries in groups.iteritems():
+            indexes, X, Ev = zip(*queries)
+            P, muQ, muE, _covG, covf = self.get_conditional(query, evidence)
+            muG = muQ + np.dot(np.asarray(Ev) - muE, P.T)
+            logps[list(indexes)] = multivariate_normal.logpdf_factored(
+                np.asarray(X), muG, covf)
+        return logps.tolist()
 
     def simulate(self, rowid, targets, constraints=None, inputs=None, N=None):
-        # XXX Deal with observed rowid.
-        constraints = self.populate_constraints(rowid, targets, constraints)
-        if inputs:
-            raise ValueError('Prohibited inputs: %s' % (inputs,))
-        if not targets:
-            raise ValueError('No targets: %s' % (targets,))
-        if any(q not in self.outputs for q in targets):
-            raise ValueError('Unknown targets: %s' % (targets,))
-        if any(q in constraints for q in targets):
-            raise ValueError('Duplicate variable: %s, %s'
-                % (targets, constraints,))
         # Reindex variables.
-        targets_r = self.reindex(targets)
-        constraints_r = self.reindex(constraints)
+        targets_r, constraints_r = self.preprocess(
+            rowid, targets, constraints, inputs)
         # Retrieve conditional distribution.
-        muG, covG = FactorAnalysis.mvn_condition(
-            self.mu, self.cov, targets_r, constraints_r)
+        evidence = sorted(constraints_r)
+        P, muQ, muE, covG, _covf = self.get_conditional(targets_r, evidence)
+        Ev = [constraints_r[e] for e in evidence]
+        muG = muQ + np.dot(P, Ev - muE)
         # Generate samples.
         sample = self.rng.multivariate_normal(mean=muG, cov=covG, size=N)
         def get_sample(samp):
@@ -211,23 +244,172 @@ class FactorAnalysis(CGpm):
         return get_sample(sample) if N is None else map(get_sample, sample)
 
     def logpdf_score(self):
-        def compute_logpdf(x):
+        def get_targets(x):
             assert len(x) == self.D
-            targets = {i:v for i,v in enumerate(x) if not np.isnan(v)}
-            return self.logpdf(None, targets)
-        return sum(compute_logpdf(x) for x in self.data)
-
-    def transition(self, N=None):
-        X = np.asarray(self.data.values())
-        # Only run inference on observations without missing entries.
-        self.fa = sklearn.decomposition.FactorAnalysis(n_components=self.L)
-        self.fa.fit(X[~np.any(np.isnan(X), axis=1)])
-        assert self.L, self.D == self.fa.components_.shape
-        # Update parameters of Factor Analysis.
-        self.Psi = np.diag(self.fa.noise_variance_)
-        self.mux = self.fa.mean_
-        self.W = np.transpose(self.fa.components_)
+            return {o:v for o,v in zip(self.observables, x) if not np.isnan(v)}
+        targets_list = [get_targets(x) for x in self.data.itervalues()]
+        targets_list = [targets for targets in targets_list if targets]
+        rowids = [None] * len(targets_list)
+        return sum(self.logpdf_bulk(rowids, targets_list))
+
+    def transition(self, N=None, batch_size=None, full=None):
+        """Run N iterations of EM, warm started from the current parameters.
+
+        Each iteration refreshes the expectations of the rows incorporated
+        since the last iteration and of batch_size other rows (EM_BATCH_SIZE
+        if None), then maximizes the parameters, so that it costs O(new rows
+        + batch_size). If N is None, run one iteration.
+
+        If full, each iteration refreshes every row instead, and if N is None
+        EM iterates until the log likelihood of the rows converges.
+        """
+        if not self.data:
+            return
+        if not np.any(self.W):
+            self._initialize_parameters()
+        if full:
+            batch_size = None
+        elif batch_size is None:
+            batch_size = EM_BATCH_SIZE
+        if N is None and not full:
+            N = 1
+        logp = -float('inf')
+        for _i in xrange(EM_MAX_ITER if N is None else N):
+            # Log likelihood of the refreshed rows before the M-step.
+            logp_old = logp
+            logp = self._expectation_step(self._select_rows(batch_size))
+            self._maximization_step()
+            if N is None and logp - logp_old < EM_TOL:
+                break
+
+    def _select_rows(self, batch_size):
+        rowids = [r for r in self.data if r not in self._expectations]
+        refreshed = [r for r in self.data if r in self._expectations]
+        if batch_size is None or batch_size >= len(refreshed):
+            return rowids + refreshed
+        batch = self.rng.choice(len(refreshed), size=batch_size, replace=False)
+        return rowids + [refreshed[i] for i in batch]
+
+    def _initialize_parameters(self):
+        # Moments of the observed data, and random loadings on that scale.
+        X = np.asarray(self.data.values(), dtype=float)
+        observed = np.any(~np.isnan(X), axis=0)
+        mean = np.zeros(self.D)
+        var = np.ones(self.D)
+        mean[observed] = np.nanmean(X[:,observed], axis=0)
+        var[observed] = np.nanvar(X[:,observed], axis=0)
+        var[var <= 0] = 1.
+        self.mux = mean
+        self.Psi = np.diag(var)
+        self.W = self.rng.normal(size=(self.D, self.L)) \
+            * np.sqrt(var / self.L)[:,np.newaxis]
+        self.mu, self.cov = self.joint_parameters()
+        self._conditionals = {}
+
+    def _expectation_step(self, rowids):
+        # Rows observing the same variables share the posterior of z. Returns
+        # the log likelihood of the observed entries of the rows.
+        latents = range(self.L)
+        logp = 0
+        groups = OrderedDict()
+        for rowid in rowids:
+            x = np.asarray(self.data[rowid], dtype=float)
+            observed = tuple(self.L + np.flatnonzero(~np.isnan(x)))
+            groups.setdefault(observed, []).append(rowid)
+        for observed, group in groups.iteritems():
+            P, muQ, muE, covG, _covf = self.get_conditional(latents, observed)
+            columns = np.asarray(observed, dtype=int) - self.L
+            X = np.asarray([self.data[r] for r in group], dtype=float)
+            X = X[:,columns]
+            _P, muX, _muE, _covX, covf = self.get_conditional(observed, [])
+            logp += np.sum(multivariate_normal.logpdf_factored(X, muX, covf))
+            Ez = np.column_stack((
+                muQ + np.dot(X - muE, P.T), np.ones(len(group))))
+            Ezz = np.einsum('ni,nj->nij', Ez, Ez)
+            Ezz[:,:self.L,:self.L] += covG
+            # Replace the old expectations of the rows in the statistics.
+            dEz, dEzz = Ez.copy(), Ezz.copy()
+            new = np.ones(len(group), dtype=bool)
+            for i, rowid in enumerate(group):
+                if rowid in self._expectations:
+                    Ez_old, Ezz_old = self._expectations[rowid]
+                    dEz[i] -= Ez_old
+                    dEzz[i] -= Ezz_old
+                    new[i] = False
+            self._stats_zz[columns] += np.sum(dEzz, axis=0)
+            self._stats_xz[columns] += np.dot(X.T, dEz)
+            self._stats_xx[columns] += np.sum(X[new]**2, axis=0)
+            self._stats_n[columns] += np.sum(new)
+            self._expectations.update(zip(group, zip(Ez, Ezz)))
+        return logp
+
+    def _update_stats(self, rowid, sign):
+        Ez, Ezz = self._expectations[rowid]
+        x = np.asarray(self.data[rowid], dtype=float)
+        observed = ~np.isnan(x)
+        self._stats_zz[observed] += sign * Ezz
+        self._stats_xz[observed] += sign * np.outer(x[observed], Ez)
+        self._stats_xx[observed] += sign * x[observed]**2
+        self._stats_n[observed] += sign
+
+    def _maximization_step(self):
+        # Regress each observable on z' = [z,1] over the rows observing it,
+        # which gives its loadings W and mean mux, and then its noise.
+        observed = self._stats_n > 0
+        n = self._stats_n[observed]
+        zz = self._stats_zz[observed]
+        xz = self._stats_xz[observed]
+        xx = self._stats_xx[observed]
+        loadings = np.einsum('dij,dj->di', np.linalg.pinv(zz), xz)
+        noise = (xx - np.sum(loadings * xz, axis=1)) / n
+        var = xx / n - (xz[:,self.L] / n)**2
+        W, mux, Psi = self.W.copy(), self.mux.copy(), np.diag(self.Psi).copy()
+        W[observed] = loadings[:,:self.L]
+        mux[observed] = loadings[:,self.L]
+        Psi[observed] = np.maximum(noise, MIN_NOISE * var + 1e-12)
+        self.W, self.mux, self.Psi = W, mux, np.diag(Psi)
         self.mu, self.cov = self.joint_parameters()
+        self._conditionals = {}
+        # Scikit-learn model with these parameters, for transform and score.
+        self.fa = sklearn.decomposition.FactorAnalysis(n_components=self.L)
+        self.fa.components_ = np.transpose(self.W)
+        self.fa.noise_variance_ = np.diag(self.Psi)
+        self.fa.mean_ = self.mux
+
+    def preprocess(self, rowid, targets, constraints, inputs):
+        # XXX Deal with observed rowid.
+        constraints = self.populate_constraints(rowid, targets, constraints)
+        if inputs:
+            raise ValueError('Prohibited inputs: %s' % (inputs,))
+        if not targets:
+            raise ValueError('No targets: %s' % (targets,))
+        if any(q not in self.outputs for q in targets):
+            raise ValueError('Unknown targets: %s' % (targets,))
+        if any(q in constraints for q in targets):
+            raise ValueError('Duplicate variable: %s, %s'
+                % (targets, constraints,))
+        # Reindex variables.
+        return self.reindex(targets), self.reindex(constraints)
+
+    def get_conditional(self, query, evidence):
+        """Return the regression matrix P, the means muQ and muE, covariance
+        covG and its factor, of the query indexes given the evidence indexes.
+
+        The conditional mean given evidence values Ev is muQ + P.(Ev - muE).
+        Conditionals are cached until the next transition.
+        """
+        key = (tuple(query), tuple(evidence))
+        if key not in self._conditionals:
+            muQ, muE, covQ, covE, covJ = FactorAnalysis.mvn_marginalize(
+                self.mu, self.cov, list(query), list(evidence))
+            if evidence:
+                P = np.transpose(np.linalg.solve(covE, covJ.T))
+            else:
+                P = np.zeros((len(query), 0))
+            covG = covQ - np.dot(P, covJ.T)
+            covf = multivariate_normal.covariance_factor(covG)
+            self._conditionals[key] = (P, muQ, muE, covG, covf)
+        return self._conditionals[key]
 
     def populate_constraints(self, rowid, targets, constraints):
         if constraints is None:
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 MIT Probabilistic Computing Project
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Product kernels of statsmodels KDEMultivariate: Gaussian for numerical
+('c') and Aitchison-Aitken for categorical ('u') variables."""
+
+import numpy as np
+
+
+# Maximum number of kernel evaluations held in memory at once.
+KERNEL_BLOCK_SIZE = 2**20
+
+
+def kernel_sums(bw, var_type, data, points, weights=None, exclude=None):
+    """Return the sum of the product kernels over the rows of data, at each
+    row of points, which statsmodels _kernel_base.gpke computes for one point
+    at a time.
+
+    The kernels of the rows are scaled by weights, and the kernel of row
+    exclude[i] is left out at point i unless it is negative, if given.
+    """
+    bw = np.asarray(bw, dtype=float)
+    continuous = np.asarray([v == 'c' for v in var_type], dtype=bool)
+    norm = np.prod(bw[continuous])
+    # As in the statsmodels kernel, the number of categories is the number of
+    # distinct values in the data.
+    levels = [
+        np.unique(data[:,i]).size if v == 'u' else None
+        for i, v in enumerate(var_type)
+    ]
+    if exclude is not None:
+        exclude = np.asarray(exclude, dtype=int)
+    sums = np.zeros(len(points))
+    block = max(1, KERNEL_BLOCK_SIZE // max(1, len(data)))
+    for start in xrange(0, len(points), block):
+        P = points[start:start+block]
+        K = np.ones((len(P), len(data)))
+        for i, v in enumerate(var_type):
+            Xi, x = data[np.newaxis,:,i], P[:,i,np.newaxis]
+            if v == 'c':
+                K *= np.exp(-(Xi - x)**2 / (bw[i]**2 * 2.)) / np.sqrt(2*np.pi)
+            else:
+                with np.errstate(divide='ignore'):
+                    other = np.float64(bw[i]) / (levels[i] - 1)
+                K *= np.where(Xi == x, 1 - bw[i], other)
+        if exclude is not None:
+            rows = np.flatnonzero(exclude[start:start+block] >= 0)
+            K[rows, exclude[start:start+block][rows]] = 0
+        if weights is None:
+            sums[start:start+block] = np.sum(K, axis=1) / norm
+        else:
+            sums[start:start+block] = np.dot(K, weights) / norm
+    return sums
+
+
+def kernel_self(bw, var_type):
+    """Return the product kernel of a point with itself."""
+    bw = np.asarray(bw, dtype=float)
+    continuous = np.asarray([v == 'c' for v in var_type], dtype=bool)
+    kernels = np.where(continuous, 1. / np.sqrt(2*np.pi), 1 - bw)
+    return np.prod(kernels) / np.prod(bw[continuous])
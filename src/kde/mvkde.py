@@ -14,17 +14,26 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
+
 from collections import OrderedDict
 
 import numpy as np
 
+from scipy import optimize
 from statsmodels.nonparametric import _kernel_base
 from statsmodels.nonparametric import kernel_density
 
 from cgpm.cgpm import CGpm
+from cgpm.kde import kernels
+from cgpm.kde.tree import KernelTree
 from cgpm.utils import general as gu
 
 
+# Bandwidth selectors of transition.
+BW_METHODS = ['cv_ml', 'cv_subsample', 'cv_binned', 'normal_reference']
+
+
 class MultivariateKde(CGpm):
     """Multivariate Kernel Density Estimation support continuous and categorical
     datatypes.
@@ -36,6 +45,26 @@ class MultivariateKde(CGpm):
     statsmodels package to satisfy the CGPM interface. In particular, it is
     extended to support conditional simulation by importance weighting the
     exemplars.
+
+    If distargs has a tolerance 'tol' in (0,1), densities and simulation
+    weights use a KernelTree, which drops the Gaussian kernels below tol
+    times their peak and indexes the numerical exemplars of each combination
+    of categorical values by a KD-tree, so queries cost sublinear time in N.
+
+    The bandwidth selector of transition is distargs 'bw_method':
+
+        'cv_ml' (default): statsmodels leave-one-out cross-validated maximum
+            likelihood over the full dataset, at O(N^2) per evaluation.
+        'cv_subsample': leave-one-out likelihood over 'bw_sample_size' random
+            rows (default 1000), with the bandwidths rescaled from the sample
+            size to N at the asymptotic rates of [1].
+        'cv_binned': leave-one-out likelihood over the cells of a grid with
+            'bw_bins' bins per numerical variable (default 32), weighted by
+            their counts. Numerical bandwidths are at least one bin wide.
+        'normal_reference': the plug-in rule of thumb, in O(N).
+
+    The cross-validated selectors start from the current bandwidths, and
+    transition(N, S) stops them after N iterations or S seconds.
     """
 
     def __init__(self, outputs, inputs, distargs=None, params=None,
@@ -72,8 +101,24 @@ class MultivariateKde(CGpm):
                 for i in xrange(len(outputs))
                 if distargs['outputs']['stattypes'][i] != 'numerical'):
             raise ValueError('Missing number of categories k: %s' % distargs)
+        # Ensure tolerance of the accelerated kernels in (0,1).
+        tol = distargs.get('tol', None)
+        if tol is not None and not 0 < tol < 1:
+            raise ValueError('Kernel tolerance must be in (0,1): %s' % (tol,))
+        # Ensure known bandwidth selector and positive budgets.
+        bw_method = distargs.get('bw_method', 'cv_ml')
+        if bw_method not in BW_METHODS:
+            raise ValueError('Unknown bandwidth method: %s' % (bw_method,))
+        bw_sample_size = distargs.get('bw_sample_size', 1000)
+        bw_bins = distargs.get('bw_bins', 32)
+        if bw_sample_size < 2 or bw_bins < 1:
+            raise ValueError('Invalid bandwidth budget: %s' % (distargs,))
         # Build the object.
         self.rng = rng
+        self.tol = tol
+        self.bw_method = bw_method
+        self.bw_sample_size = bw_sample_size
+        self.bw_bins = bw_bins
         # Varible indexes.
         self.outputs = outputs
         self.inputs = []
@@ -87,6 +132,8 @@ class MultivariateKde(CGpm):
         # Dataset.
         self.data = OrderedDict()
         self.N = 0
+        # Arrays derived from the dataset, cleared when it changes.
+        self._cache = {}
         # Parameters of the kernels.
         self.bw = params.get('bw', [self._default_bw(o) for o in self.outputs])
 
@@ -109,6 +156,7 @@ class MultivariateKde(CGpm):
         # Update dataset and counts.
         self.data[rowid] = x
         self.N += 1
+        self._cache = {}
 
     def unincorporate(self, rowid):
         try:
@@ -116,40 +164,73 @@ class MultivariateKde(CGpm):
         except KeyError:
             raise ValueError('No such observation: %d.' % rowid)
         self.N -= 1
+        self._cache = {}
 
     def logpdf(self, rowid, targets, constraints=None, inputs=None):
-        if self.N == 0:
-            raise ValueError('KDE requires at least one observation.')
-        constraints = self.populate_constraints(rowid, targets, constraints)
-        if inputs:
-            raise ValueError('Prohibited inputs: %s' % (inputs,))
-        if not targets:
-            raise ValueError('No targets: %s' % (targets,))
-        if any(np.isnan(v) for v in targets.values()):
-            raise ValueError('Invalid nan values in targets: %s' % (targets,))
-        if any(q not in self.outputs for q in targets):
-            raise ValueError('Unknown targets: %s' % (targets,))
-        if any(q in constraints for q in targets):
-            raise ValueError('Duplicate variable: %s, %s'
-                % (targets, constraints,))
-        if not constraints:
-            model = kernel_density.KDEMultivariate(
-                self._dataset(targets),
-                self._stattypes(targets),
-                bw=self._bw(targets),
-            )
-            pdf = model.pdf(targets.values())
-        else:
-            full_members = self._dataset(targets.keys() + constraints.keys())
-            model = kernel_density.KDEMultivariateConditional(
-                full_members[:,:len(targets)],
-                full_members[:,len(targets):],
-                self._stattypes(targets),
-                self._stattypes(constraints),
-                bw=np.concatenate((self._bw(targets), self._bw(constraints))),
-            )
-            pdf = model.pdf(targets.values(), constraints.values())
-        return np.log(pdf)
+        return self.logpdf_bulk([rowid], [targets], [constraints], [inputs])[0]
+
+    def logpdf_bulk(self, rowids, targets_list, constraints_list=None,
+            inputs_list=None):
+        """Evaluate multiple queries at once, used by Engine.
+
+        Queries with the same target and constraint variables are evaluated
+        together against the exemplars of those variables.
+        """
+        if constraints_list is None:
+            constraints_list = [None for i in xrange(len(rowids))]
+        if inputs_list is None:
+            inputs_list = [None for i in xrange(len(rowids))]
+        assert len(rowids) == len(targets_list)
+        assert len(rowids) == len(constraints_list)
+        assert len(rowids) == len(inputs_list)
+        groups = OrderedDict()
+        for i, (rowid, targets, constraints, inputs) in enumerate(zip(
+                rowids, targets_list, constraints_list, inputs_list)):
+            constraints = self.preprocess(rowid, targets, constraints, inputs)
+            query, evidence = sorted(targets), sorted(constraints)
+            groups.setdefault((tuple(query), tuple(evidence)), []).append((i,
+                [targets[q] for q in query] + [constraints[e] for e in evidence]
+            ))
+        logps = np.zeros(len(rowids))
+        for (query, evidence), queries in groups.iteritems():
+            indexes, points = zip(*queries)
+            logps[list(indexes)] = self._logpdf_points(
+                list(query), list(evidence), np.asarray(points, dtype=float))
+        return logps.tolist()
+
+    def logpdf_rows(self, rowids=None, leave_out=False):
+        """Return the log density of the observed values of stored rows.
+
+        With leave_out, the density of each row is estimated without the
+        row itself among the exemplars.
+        """
+        if rowids is None:
+            rowids = self.data.keys()
+        X, observed = self._matrix()
+        index = {rowid: i for i, rowid in enumerate(self.data)}
+        # Rows observing the same variables share their exemplars.
+        groups = OrderedDict()
+        for position, rowid in enumerate(rowids):
+            i = index[rowid]
+            groups.setdefault(tuple(observed[i]), []).append((position, i))
+        logps = np.zeros(len(rowids))
+        for pattern, queries in groups.iteritems():
+            positions, rows = zip(*queries)
+            outputs = [q for q, o in zip(self.outputs, pattern) if o]
+            points = X[list(rows)][:,np.asarray(pattern)]
+            n = len(self._dataset(outputs))
+            exclude = None
+            if leave_out:
+                # Index of each row among the exemplars of its outputs, whose
+                # kernel is left out of the sum.
+                members = np.all(observed[:,np.asarray(pattern)], axis=1)
+                exclude = (np.cumsum(members) - 1)[list(rows)]
+                n = n - 1
+            sums = self._kernel_sums(
+                outputs, range(len(outputs)), points, exclude=exclude)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                logps[list(positions)] = np.log(sums / n)
+        return logps.tolist()
 
     def simulate(self, rowid, targets, constraints=None, inputs=None, N=None):
         if self.N == 0:
@@ -164,6 +245,16 @@ class MultivariateKde(CGpm):
             raise ValueError('Duplicate variable: %s, %s'
                 % (targets, constraints,))
         constraints = self.populate_constraints(rowid, targets, constraints)
+        if constraints and self.tol is not None:
+            outputs = targets + constraints.keys()
+            targets_members = self._dataset(outputs)[:,:len(targets)]
+            columns = range(len(targets), len(outputs))
+            index = self._kernel_tree(outputs, columns).sample(
+                constraints.values(), 1 if N is None else N, self.rng)
+            if N is None:
+                return self._simulate_member(targets_members[index[0]], targets)
+            return [self._simulate_member(targets_members[i], targets)
+                for i in index]
         if constraints:
             full_members = self._dataset(targets + constraints.keys())
             weights = _kernel_base.gpke(
@@ -208,29 +299,149 @@ class MultivariateKde(CGpm):
         return self.rng.choice(range(c), p=probs)
 
     def logpdf_score(self):
-        def compute_logpdf(rowid, x):
-            assert len(x) == len(self.outputs)
-            targets = {self.outputs[i]: v
-                for i, v in enumerate(x) if not np.isnan(v)}
-            return self.logpdf(rowid, targets)
-        return sum(compute_logpdf(rowid, x) for rowid, x in self.data.items())
-
-    def transition(self, N=None):
-        if self.N > 0:
-            dataset = self._dataset(self.outputs)
-            stattypes = self._stattypes(self.outputs)
-            # Learn the kernel bandwidths.
+        return sum(self.logpdf_rows())
+
+    def transition(self, N=None, S=None):
+        """Learn the kernel bandwidths with the selector of bw_method.
+
+        The cross-validated selectors other than 'cv_ml' run at most N
+        iterations and S seconds of the optimizer, if given.
+        """
+        if self.N == 0:
+            return
+        # Drop the trees built with the previous bandwidths.
+        self._cache = {
+            key: value for key, value in self._cache.iteritems()
+            if key[0] != 'tree'
+        }
+        dataset = self._dataset(self.outputs)
+        stattypes = self._stattypes(self.outputs)
+        if self.bw_method == 'cv_ml':
             kde = kernel_density.KDEMultivariate(
                 dataset, stattypes, bw='cv_ml')
             self.bw = kde.bw.tolist()
+        elif len(dataset) < 2:
+            return
+        elif self.bw_method == 'cv_subsample':
+            self.bw = self._transition_cv_subsample(dataset, N, S)
+        elif self.bw_method == 'cv_binned':
+            self.bw = self._transition_cv_binned(dataset, N, S)
+        elif self.bw_method == 'normal_reference':
+            self.bw = self._transition_normal_reference(dataset)
+        else:
+            assert False, 'Unknown bandwidth method: %s' % (self.bw_method,)
 
     # --------------------------------------------------------------------------
     # Internal.
 
+    def _transition_cv_subsample(self, dataset, N, S):
+        stattypes = self._stattypes(self.outputs)
+        size = min(self.bw_sample_size, len(dataset))
+        rows = self.rng.choice(len(dataset), size=size, replace=False)
+        sample = dataset[np.sort(rows)]
+        # Likelihood of the sample with the bandwidths of size rows, whose
+        # optimizer starts from the current bandwidths at that size.
+        def loglikelihood(bw):
+            return _loo_loglikelihood(bw, stattypes, sample)
+        bw = _bw_rescale(self.bw, stattypes, len(dataset), size)
+        bw = _bw_maximize(loglikelihood, bw, stattypes, np.zeros(len(bw)), N, S)
+        return _bw_rescale(bw, stattypes, size, len(dataset)).tolist()
+
+    def _transition_cv_binned(self, dataset, N, S):
+        stattypes = self._stattypes(self.outputs)
+        cells, counts, widths = _bin(dataset, stattypes, self.bw_bins)
+        def loglikelihood(bw):
+            return _loo_loglikelihood(bw, stattypes, cells, counts)
+        bw = np.maximum(self.bw, widths)
+        return _bw_maximize(loglikelihood, bw, stattypes, widths, N, S).tolist()
+
+    def _transition_normal_reference(self, dataset):
+        stattypes = self._stattypes(self.outputs)
+        n, q = len(dataset), stattypes.count('c')
+        bw = np.asarray(self.bw, dtype=float)
+        for i, v in enumerate(stattypes):
+            if v == 'c':
+                # Silverman's rule with the robust scale estimate.
+                std = np.std(dataset[:,i])
+                iqr = np.subtract(*np.percentile(dataset[:,i], [75, 25]))
+                scale = min(std, iqr / 1.349) if iqr > 0 else std
+                if scale > 0:
+                    bw[i] = 1.06 * scale * n**(-1. / (4 + q))
+            else:
+                c = np.unique(dataset[:,i]).size
+                bw[i] = min(n**(-2. / (4 + q)), (c - 1.) / c) if c > 1 else 0
+        return bw.tolist()
+
+    def preprocess(self, rowid, targets, constraints, inputs):
+        if self.N == 0:
+            raise ValueError('KDE requires at least one observation.')
+        constraints = self.populate_constraints(rowid, targets, constraints)
+        if inputs:
+            raise ValueError('Prohibited inputs: %s' % (inputs,))
+        if not targets:
+            raise ValueError('No targets: %s' % (targets,))
+        if any(np.isnan(v) for v in targets.values()):
+            raise ValueError('Invalid nan values in targets: %s' % (targets,))
+        if any(q not in self.outputs for q in targets):
+            raise ValueError('Unknown targets: %s' % (targets,))
+        if any(q in constraints for q in targets):
+            raise ValueError('Duplicate variable: %s, %s'
+                % (targets, constraints,))
+        return constraints
+
+    def _logpdf_points(self, targets, constraints, points):
+        # Log density of the targets (the leading columns of points) given
+        # the constraints (the trailing columns), as in the statsmodels
+        # KDEMultivariate and KDEMultivariateConditional.
+        outputs = targets + constraints
+        sums = self._kernel_sums(outputs, range(len(outputs)), points)
+        if constraints:
+            columns = range(len(targets), len(outputs))
+            sums_constraints = self._kernel_sums(
+                outputs, columns, points[:,len(targets):])
+            return np.log(sums / sums_constraints)
+        return np.log(sums / len(self._dataset(outputs)))
+
+    def _kernel_sums(self, outputs, columns, points, exclude=None):
+        # Sum of the kernels of the variables in columns, over the exemplars
+        # of outputs, at each point. The exemplar at index exclude[i] is left
+        # out of the sum at point i, if given.
+        if self.tol is not None:
+            return self._kernel_tree(outputs, columns).sums(points, exclude)
+        variables = [outputs[c] for c in columns]
+        members = self._dataset(outputs)[:,columns]
+        return kernels.kernel_sums(
+            self._bw(variables), self._stattypes(variables), members, points,
+            exclude=exclude)
+
+    def _kernel_tree(self, outputs, columns):
+        # The tree of each query signature is kept with the bandwidths it was
+        # built with, and replaced once they change.
+        variables = [outputs[c] for c in columns]
+        bw = self._bw(variables)
+        key = ('tree', tuple(outputs), tuple(columns))
+        if key not in self._cache or self._cache[key][0] != tuple(bw):
+            members = self._dataset(outputs)[:,columns]
+            self._cache[key] = (tuple(bw), KernelTree(
+                members, self._stattypes(variables), bw, self.tol))
+        return self._cache[key][1]
+
+    def _matrix(self):
+        # The dataset as a contiguous array, and the mask of observed entries.
+        if 'matrix' not in self._cache:
+            X = np.asarray(self.data.values(), dtype=float)
+            X = X.reshape(len(self.data), len(self.outputs))
+            self._cache['matrix'] = (X, ~np.isnan(X))
+        return self._cache['matrix']
+
     def _dataset(self, outputs):
-        indexes = [self.outputs.index(q) for q in outputs]
-        X = np.asarray(self.data.values())[:,indexes]
-        return X[~np.any(np.isnan(X), axis=1)]
+        key = ('dataset', tuple(outputs))
+        if key not in self._cache:
+            indexes = [self.outputs.index(q) for q in outputs]
+            X, observed = self._matrix()
+            rows = np.all(observed[:,indexes], axis=1)
+            self._cache[key] = X[rows][:,indexes]
+        return self._cache[key]
 
     def _default_bw(self, q):
         i = self.outputs.index(q)
@@ -276,6 +487,10 @@ class MultivariateKde(CGpm):
                 'stattypes': self.stattypes,
                 'statargs': self.statargs,
             },
+            'tol': self.tol,
+            'bw_method': self.bw_method,
+            'bw_sample_size': self.bw_sample_size,
+            'bw_bins': self.bw_bins,
         }
 
     @staticmethod
@@ -312,3 +527,82 @@ class MultivariateKde(CGpm):
         kde.data = OrderedDict(metadata['data'])
         kde.N = metadata['N']
         return kde
+
+
+def _loo_loglikelihood(bw, var_type, data, counts=None):
+    # Leave-one-out log likelihood of the rows of data, each repeated by its
+    # count, as the statsmodels KDEMultivariate.loo_likelihood.
+    if counts is None:
+        counts = np.ones(len(data))
+    n = np.sum(counts)
+    # Each row is left out of its own sum, and its other copies are added
+    # back, rather than subtracting its kernel which cancels for isolated rows.
+    sums = kernels.kernel_sums(
+        bw, var_type, data, data, weights=counts, exclude=np.arange(len(data)))
+    sums = sums + (counts - 1) * kernels.kernel_self(bw, var_type)
+    densities = np.maximum(sums / (n - 1), np.finfo(float).tiny)
+    return np.dot(counts, np.log(densities))
+
+def _bw_maximize(loglikelihood, bw, var_type, lower, N=None, S=None):
+    # Maximize the loglikelihood of the bandwidths with Nelder-Mead from bw,
+    # over numerical bandwidths above lower and categorical in (0,1), and
+    # return the best bandwidths found within N iterations and S seconds.
+    continuous = np.asarray([v == 'c' for v in var_type], dtype=bool)
+    lower = np.asarray(lower, dtype=float)
+    def to_bw(theta):
+        with np.errstate(over='ignore'):
+            return np.where(
+                continuous, lower + np.exp(theta), 1. / (1 + np.exp(-theta)))
+    def to_theta(bw):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bw = np.where(continuous,
+                np.maximum(bw - lower, 1e-3 * np.maximum(lower, 1e-3)),
+                np.clip(bw, 1e-3, 1 - 1e-3))
+            return np.where(continuous, np.log(bw), np.log(bw / (1 - bw)))
+    bw = np.asarray(bw, dtype=float)
+    best = [bw, -loglikelihood(bw)]
+    start = time.time()
+    def objective(theta):
+        if S is not None and time.time() - start > S:
+            raise _BudgetExhausted()
+        bw = to_bw(theta)
+        value = -loglikelihood(bw)
+        if value < best[1]:
+            best[:] = [bw, value]
+        return value
+    try:
+        optimize.fmin(objective, to_theta(bw), xtol=1e-3,
+            maxiter=1000 if N is None else N, maxfun=1000, disp=0)
+    except _BudgetExhausted:
+        pass
+    return best[0]
+
+def _bw_rescale(bw, var_type, n_from, n_to):
+    # Scale bandwidths of n_from rows to n_to rows at the optimal rates of the
+    # numerical O(n^(-1/(4+q))) and categorical O(n^(-2/(4+q))) kernels, with
+    # q the number of numerical variables.
+    q = var_type.count('c')
+    ratio = float(n_to) / n_from
+    return np.asarray([
+        b * ratio**(-1. / (4 + q)) if v == 'c'
+            else min(b * ratio**(-2. / (4 + q)), 1 - 1e-3)
+        for b, v in zip(bw, var_type)
+    ])
+
+def _bin(data, var_type, bins):
+    # Distinct cells of data on a grid of bins per numerical variable, with
+    # the numerical values at the centers of the cells, the number of rows in
+    # each cell, and the width of the bins of each variable (0 if categorical).
+    continuous = np.asarray([v == 'c' for v in var_type], dtype=bool)
+    low = np.where(continuous, np.min(data, axis=0), 0)
+    widths = np.where(
+        continuous, (np.max(data, axis=0) - low) / float(bins), 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        index = np.clip(np.floor((data - low) / widths), 0, bins - 1)
+    index = np.where(continuous & (widths > 0), index, 0)
+    cells = np.where(continuous, low + (index + .5) * widths, data)
+    cells, counts = np.unique(cells, axis=0, return_counts=True)
+    return cells, counts.astype(float), widths
+
+class _BudgetExhausted(Exception):
+    pass
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 MIT Probabilistic Computing Project
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+
+import numpy as np
+
+from scipy.spatial import cKDTree
+
+from cgpm.kde import kernels
+
+
+class KernelTree(object):
+    """Truncated product kernel sums over a set of exemplars.
+
+    The kernels are those of statsmodels gpke: Gaussian for numerical ('c')
+    and Aitchison-Aitken for categorical ('u') variables. Exemplars are
+    grouped by their categorical values, which contribute one exact factor
+    per group, and the numerical values of each group, scaled by their
+    bandwidths, are indexed by a KD-tree. Gaussian kernels farther than
+    sqrt(-2 log(tol)) bandwidths from a point are dropped, so each dropped
+    kernel is at most tol times its peak value. Points whose truncated sum
+    vanishes are evaluated exactly.
+    """
+
+    def __init__(self, data, var_type, bw, tol):
+        assert 0 < tol < 1
+        data = np.asarray(data, dtype=float)
+        self.bw = np.asarray(bw, dtype=float)
+        self.numerical = [i for i, v in enumerate(var_type) if v == 'c']
+        self.categorical = [i for i, v in enumerate(var_type) if v == 'u']
+        assert len(self.numerical) + len(self.categorical) == len(var_type)
+        self.radius = np.sqrt(-2 * np.log(tol))
+        self.norm = np.prod(self.bw[self.numerical]) \
+            * np.sqrt(2*np.pi)**len(self.numerical)
+        # As in the statsmodels kernel, the number of categories is the number
+        # of distinct values in the data.
+        self.levels = [np.unique(data[:,i]).size for i in self.categorical]
+        # Row indexes and KD-tree of the exemplars of each categorical value.
+        keys = [tuple(row) for row in data[:,self.categorical]]
+        self.groups = OrderedDict()
+        for row, key in enumerate(keys):
+            self.groups.setdefault(key, []).append(row)
+        self.trees = OrderedDict(
+            (key, cKDTree(self._scale(data[rows])) if self.numerical else None)
+            for key, rows in self.groups.iteritems()
+        )
+
+    def sums(self, points, exclude=None):
+        """Return the sum of the kernels over the exemplars at each point.
+
+        The exemplar at index exclude[i] is left out of the sum at point i,
+        if exclude is given.
+        """
+        points = np.asarray(points, dtype=float)
+        if len(points) == 0:
+            return np.zeros(0)
+        if exclude is not None:
+            exclude = np.asarray(exclude, dtype=int)
+        sums = self._sums(points, self.radius, exclude)
+        exact = sums <= 0
+        if np.any(exact):
+            sums[exact] = self._sums(points[exact], np.inf,
+                None if exclude is None else exclude[exact])
+        return sums
+
+    def sample(self, point, size, rng):
+        """Return indexes of size exemplars drawn proportional to kernels."""
+        for radius in [self.radius, np.inf]:
+            keys, members, weights = [], [], []
+            factors = self._categorical_factors(np.asarray([point]))
+            for key, rows in self.groups.iteritems():
+                if self.numerical:
+                    neighbors, kernels = self._neighbors(key, point, radius)
+                    members.append([rows[i] for i in neighbors])
+                else:
+                    kernels = np.ones(len(rows))
+                    members.append(rows)
+                keys.append(key)
+                weights.append(factors[key][0] * kernels)
+            totals = np.asarray([np.sum(w) for w in weights])
+            if np.sum(totals) > 0:
+                break
+        groups = rng.choice(len(keys), size=size, p=totals/np.sum(totals))
+        return [
+            members[g][rng.choice(len(weights[g]), p=weights[g]/totals[g])]
+            for g in groups
+        ]
+
+    def _sums(self, points, radius, exclude=None):
+        sums = np.zeros(len(points))
+        factors = self._categorical_factors(points)
+        if self.numerical:
+            scaled = self._scale(points)
+            points_tree = cKDTree(scaled)
+        for key, rows in self.groups.iteritems():
+            rows = np.asarray(rows)
+            if not self.numerical:
+                counts = len(rows) - (0 if exclude is None
+                    else np.in1d(exclude, rows).astype(float))
+                sums += factors[key] * counts
+                continue
+            if np.isinf(radius):
+                # Exact sums of the unit Gaussian kernels, computed in blocks
+                # of points, leaving out the local index of excluded rows.
+                local = None
+                if exclude is not None:
+                    local = np.searchsorted(rows, exclude)
+                    local[local == len(rows)] = 0
+                    local[rows[local] != exclude] = -1
+                q = len(self.numerical)
+                totals = kernels.kernel_sums(
+                    np.ones(q), 'c'*q, self.trees[key].data, scaled,
+                    exclude=local) * np.sqrt(2*np.pi)**q
+            else:
+                pairs = points_tree.sparse_distance_matrix(
+                    self.trees[key], radius, output_type='ndarray')
+                if exclude is not None:
+                    pairs = pairs[rows[pairs['j']] != exclude[pairs['i']]]
+                totals = np.bincount(
+                    pairs['i'], weights=np.exp(-pairs['v']**2 / 2.),
+                    minlength=len(points))
+            sums += factors[key] * totals
+        return sums / self.norm
+
+    def _neighbors(self, key, point, radius):
+        tree = self.trees[key]
+        scaled = self._scale(np.asarray([point]))[0]
+        if np.isinf(radius):
+            neighbors = np.arange(tree.n)
+        else:
+            neighbors = np.asarray(
+                tree.query_ball_point(scaled, radius), dtype=int)
+        distances = np.sum((tree.data[neighbors] - scaled)**2, axis=1)
+        return neighbors, np.exp(-distances / 2.)
+
+    def _categorical_factors(self, points):
+        # Product of the categorical kernels of each group, at each point.
+        factors = OrderedDict()
+        for key in self.groups:
+            factor = np.ones(len(points))
+            for j, i in enumerate(self.categorical):
+                h = self.bw[i]
+                with np.errstate(divide='ignore'):
+                    other = np.float64(h) / (self.levels[j] - 1)
+                factor *= np.where(points[:,i] == key[j], 1 - h, other)
+            factors[key] = factor
+        return factors
+
+    def _scale(self, X):
+        return X[:,self.numerical] / self.bw[self.numerical]
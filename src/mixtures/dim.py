@@ -14,7 +14,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
+import itertools
 import math
+import os
 
 import numpy as np
 
@@ -23,6 +26,15 @@ from cgpm.utils import config as cu
 from cgpm.utils import general as gu
 
 
+# Counter for the versions of Dims, see `Dim.version`.
+_VERSIONS = itertools.count()
+
+
+def _next_version():
+    # The pid keeps versions distinct when states are mutated in workers.
+    return (os.getpid(), next(_VERSIONS))
+
+
 class Dim(CGpm):
     """CGpm representing a homogeneous mixture of univariate CGpm.
 
@@ -89,6 +101,14 @@ class Dim(CGpm):
         # -- Auxiliary Singleton ---- ------------------------------------------
         self.aux_model = self.create_aux_model()
 
+        # -- Version -----------------------------------------------------------
+        # Fresh token whenever the clusters or hypers change, never reused.
+        self.version = _next_version()
+
+        # -- Copy-on-write -----------------------------------------------------
+        # Clusters whose data is shared with a fork, see `fork`.
+        self.shared = set()
+
     # --------------------------------------------------------------------------
     # Observe
 
@@ -100,20 +120,102 @@ class Dim(CGpm):
             self.clusters[k] = self.aux_model
             self.aux_model = self.create_aux_model()
         if valid:
+            self._own_cluster(k)
             self.clusters[k].incorporate(rowid, observation, inputs_cluster)
             self.Zr[rowid] = k
         else:
             self.Zi[rowid] = k
+        self.version = _next_version()
+
+    def incorporate_array(self, rowids, X, Z, suffstats=None):
+        """Incorporate values X of many rowids assigned to clusters Z.
+
+        Only for Dims without input variables. The rows are grouped by cluster
+        and each cluster incorporates its block of values with a single call
+        to `incorporate_array`, instead of one `incorporate` per row.
+
+        If `suffstats` is given, it maps each cluster to the output of its
+        `get_suffstats` for exactly these rows (as saved by `to_metadata`),
+        and the clusters are restored from them instead of reducing X.
+        """
+        assert not self.inputs[1:]
+        rowids = np.asarray(rowids, dtype=int)
+        X = np.asarray(X, dtype=float)
+        Z = np.asarray(Z, dtype=int)
+        assert len(rowids) == len(X) == len(Z)
+        if len(rowids) == 0:
+            return
+        existing = set(self.Zr).union(self.Zi).intersection(rowids.tolist())
+        if existing:
+            raise ValueError('rowid already incorporated: %d.' % min(existing))
+        # Create the clusters in order of first appearance, as incorporate.
+        ks, first = np.unique(Z, return_index=True)
+        for k in ks[np.argsort(first)].tolist():
+            if k not in self.clusters:
+                self.clusters[k] = self.aux_model
+                self.aux_model = self.create_aux_model()
+        valid = ~np.isnan(X)
+        rowids_valid, X_valid, Z_valid = rowids[valid], X[valid], Z[valid]
+        order = np.argsort(Z_valid, kind='mergesort')
+        splits = np.flatnonzero(np.diff(Z_valid[order])) + 1
+        for block in np.split(order, splits):
+            if len(block) > 0:
+                k = int(Z_valid[block[0]])
+                self._own_cluster(k)
+                if suffstats is None:
+                    self.clusters[k].incorporate_array(
+                        rowids_valid[block].tolist(), X_valid[block])
+                else:
+                    self.clusters[k].restore_array(
+                        rowids_valid[block].tolist(), X_valid[block].tolist(),
+                        suffstats[k])
+        self.Zr.update(zip(rowids_valid.tolist(), Z_valid.tolist()))
+        self.Zi.update(zip(rowids[~valid].tolist(), Z[~valid].tolist()))
+        self.version = _next_version()
+        if suffstats is not None:
+            self._check_suffstats()
 
     def unincorporate(self, rowid):
         if rowid in self.Zi:
             del self.Zi[rowid]
         elif rowid in self.Zr:
+            self._own_cluster(self.Zr[rowid])
             cluster = self.clusters[self.Zr[rowid]]
             cluster.unincorporate(rowid)
             del self.Zr[rowid]
         else:
             raise ValueError('rowid not incorporated: %d.' % rowid)
+        self.version = _next_version()
+
+    # --------------------------------------------------------------------------
+    # Fork
+
+    def fork(self, rng=None):
+        """Return a copy of the Dim which shares the data of its clusters.
+
+        The row assignments, hyperparameters and sufficient statistics are
+        copied, while the data recorded in each cluster is shared until either
+        copy updates that cluster. Conditional dims are deep copied.
+        """
+        rng = self.rng if rng is None else rng
+        if self.is_conditional():
+            dim = copy.deepcopy(self)
+            dim.rng = rng
+            return dim
+        dim = copy.copy(self)
+        dim.rng = rng
+        dim.outputs = list(self.outputs)
+        dim.inputs = list(self.inputs)
+        dim.hypers = dict(self.hypers)
+        dim.Zr = dict(self.Zr)
+        dim.Zi = dict(self.Zi)
+        dim.clusters = {
+            k: cluster.fork(rng) for k, cluster in self.clusters.iteritems()
+        }
+        dim.aux_model = dim.create_aux_model()
+        dim.shared = set(self.clusters)
+        self.shared.update(self.clusters)
+        return dim
 
     # --------------------------------------------------------------------------
     # logpdf score
@@ -131,6 +233,21 @@ class Dim(CGpm):
         return cluster.logpdf(rowid, targets, constraints, inputs2) \
             if valid else 0
 
+    def logpdf_array(self, X, inputs=None):
+        """Return a numpy array with the logpdf of each value in X in cluster k.
+
+        Missing (nan) values contribute zero density, as in `logpdf`.
+        """
+        k, inputs2, valid = self.preprocess(None, None, inputs)
+        cluster = self.clusters.get(k, self.aux_model)
+        assert valid
+        X = np.asarray(X, dtype=float)
+        logps = np.zeros(len(X))
+        observed = ~np.isnan(X)
+        if np.any(observed):
+            logps[observed] = cluster.logpdf_array(X[observed], inputs2)
+        return logps
+
     # --------------------------------------------------------------------------
     # Simulate
 
@@ -140,6 +257,13 @@ class Dim(CGpm):
         assert valid
         return cluster.simulate(rowid, targets, constraints, inputs2, N)
 
+    def simulate_array(self, rowid, N, inputs=None):
+        """Return a numpy array of N samples of the output in cluster k."""
+        k, inputs2, valid = self.preprocess(None, None, inputs)
+        cluster = self.clusters.get(k, self.aux_model)
+        assert valid
+        return cluster.simulate_array(rowid, N, inputs2)
+
     # --------------------------------------------------------------------------
     # Inferece
 
@@ -148,6 +272,7 @@ class Dim(CGpm):
         if not self.is_collapsed():
             for k in self.clusters:
                 self.clusters[k].transition_params()
+            self.version = _next_version()
 
     def transition_hypers(self):
         """Transitions the hyperparameters of each cluster."""
@@ -155,16 +280,7 @@ class Dim(CGpm):
         self.rng.shuffle(hypers)
         # For each hyper.
         for hyper in hypers:
-            logps = []
-            # For each grid point.
-            for grid_value in self.hyper_grids[hyper]:
-                # Compute the probability of the grid point.
-                self.hypers[hyper] = grid_value
-                logp_k = 0
-                for k in self.clusters:
-                    self.clusters[k].set_hypers(self.hypers)
-                    logp_k += self.clusters[k].logpdf_score()
-                logps.append(logp_k)
+            logps = self._logpdf_score_grid(hyper)
             # Sample a new hyperparameter from the grid.
             index = gu.log_pflip(logps, rng=self.rng)
             self.hypers[hyper] = self.hyper_grids[hyper][index]
@@ -172,16 +288,43 @@ class Dim(CGpm):
         for k in self.clusters:
             self.clusters[k].set_hypers(self.hypers)
         self.aux_model = self.create_aux_model()
+        self.version = _next_version()
+
+    def _logpdf_score_grid(self, hyper):
+        # Models which implement logpdf_score_grid evaluate the score of all
+        # grid points of the hyper at once, holding the other hypers fixed.
+        grid = self.hyper_grids[hyper]
+        clusters = self.clusters.values()
+        if clusters and all(
+                hasattr(cluster, 'logpdf_score_grid') for cluster in clusters):
+            for cluster in clusters:
+                cluster.set_hypers(self.hypers)
+            return np.sum([
+                cluster.logpdf_score_grid(hyper, grid) for cluster in clusters
+            ], axis=0)
+        logps = []
+        # For each grid point.
+        for grid_value in grid:
+            # Compute the probability of the grid point.
+            self.hypers[hyper] = grid_value
+            logp_k = 0
+            for k in self.clusters:
+                self.clusters[k].set_hypers(self.hypers)
+                logp_k += self.clusters[k].logpdf_score()
+            logps.append(logp_k)
+        return logps
 
     def transition_hyper_grids(self, X, n_grid=30):
         """Transitions hyperparameter grids using empirical Bayes."""
+        X = np.asarray(X, dtype=float)
         self.hyper_grids = self.model.construct_hyper_grids(
-            [x for x in X if not math.isnan(x)], n_grid=n_grid)
+            X[~np.isnan(X)], n_grid=n_grid)
         # Only transition the hypers if previously uninstantiated.
         if not self.hypers:
             for h in self.hyper_grids:
                 self.hypers[h] = self.rng.choice(self.hyper_grids[h])
         self.aux_model = self.create_aux_model()
+        self.version = _next_version()
 
     # --------------------------------------------------------------------------
     # Attributes from self.model
@@ -208,6 +351,7 @@ class Dim(CGpm):
         self.hypers = hypers
         for model in self.clusters.values():
             model.set_hypers(hypers)
+        self.version = _next_version()
 
     def get_suffstats(self):
         if len(self.clusters) == 0:
@@ -253,3 +397,24 @@ class Dim(CGpm):
             valid_inputs = not any(np.isnan(inputs2.values()))
         assert valid_constraints
         return k, inputs2, valid_targets and valid_inputs
+
+    def _check_suffstats(self):
+        if not cu.check_env_debug():
+            return
+        # For debugging only.
+        for cluster in self.clusters.itervalues():
+            rowids = sorted(cluster.data)
+            expected = self.create_aux_model()
+            expected.incorporate_array(
+                rowids, [cluster.data[r] for r in rowids])
+            stats, stats_expected = \
+                cluster.get_suffstats(), expected.get_suffstats()
+            assert set(stats) == set(stats_expected)
+            for key in stats:
+                assert np.allclose(stats[key], stats_expected[key])
+
+    def _own_cluster(self, k):
+        # Copy the data of cluster k if it is shared with a fork.
+        if k in self.shared:
+            self.clusters[k].data = dict(self.clusters[k].data)
+            self.shared.discard(k)
@@ -14,6 +14,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
 import itertools
 
 from math import isnan
@@ -23,6 +24,7 @@ import numpy as np
 from cgpm.cgpm import CGpm
 from cgpm.mixtures.dim import Dim
 from cgpm.network.importance import ImportanceNetwork
+from cgpm.primitives.crp import Crp
 from cgpm.utils import config as cu
 from cgpm.utils import general as gu
 from cgpm.utils.config import cctype_class
@@ -34,7 +36,8 @@ class View(CGpm):
 
     def __init__(
             self, X, outputs=None, inputs=None, alpha=None,
-            cctypes=None, distargs=None, hypers=None, Zr=None, rng=None):
+            cctypes=None, distargs=None, hypers=None, Zr=None,
+            suffstats=None, rng=None):
         """View constructor provides a convenience method for bulk incorporate
         and unincorporate by specifying the data and optional row partition.
 
@@ -60,6 +63,10 @@ class View(CGpm):
             A `len(outputs[1:])` list of hyperparameters.
         Zr : list<int>, optional.
             Row partition, where `Zr[rowid]` is the cluster identity of rowid.
+        suffstats : list<dict>, optional.
+            A `len(outputs[1:])` list of sufficient statistics of the clusters
+            in `Zr`, as saved by `to_metadata`. The clusters are restored from
+            them instead of from the data. Ignored if `Zr` is not specified.
         rng : np.random.RandomState, optional.
             Source of entropy.
         """
@@ -82,6 +89,8 @@ class View(CGpm):
                 distargs = [None] * len(cctypes)
             if not hypers:
                 hypers = [None] * len(cctypes)
+            if not suffstats or Zr is None:
+                suffstats = [None] * len(cctypes)
             assert len(outputs[1:])==len(cctypes)
             assert len(distargs) == len(cctypes)
             assert len(hypers) == len(cctypes)
@@ -98,12 +107,8 @@ class View(CGpm):
         n_rows = len(self.X[self.X.keys()[0]])
         self.crp.transition_hyper_grids([1]*n_rows)
         if Zr is None:
-            for i in xrange(n_rows):
-                s = self.crp.simulate(i, [self.outputs[0]], None, {-1:0})
-                self.crp.incorporate(i, s, {-1:0})
-        else:
-            for i, z in enumerate(Zr):
-                self.crp.incorporate(i, {self.outputs[0]: z}, {-1:0})
+            Zr = gu.simulate_crp_array(n_rows, self.alpha(), rng=self.rng)
+        self.crp.incorporate_array(range(n_rows), Zr, [0]*n_rows)
 
         # -- Dimensions --------------------------------------------------------
         self.dims = dict()
@@ -123,7 +128,11 @@ class View(CGpm):
                 rng=self.rng
             )
             dim.transition_hyper_grids(self.X[c])
-            self.incorporate_dim(dim)
+            self.incorporate_dim(dim, suffstats=suffstats[i])
+
+        # -- Cache -------------------------------------------------------------
+        # Cluster weights of hypothetical rows, see `sampling.view_logpdf`.
+        self.lp_cluster_cache = {}
 
         # -- Validation --------------------------------------------------------
         self._check_partitions()
@@ -131,11 +140,11 @@ class View(CGpm):
     # --------------------------------------------------------------------------
     # Observe
 
-    def incorporate_dim(self, dim, reassign=True):
+    def incorporate_dim(self, dim, reassign=True, suffstats=None):
         """Incorporate dim into View. If not reassign, partition should match."""
         dim.inputs[0] = self.outputs[0]
         if reassign:
-            self._bulk_incorporate(dim)
+            self._bulk_incorporate(dim, suffstats=suffstats)
         self.dims[dim.index] = dim
         self.outputs = self.outputs[:1] + self.dims.keys()
         return dim.logpdf_score()
@@ -171,6 +180,56 @@ class View(CGpm):
         if self.outputs[0] not in observation:
             self.transition_rows(rows=[rowid])
 
+    def incorporate_bulk(self, rowids, observations):
+        """Incorporate a block of fresh rows into the View.
+
+        Rows whose observation does not specify the cluster are scored against
+        every table at once with `Dim.logpdf_array`, and assigned with one
+        vectorized Gibbs step. All rows of the block are scored against the
+        clusters as they were before the block. Rows which sample the fresh
+        table are then transitioned one at a time, to form new clusters.
+
+        This is an approximation of sequential `incorporate`, which scores
+        each row against the clusters including the earlier rows of the block
+        and runs the Gibbs step on every row. Rows assigned to existing tables
+        are not transitioned, so later `transition_rows` sweeps correct for
+        blocks that shift the clusters.
+        """
+        if any(dim.is_conditional() for dim in self.dims.itervalues()):
+            for rowid, observation in zip(rowids, observations):
+                self.incorporate(rowid, observation)
+            return
+        rowids = np.asarray(rowids, dtype=int)
+        crp_v = self.outputs[0]
+        X = {
+            d: np.asarray([obs[d] for obs in observations], dtype=float)
+            for d in self.dims
+        }
+        Z = np.asarray([obs.get(crp_v, 0) for obs in observations], dtype=int)
+        sample = np.flatnonzero([crp_v not in obs for obs in observations])
+        fresh = np.zeros(len(rowids), dtype=bool)
+        if len(sample) > 0:
+            # Tables of a new customer, the last one is a fresh table.
+            K = self.crp.clusters[0].gibbs_tables(-1)
+            N_rows = self.n_rows()
+            logps = np.tile([
+                Crp.calc_predictive_logp(k, N_rows, self.Nk(), self.alpha())
+                for k in K
+            ], (len(sample), 1))
+            for d in self.dims:
+                for i, k in enumerate(K):
+                    logps[:,i] += self.dims[d].logpdf_array(
+                        X[d][sample], {crp_v: k})
+            gumbel = self.rng.gumbel(size=logps.shape)
+            choices = np.argmax(logps + gumbel, axis=1)
+            Z[sample] = np.asarray(K)[choices]
+            fresh[sample] = choices == len(K) - 1
+        self.crp.incorporate_array(rowids, Z, np.zeros(len(rowids)))
+        for d in self.dims:
+            self.dims[d].incorporate_array(rowids, X[d], Z)
+        if np.any(fresh):
+            self.transition_rows(rows=rowids[fresh].tolist())
+
     def unincorporate(self, rowid):
         # Unincorporate from dims.
         for dim in self.dims.itervalues():
@@ -219,6 +278,21 @@ class View(CGpm):
         self.unincorporate_dim(D_old)
         self.incorporate_dim(D_new)
 
+    # --------------------------------------------------------------------------
+    # Fork
+
+    def fork(self, X, rng=None):
+        """Return a copy of the View on dataset X, see `Dim.fork`."""
+        rng = self.rng if rng is None else rng
+        view = copy.copy(self)
+        view.rng = rng
+        view.X = X
+        view.outputs = list(self.outputs)
+        view.crp = self.crp.fork(rng)
+        view.dims = {d: dim.fork(rng) for d, dim in self.dims.iteritems()}
+        view.lp_cluster_cache = {}
+        return view
+
     # --------------------------------------------------------------------------
     # Inference
 
@@ -480,16 +554,23 @@ class View(CGpm):
         cluster = {self.outputs[0]: k}
         return merged(inputs, cluster)
 
-    def _bulk_incorporate(self, dim):
+    def _bulk_incorporate(self, dim, suffstats=None):
         # XXX Major hack! We should really be creating new Dim objects.
         dim.clusters = {}   # Mapping of cluster k to the object.
         dim.Zr = {}         # Mapping of non-nan rowids to cluster k.
         dim.Zi = {}         # Mapping of nan rowids to cluster k.
         dim.aux_model = dim.create_aux_model()
-        for rowid, k in self.Zr().iteritems():
-            observation = {dim.index: self.X[dim.index][rowid]}
-            inputs = self._get_input_values(rowid, dim, k)
-            dim.incorporate(rowid, observation, inputs)
+        if dim.is_conditional():
+            for rowid, k in self.Zr().iteritems():
+                observation = {dim.index: self.X[dim.index][rowid]}
+                inputs = self._get_input_values(rowid, dim, k)
+                dim.incorporate(rowid, observation, inputs)
+        else:
+            Zr = self.Zr()
+            rowids = np.fromiter(Zr.iterkeys(), dtype=int, count=len(Zr))
+            X = np.asarray(self.X[dim.index], dtype=float)[rowids]
+            dim.incorporate_array(
+                rowids, X, Zr.values(), suffstats=suffstats)
         assert merged(dim.Zr, dim.Zi) == self.Zr()
         dim.transition_params()
 
@@ -594,6 +675,9 @@ class View(CGpm):
     def from_metadata(cls, metadata, rng=None):
         if rng is None:
             rng = gu.gen_rng(0)
+        suffstats = None
+        if metadata.get('Zr') is not None and 'suffstats' in metadata:
+            suffstats = [dict(stats) for stats in metadata['suffstats']]
         return cls(
             metadata.get('X'),
             outputs=metadata.get('outputs', None),
@@ -603,4 +687,5 @@ class View(CGpm):
             distargs=metadata.get('distargs', None),
             hypers=metadata.get('hypers', None),
             Zr=metadata.get('Zr', None),
+            suffstats=suffstats,
             rng=rng)
@@ -16,6 +16,8 @@
 
 from math import log
 
+import numpy as np
+
 from scipy.special import betaln
 
 from cgpm.primitives.distribution import DistributionGpm
@@ -42,6 +44,8 @@ class Bernoulli(DistributionGpm):
         self.beta = hypers.get('beta', 1.)
         assert self.alpha > 0
         assert self.beta > 0
+        # Cached log probabilities of the predictive, see `predictive_params`.
+        self._predictive = None
 
     def incorporate(self, rowid, observation, inputs=None):
         DistributionGpm.incorporate(self, rowid, observation, inputs)
@@ -51,19 +55,30 @@ class Bernoulli(DistributionGpm):
         self.N += 1
         self.x_sum += x
         self.data[rowid] = x
+        self._predictive = None
+
+    def incorporate_array(self, rowids, X):
+        X = np.asarray(X, dtype=float)
+        invalid = (X != 0) & (X != 1)
+        if np.any(invalid):
+            raise ValueError('Invalid Bernoulli: %s' % str(X[invalid][0]))
+        self.N += len(X)
+        self.x_sum += float(np.sum(X))
+        self._incorporate_array_data(rowids, X.tolist())
+        self._predictive = None
 
     def unincorporate(self, rowid):
         x = self.data.pop(rowid)
         self.N -= 1
         self.x_sum -= x
+        self._predictive = None
 
     def logpdf(self, rowid, targets, constraints=None, inputs=None):
         DistributionGpm.logpdf(self, rowid, targets, constraints, inputs)
         x = targets[self.outputs[0]]
         if x not in [0, 1]:
             return -float('inf')
-        return Bernoulli.calc_predictive_logp(
-            x, self.N, self.x_sum, self.alpha, self.beta)
+        return self.predictive_params()[int(x)]
 
     @gu.simulate_many
     def simulate(self, rowid, targets, constraints=None, inputs=None, N=None):
@@ -77,6 +92,22 @@ class Bernoulli(DistributionGpm):
         x = gu.log_pflip([p0, p1], rng=self.rng)
         return {self.outputs[0]: x}
 
+    def simulate_array(self, rowid, N, inputs=None):
+        DistributionGpm.simulate_array(self, rowid, N, inputs)
+        if rowid in self.data:
+            return np.repeat(self.data[rowid], N)
+        return np.asarray(
+            gu.log_pflip(self.predictive_params(), size=N, rng=self.rng))
+
+    def logpdf_array(self, X, inputs=None):
+        assert not inputs
+        X = np.asarray(X, dtype=float)
+        logps = np.full(len(X), -float('inf'))
+        valid = (X == 0) | (X == 1)
+        logps[valid] = np.asarray(self.predictive_params())[
+            X[valid].astype(int)]
+        return logps
+
     def logpdf_score(self):
         return Bernoulli.calc_logpdf_marginal(
             self.N, self.x_sum, self.alpha, self.beta)
@@ -93,6 +124,7 @@ class Bernoulli(DistributionGpm):
         assert hypers['beta'] > 0
         self.alpha = hypers['alpha']
         self.beta = hypers['beta']
+        self._predictive = None
 
     def get_hypers(self):
         return {'alpha': self.alpha, 'beta': self.beta}
@@ -100,9 +132,27 @@ class Bernoulli(DistributionGpm):
     def get_params(self):
         return {}
 
+    def predictive_params(self):
+        """Return the predictive log probabilities [logp(x=0), logp(x=1)].
+
+        The values are cached until the suffstats or hypers change.
+        """
+        if self._predictive is None:
+            self._predictive = [
+                Bernoulli.calc_predictive_logp(
+                    x, self.N, self.x_sum, self.alpha, self.beta)
+                for x in [0, 1]
+            ]
+        return self._predictive
+
     def get_suffstats(self):
         return {'N':self.N, 'x_sum':self.x_sum}
 
+    def set_suffstats(self, suffstats):
+        self.N = suffstats['N']
+        self.x_sum = suffstats['x_sum']
+        self._predictive = None
+
     def get_distargs(self):
         return {'k': 2}
 
@@ -93,6 +93,14 @@ class Beta(DistributionGpm):
         x = self.rng.beta(alpha, beta)
         return {self.outputs[0]: x}
 
+    def simulate_array(self, rowid, N, inputs=None):
+        DistributionGpm.simulate_array(self, rowid, N, inputs)
+        if rowid in self.data:
+            return np.repeat(self.data[rowid], N)
+        alpha = self.strength * self.balance
+        beta = self.strength * (1. - self.balance)
+        return self.rng.beta(alpha, beta, size=N)
+
     def logpdf_score(self):
         data_logp = Beta.calc_log_likelihood(
             self.N, self.sum_log_x, self.sum_minus_log_x, self.strength,
@@ -148,6 +156,11 @@ class Beta(DistributionGpm):
         return {'N': self.N, 'sum_log_x': self.sum_log_x,
             'sum_minus_log_x': self.sum_minus_log_x}
 
+    def set_suffstats(self, suffstats):
+        self.N = suffstats['N']
+        self.sum_log_x = suffstats['sum_log_x']
+        self.sum_minus_log_x = suffstats['sum_minus_log_x']
+
     def get_distargs(self):
         return {}
 
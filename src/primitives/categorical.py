@@ -49,6 +49,8 @@ class Categorical(DistributionGpm):
         # Hyperparameters.
         if hypers is None: hypers = {}
         self.alpha = hypers.get('alpha', 1.)
+        # Cached log probabilities of the predictive, see `predictive_params`.
+        self._predictive = None
 
     def incorporate(self, rowid, observation, inputs=None):
         DistributionGpm.incorporate(self, rowid, observation, inputs)
@@ -59,19 +61,36 @@ class Categorical(DistributionGpm):
         self.N += 1
         self.counts[x] += 1
         self.data[rowid] = x
+        self._predictive = None
+
+    def incorporate_array(self, rowids, X):
+        X = np.asarray(X, dtype=float)
+        invalid = ~((X % 1 == 0) & (0 <= X) & (X < self.k))
+        if np.any(invalid):
+            raise ValueError(
+                'Invalid Categorical(%d): %s' % (self.k, X[invalid][0]))
+        X = X.astype(int)
+        self.N += len(X)
+        self.counts += np.bincount(X, minlength=self.k)
+        self._incorporate_array_data(rowids, X.tolist())
+        self._predictive = None
+
+    def restore_array(self, rowids, X, suffstats):
+        X = np.asarray(X, dtype=int).tolist()
+        DistributionGpm.restore_array(self, rowids, X, suffstats)
 
     def unincorporate(self, rowid):
         x = self.data.pop(rowid)
         self.N -= 1
         self.counts[x] -= 1
+        self._predictive = None
 
     def logpdf(self, rowid, targets, constraints=None, inputs=None):
         DistributionGpm.logpdf(self, rowid, targets, constraints, inputs)
         x = targets[self.outputs[0]]
         if not (x % 1 == 0 and 0 <= x < self.k):
             return -float('inf')
-        return Categorical.calc_predictive_logp(
-            int(x), self.N, self.counts, self.alpha)
+        return float(self.predictive_params()[int(x)])
 
     @gu.simulate_many
     def simulate(self, rowid, targets, constraints=None, inputs=None, N=None):
@@ -81,6 +100,21 @@ class Categorical(DistributionGpm):
         x = gu.pflip(self.counts + self.alpha, rng=self.rng)
         return {self.outputs[0]: x}
 
+    def logpdf_array(self, X, inputs=None):
+        assert not inputs
+        X = np.asarray(X, dtype=float)
+        logps = np.full(len(X), -float('inf'))
+        valid = (X % 1 == 0) & (0 <= X) & (X < self.k)
+        logps[valid] = self.predictive_params()[X[valid].astype(int)]
+        return logps
+
+    def simulate_array(self, rowid, N, inputs=None):
+        DistributionGpm.simulate_array(self, rowid, N, inputs)
+        if rowid in self.data:
+            return np.repeat(self.data[rowid], N)
+        return np.asarray(gu.pflip(self.counts + self.alpha, size=N,
+            rng=self.rng))
+
     def logpdf_score(self):
         return Categorical.calc_logpdf_marginal(self.N, self.counts, self.alpha)
 
@@ -94,6 +128,7 @@ class Categorical(DistributionGpm):
     def set_hypers(self, hypers):
         assert hypers['alpha'] > 0
         self.alpha = hypers['alpha']
+        self._predictive = None
 
     def get_hypers(self):
         return {'alpha': self.alpha}
@@ -101,9 +136,24 @@ class Categorical(DistributionGpm):
     def get_params(self):
         return {}
 
+    def predictive_params(self):
+        """Return the vector of predictive log probabilities of each category.
+
+        The vector is cached until the suffstats or hypers change.
+        """
+        if self._predictive is None:
+            self._predictive = Categorical.calc_predictive_logps(
+                self.counts, self.alpha)
+        return self._predictive
+
     def get_suffstats(self):
         return {'N' : self.N, 'counts' : list(self.counts)}
 
+    def set_suffstats(self, suffstats):
+        self.N = suffstats['N']
+        self.counts = np.asarray(suffstats['counts'], dtype=float)
+        self._predictive = None
+
     def get_distargs(self):
         return {'k': self.k}
 
@@ -147,6 +197,10 @@ class Categorical(DistributionGpm):
         denom = log(np.sum(counts) + alpha * len(counts))
         return numer - denom
 
+    @staticmethod
+    def calc_predictive_logps(counts, alpha):
+        return np.log(alpha + counts) - log(np.sum(counts) + alpha * len(counts))
+
     @staticmethod
     def calc_logpdf_marginal(N, counts, alpha):
         K = len(counts)
@@ -17,6 +17,8 @@
 from collections import OrderedDict
 from math import log
 
+import numpy as np
+
 from scipy.special import gammaln
 
 from cgpm.primitives.distribution import DistributionGpm
@@ -51,6 +53,19 @@ class Crp(DistributionGpm):
         self.counts[x] += 1
         self.data[rowid] = x
 
+    def incorporate_array(self, rowids, X):
+        X = np.asarray(X, dtype=int)
+        # Add the tables in order of first appearance, as incorporate.
+        tables, first, counts = np.unique(
+            X, return_index=True, return_counts=True)
+        for i in np.argsort(first):
+            x = int(tables[i])
+            if x not in self.counts:
+                self.counts[x] = 0
+            self.counts[x] += int(counts[i])
+        self.N += len(X)
+        self._incorporate_array_data(rowids, X.tolist())
+
     def unincorporate(self, rowid):
         x = self.data.pop(rowid)
         self.N -= 1
@@ -80,6 +95,16 @@ class Crp(DistributionGpm):
             x = gu.log_pflip(logps, array=K, rng=self.rng)
         return {self.outputs[0]: x}
 
+    def simulate_array(self, rowid, N, inputs=None):
+        DistributionGpm.simulate_array(self, rowid, N, inputs)
+        if rowid in self.data:
+            return np.repeat(self.data[rowid], N)
+        K = sorted(self.counts) + [max(self.counts) + 1] if self.counts\
+            else [0]
+        logps = [Crp.calc_predictive_logp(x, self.N, self.counts, self.alpha)
+            for x in K]
+        return np.asarray(gu.log_pflip(logps, array=K, size=N, rng=self.rng))
+
     def logpdf_score(self):
         return Crp.calc_logpdf_marginal(self.N, self.counts, self.alpha)
 
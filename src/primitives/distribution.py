@@ -14,6 +14,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
+
+import numpy as np
+
 from cgpm.cgpm import CGpm
 from cgpm.mixtures.dim import Dim
 from cgpm.utils import general as gu
@@ -52,6 +56,45 @@ class DistributionGpm(CGpm):
         assert not inputs
         assert observation.keys() == self.outputs
 
+    def incorporate_array(self, rowids, X):
+        """Incorporate the values X of many fresh rowids at once.
+
+        The default implementation loops over `incorporate`; subclasses whose
+        sufficient statistics are sums override it with vectorized reductions.
+        """
+        for rowid, x in zip(rowids, X):
+            self.incorporate(rowid, {self.outputs[0]: x})
+
+    def restore_array(self, rowids, X, suffstats):
+        """Restore the values X of fresh rowids with their saved suffstats.
+
+        The values are recorded without being reduced; `suffstats` must be the
+        output of `get_suffstats` for the same rowids and values.
+        """
+        self._incorporate_array_data(rowids, list(X))
+        self.set_suffstats(suffstats)
+
+    def fork(self, rng=None):
+        """Return a copy of the distribution which shares its recorded data.
+
+        Containers of sufficient statistics are copied; the `data` dict is
+        shared, and the owner of either copy must replace it with a copy of
+        its own before updating the copy, see `Dim.fork`.
+        """
+        model = copy.copy(self)
+        for name, value in vars(self).iteritems():
+            if name != 'data' and isinstance(value, (dict, list, np.ndarray)):
+                setattr(model, name, copy.copy(value))
+        if rng is not None:
+            model.rng = rng
+        return model
+
+    def _incorporate_array_data(self, rowids, X):
+        """Record the values X of rowids, for overrides of incorporate_array."""
+        n_data = len(self.data)
+        self.data.update(zip(rowids, X))
+        assert len(self.data) == n_data + len(rowids)
+
     def logpdf(self, rowid, targets, constraints=None, inputs=None):
         assert rowid not in self.data
         assert not inputs
@@ -63,6 +106,24 @@ class DistributionGpm(CGpm):
         assert not inputs
         assert targets == self.outputs
 
+    def simulate_array(self, rowid, N, inputs=None):
+        """Return a numpy array of N samples of the output variable.
+
+        Unlike `simulate`, the samples are drawn with vectorized calls to the
+        rng and are not wrapped in a dictionary per sample.
+        """
+        assert not inputs
+        assert N is not None
+
+    def logpdf_array(self, X, inputs=None):
+        """Return a numpy array with the predictive logpdf of each value in X.
+
+        The default implementation loops over `logpdf`; subclasses with a
+        closed form predictive override it with a vectorized evaluation.
+        """
+        assert not inputs
+        return np.asarray([self.logpdf(None, {self.outputs[0]: x}) for x in X])
+
     ##################
     # NON-GPM METHOD #
     ##################
@@ -101,6 +162,10 @@ class DistributionGpm(CGpm):
         """Return a dictionary of sufficient statistics."""
         raise NotImplementedError
 
+    def set_suffstats(self, suffstats):
+        """Set the sufficient statistics from the output of `get_suffstats`."""
+        raise NotImplementedError
+
     def get_distargs(self):
         """Return a dictionary of distribution arguments."""
         raise NotImplementedError
@@ -16,6 +16,8 @@
 
 from math import log
 
+import numpy as np
+
 from scipy.special import gammaln
 
 from cgpm.primitives.distribution import DistributionGpm
@@ -52,6 +54,14 @@ class Exponential(DistributionGpm):
         self.sum_x += x
         self.data[rowid] = x
 
+    def incorporate_array(self, rowids, X):
+        X = np.asarray(X, dtype=float)
+        if np.any(X < 0):
+            raise ValueError('Invalid Exponential: %s' % str(X[X < 0][0]))
+        self.N += len(X)
+        self.sum_x += float(np.sum(X))
+        self._incorporate_array_data(rowids, X.tolist())
+
     def unincorporate(self, rowid):
         x = self.data.pop(rowid)
         self.N -= 1
@@ -76,6 +86,15 @@ class Exponential(DistributionGpm):
         x = self.rng.exponential(scale=1./mu)
         return {self.outputs[0]: x}
 
+    def simulate_array(self, rowid, N, inputs=None):
+        DistributionGpm.simulate_array(self, rowid, N, inputs)
+        if rowid in self.data:
+            return np.repeat(self.data[rowid], N)
+        an, bn = Exponential.posterior_hypers(
+            self.N, self.sum_x, self.a, self.b)
+        mu = self.rng.gamma(an, scale=1./bn, size=N)
+        return self.rng.exponential(scale=1./mu)
+
     def logpdf_score(self):
         return Exponential.calc_logpdf_marginal(
             self.N, self.sum_x, self.a, self.b)
@@ -102,6 +121,10 @@ class Exponential(DistributionGpm):
     def get_suffstats(self):
         return {'N': self.N, 'sum_x': self.sum_x}
 
+    def set_suffstats(self, suffstats):
+        self.N = suffstats['N']
+        self.sum_x = suffstats['sum_x']
+
     def get_distargs(self):
         return {}
 
@@ -14,6 +14,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import numpy as np
+
 from scipy.special import betaln
 
 from cgpm.primitives.distribution import DistributionGpm
@@ -53,6 +55,15 @@ class Geometric(DistributionGpm):
         self.sum_x += x
         self.data[rowid] = x
 
+    def incorporate_array(self, rowids, X):
+        X = np.asarray(X, dtype=float)
+        invalid = ~((X % 1 == 0) & (X >= 0))
+        if np.any(invalid):
+            raise ValueError('Invalid Geometric: %s' % str(X[invalid][0]))
+        self.N += len(X)
+        self.sum_x += float(np.sum(X))
+        self._incorporate_array_data(rowids, X.tolist())
+
     def unincorporate(self, rowid):
         x = self.data.pop(rowid)
         self.N -= 1
@@ -76,6 +87,14 @@ class Geometric(DistributionGpm):
         x = self.rng.geometric(pn) - 1
         return {self.outputs[0]: x}
 
+    def simulate_array(self, rowid, N, inputs=None):
+        DistributionGpm.simulate_array(self, rowid, N, inputs)
+        if rowid in self.data:
+            return np.repeat(self.data[rowid], N)
+        an, bn = Geometric.posterior_hypers(self.N, self.sum_x, self.a, self.b)
+        pn = self.rng.beta(an, bn, size=N)
+        return self.rng.geometric(pn) - 1
+
     def logpdf_score(self):
         return Geometric.calc_logpdf_marginal(
             self.N, self.sum_x, self.a, self.b)
@@ -102,6 +121,10 @@ class Geometric(DistributionGpm):
     def get_suffstats(self):
         return {'N': self.N, 'sum_x': self.sum_x}
 
+    def set_suffstats(self, suffstats):
+        self.N = suffstats['N']
+        self.sum_x = suffstats['sum_x']
+
     def get_distargs(self):
         return {}
 
@@ -49,6 +49,8 @@ class Lognormal(DistributionGpm):
         assert self.r > 0.
         assert self.s > 0.
         assert self.nu > 0.
+        # Cached parameters of the predictive, see `predictive_params`.
+        self._predictive = None
 
     def incorporate(self, rowid, observation, inputs=None):
         DistributionGpm.incorporate(self, rowid, observation, inputs)
@@ -59,22 +61,33 @@ class Lognormal(DistributionGpm):
         self.sum_log_x += log(x)
         self.sum_log_x_sq += log(x) * log(x)
         self.data[rowid] = x
+        self._predictive = None
+
+    def incorporate_array(self, rowids, X):
+        X = np.asarray(X, dtype=float)
+        if np.any(X <= 0):
+            raise ValueError('Invalid Lognormal: %s' % str(X[X <= 0][0]))
+        log_x = np.log(X)
+        self.N += len(X)
+        self.sum_log_x += float(np.sum(log_x))
+        self.sum_log_x_sq += float(np.dot(log_x, log_x))
+        self._incorporate_array_data(rowids, X.tolist())
+        self._predictive = None
 
     def unincorporate(self, rowid):
         x = self.data.pop(rowid)
         self.N -= 1
         self.sum_log_x -= log(x)
         self.sum_log_x_sq -= log(x) * log(x)
+        self._predictive = None
 
     def logpdf(self, rowid, targets, constraints=None, inputs=None):
         DistributionGpm.logpdf(self, rowid, targets, constraints, inputs)
         x = targets[self.outputs[0]]
         if x <= 0:
             return -float('inf')
-        return - log(x) + \
-            Normal.calc_predictive_logp(
-                log(x), self.N, self.sum_log_x, self.sum_log_x_sq, self.m,
-                self.r, self.s, self.nu)
+        return - log(x) + float(
+            Normal.calc_predictive_logp_t(log(x), *self.predictive_params()))
 
     @gu.simulate_many
     def simulate(self, rowid, targets, constraints=None, inputs=None, N=None):
@@ -92,6 +105,23 @@ class Lognormal(DistributionGpm):
         x = np.exp(xn)
         return {self.outputs[0]: x}
 
+    def simulate_array(self, rowid, N, inputs=None):
+        DistributionGpm.simulate_array(self, rowid, N, inputs)
+        if rowid in self.data:
+            return np.repeat(self.data[rowid], N)
+        df, loc, scale, _const = self.predictive_params()
+        return np.exp(loc + scale * self.rng.standard_t(df, size=N))
+
+    def logpdf_array(self, X, inputs=None):
+        assert not inputs
+        X = np.asarray(X, dtype=float)
+        logps = np.full(len(X), -float('inf'))
+        positive = X > 0
+        log_x = np.log(X[positive])
+        logps[positive] = -log_x + Normal.calc_predictive_logp_t(
+            log_x, *self.predictive_params())
+        return logps
+
     def logpdf_score(self):
         return -self.sum_log_x + \
             Normal.calc_logpdf_marginal(
@@ -113,6 +143,7 @@ class Lognormal(DistributionGpm):
         self.r = hypers['r']
         self.s = hypers['s']
         self.nu = hypers['nu']
+        self._predictive = None
 
     def get_hypers(self):
         return {'m': self.m, 'r': self.r, 's': self.s, 'nu': self.nu}
@@ -120,17 +151,34 @@ class Lognormal(DistributionGpm):
     def get_params(self):
         return {}
 
+    def predictive_params(self):
+        """Return (df, loc, scale, const) of the Student-t predictive of log(x).
+
+        The parameters are cached until the suffstats or hypers change.
+        """
+        if self._predictive is None:
+            self._predictive = Normal.calc_predictive_params(
+                self.N, self.sum_log_x, self.sum_log_x_sq, self.m, self.r,
+                self.s, self.nu)
+        return self._predictive
+
     def get_suffstats(self):
         return {'N': self.N, 'sum_log_x': self.sum_log_x,
             'sum_log_x_sq': self.sum_log_x_sq}
 
+    def set_suffstats(self, suffstats):
+        self.N = suffstats['N']
+        self.sum_log_x = suffstats['sum_log_x']
+        self.sum_log_x_sq = suffstats['sum_log_x_sq']
+        self._predictive = None
+
     def get_distargs(self):
         return {}
 
     @staticmethod
     def construct_hyper_grids(X, n_grid=30):
         grids = dict()
-        grids['m'] = gu.log_linspace(1e-4, max(X), n_grid)
+        grids['m'] = gu.log_linspace(1e-4, np.max(X), n_grid)
         grids['r'] = gu.log_linspace(.1, float(len(X)), n_grid)
         grids['nu'] = gu.log_linspace(.1, float(len(X)), n_grid)
         grids['s'] = gu.log_linspace(.1, float(len(X)), n_grid)
@@ -60,6 +60,8 @@ class Normal(DistributionGpm):
         assert self.s > 0.
         assert self.r > 0.
         assert self.nu > 0.
+        # Cached parameters of the predictive, see `predictive_params`.
+        self._predictive = None
 
     def incorporate(self, rowid, observation, inputs=None):
         DistributionGpm.incorporate(self, rowid, observation, inputs)
@@ -68,19 +70,27 @@ class Normal(DistributionGpm):
         self.sum_x += x
         self.sum_x_sq += x*x
         self.data[rowid] = x
+        self._predictive = None
+
+    def incorporate_array(self, rowids, X):
+        X = np.asarray(X, dtype=float)
+        self.N += len(X)
+        self.sum_x += float(np.sum(X))
+        self.sum_x_sq += float(np.dot(X, X))
+        self._incorporate_array_data(rowids, X.tolist())
+        self._predictive = None
 
     def unincorporate(self, rowid):
         x = self.data.pop(rowid)
         self.N -= 1
         self.sum_x -= x
         self.sum_x_sq -= x*x
+        self._predictive = None
 
     def logpdf(self, rowid, targets, constraints=None, inputs=None):
         DistributionGpm.logpdf(self, rowid, targets, constraints, inputs)
         x = targets[self.outputs[0]]
-        return Normal.calc_predictive_logp(
-            x, self.N, self.sum_x, self.sum_x_sq, self.m, self.r,
-            self.s, self.nu)
+        return float(Normal.calc_predictive_logp_t(x, *self.predictive_params()))
 
     @gu.simulate_many
     def simulate(self, rowid, targets, constraints=None, inputs=None, N=None):
@@ -93,6 +103,18 @@ class Normal(DistributionGpm):
         x = self.rng.normal(loc=mu, scale=rho**-.5)
         return {self.outputs[0]: x}
 
+    def simulate_array(self, rowid, N, inputs=None):
+        DistributionGpm.simulate_array(self, rowid, N, inputs)
+        if rowid in self.data:
+            return np.repeat(self.data[rowid], N)
+        df, loc, scale, _const = self.predictive_params()
+        return loc + scale * self.rng.standard_t(df, size=N)
+
+    def logpdf_array(self, X, inputs=None):
+        assert not inputs
+        return Normal.calc_predictive_logp_t(
+            np.asarray(X, dtype=float), *self.predictive_params())
+
     def logpdf_score(self):
         return Normal.calc_logpdf_marginal(
             self.N, self.sum_x, self.sum_x_sq, self.m, self.r, self.s, self.nu)
@@ -112,6 +134,7 @@ class Normal(DistributionGpm):
         self.r = hypers['r']
         self.s = hypers['s']
         self.nu = hypers['nu']
+        self._predictive = None
 
     def get_hypers(self):
         return {'m': self.m, 'r': self.r, 's': self.s, 'nu': self.nu}
@@ -122,9 +145,26 @@ class Normal(DistributionGpm):
     def get_suffstats(self):
         return {'N': self.N, 'sum_x': self.sum_x, 'sum_x_sq': self.sum_x_sq}
 
+    def set_suffstats(self, suffstats):
+        self.N = suffstats['N']
+        self.sum_x = suffstats['sum_x']
+        self.sum_x_sq = suffstats['sum_x_sq']
+        self._predictive = None
+
     def get_distargs(self):
         return {}
 
+    def predictive_params(self):
+        """Return (df, loc, scale, const) of the Student-t predictive.
+
+        The parameters are cached until the suffstats or hypers change.
+        """
+        if self._predictive is None:
+            self._predictive = Normal.calc_predictive_params(
+                self.N, self.sum_x, self.sum_x_sq, self.m, self.r, self.s,
+                self.nu)
+        return self._predictive
+
     @staticmethod
     def construct_hyper_grids(X, n_grid=30):
         grids = dict()
@@ -132,7 +172,7 @@ class Normal(DistributionGpm):
         N = len(X) + 1.
         ssqdev = np.var(X) * len(X) + 1.
         # Data dependent heuristics.
-        grids['m'] = np.linspace(min(X), max(X) + 5, n_grid)
+        grids['m'] = np.linspace(np.min(X), np.max(X) + 5, n_grid)
         grids['r'] = gu.log_linspace(1. / N, N, n_grid)
         grids['s'] = gu.log_linspace(ssqdev / 100., ssqdev, n_grid)
         grids['nu'] = gu.log_linspace(1., N, n_grid) # df >= 1
@@ -172,6 +212,22 @@ class Normal(DistributionGpm):
         ZM = Normal.calc_log_Z(rm, sm, num)
         return -.5 * LOG2PI + ZM - ZN
 
+    @staticmethod
+    def calc_predictive_params(N, sum_x, sum_x_sq, m, r, s, nu):
+        # The posterior predictive is a Student-t with nun degrees of freedom,
+        # location mn and squared scale sn*(rn+1)/(rn*nun).
+        mn, rn, sn, nun = Normal.posterior_hypers(
+            N, sum_x, sum_x_sq, m, r, s, nu)
+        scale = (sn * (rn + 1.) / (rn * nun))**.5
+        const = lgamma((nun + 1.)/2.) - lgamma(nun/2.) \
+            - .5 * (log(nun) + LOGPI) - log(scale)
+        return nun, mn, scale, const
+
+    @staticmethod
+    def calc_predictive_logp_t(x, df, loc, scale, const):
+        z = (x - loc) / scale
+        return const - (df + 1.)/2. * np.log1p(z*z / df)
+
     @staticmethod
     def calc_logpdf_marginal(N, sum_x, sum_x_sq, m, r, s, nu):
         _mn, rn, sn, nun = Normal.posterior_hypers(
@@ -200,7 +256,7 @@ class Normal(DistributionGpm):
             + lgamma(nu/2.))
 
     @staticmethod
-    def sample_parameters(m, r, s, nu, rng):
-        rho = rng.gamma(nu/2., scale=2./s)
+    def sample_parameters(m, r, s, nu, rng, size=None):
+        rho = rng.gamma(nu/2., scale=2./s, size=size)
         mu = rng.normal(loc=m, scale=1./(rho*r)**.5)
         return mu, rho
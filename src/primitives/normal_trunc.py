@@ -66,6 +66,17 @@ class NormalTrunc(DistributionGpm):
         self.sum_x_sq += x*x
         self.data[rowid] = x
 
+    def incorporate_array(self, rowids, X):
+        X = np.asarray(X, dtype=float)
+        invalid = ~((self.l <= X) & (X <= self.h))
+        if np.any(invalid):
+            raise ValueError('Invalid NormalTrunc(%f,%f): %s'
+                % (self.l, self.h, str(X[invalid][0])))
+        self.N += len(X)
+        self.sum_x += float(np.sum(X))
+        self.sum_x_sq += float(np.dot(X, X))
+        self._incorporate_array_data(rowids, X.tolist())
+
     def unincorporate(self, rowid):
         x = self.data.pop(rowid)
         self.N -= 1
@@ -96,6 +107,23 @@ class NormalTrunc(DistributionGpm):
         else:
             raise RuntimeError('NormalTrunc failed to rejection sample.')
 
+    def simulate_array(self, rowid, N, inputs=None):
+        DistributionGpm.simulate_array(self, rowid, N, inputs)
+        if rowid in self.data:
+            return np.repeat(self.data[rowid], N)
+        # Rejection sample in batches, refilling only the rejected draws.
+        x = np.full(N, np.nan)
+        reject = np.ones(N, dtype=bool)
+        max_iters = 1000
+        for i in xrange(max_iters):
+            x[reject] = self.rng.normal(
+                loc=self.mu, scale=self.sigma, size=np.sum(reject))
+            reject = (x < self.l) | (self.h < x)
+            if not np.any(reject):
+                return x
+        else:
+            raise RuntimeError('NormalTrunc failed to rejection sample.')
+
     def logpdf_score(self):
         data_logp = NormalTrunc.calc_log_likelihood(
             self.N, self.sum_x, self.sum_x_sq, self.sigma, self.mu)
@@ -141,6 +169,11 @@ class NormalTrunc(DistributionGpm):
     def get_suffstats(self):
         return {'N': self.N, 'sum_x': self.sum_x, 'sum_x_sq': self.sum_x_sq}
 
+    def set_suffstats(self, suffstats):
+        self.N = suffstats['N']
+        self.sum_x = suffstats['sum_x']
+        self.sum_x_sq = suffstats['sum_x_sq']
+
     def get_distargs(self):
         return {'l':self.l, 'h':self.h}
 
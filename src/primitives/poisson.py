@@ -56,6 +56,16 @@ class Poisson(DistributionGpm):
         self.sum_log_fact_x += gammaln(x+1)
         self.data[rowid] = x
 
+    def incorporate_array(self, rowids, X):
+        X = np.asarray(X, dtype=float)
+        invalid = ~((X % 1 == 0) & (X >= 0))
+        if np.any(invalid):
+            raise ValueError('Invalid Poisson: %s' % str(X[invalid][0]))
+        self.N += len(X)
+        self.sum_x += float(np.sum(X))
+        self.sum_log_fact_x += float(np.sum(gammaln(X+1)))
+        self._incorporate_array_data(rowids, X.tolist())
+
     def unincorporate(self, rowid):
         x = self.data.pop(rowid)
         self.N -= 1
@@ -80,6 +90,14 @@ class Poisson(DistributionGpm):
         x = self.rng.negative_binomial(an, bn/(bn+1.))
         return {self.outputs[0]: x}
 
+    def simulate_array(self, rowid, N, inputs=None):
+        DistributionGpm.simulate_array(self, rowid, N, inputs)
+        if rowid in self.data:
+            return np.repeat(self.data[rowid], N)
+        an, bn = Poisson.posterior_hypers(
+            self.N, self.sum_x, self.a, self.b)
+        return self.rng.negative_binomial(an, bn/(bn+1.), size=N)
+
     def logpdf_score(self):
         return Poisson.calc_logpdf_marginal(
             self.N, self.sum_x, self.sum_log_fact_x, self.a, self.b)
@@ -107,6 +125,11 @@ class Poisson(DistributionGpm):
         return {'N': self.N, 'sum_x' : self.sum_x,
             'sum_log_fact_x': self.sum_log_fact_x}
 
+    def set_suffstats(self, suffstats):
+        self.N = suffstats['N']
+        self.sum_x = suffstats['sum_x']
+        self.sum_log_fact_x = suffstats['sum_log_fact_x']
+
     def get_distargs(self):
         return {}
 
@@ -67,6 +67,16 @@ class Vonmises(DistributionGpm):
         self.sum_cos_x += cos(x)
         self.data[rowid] = x
 
+    def incorporate_array(self, rowids, X):
+        X = np.asarray(X, dtype=float)
+        invalid = ~((0 <= X) & (X <= 2*pi))
+        if np.any(invalid):
+            raise ValueError('Invalid Vonmises: %s' % str(X[invalid][0]))
+        self.N += len(X)
+        self.sum_sin_x += float(np.sum(np.sin(X)))
+        self.sum_cos_x += float(np.sum(np.cos(X)))
+        self._incorporate_array_data(rowids, X.tolist())
+
     def unincorporate(self, rowid):
         x = self.data.pop(rowid)
         self.N -= 1
@@ -95,6 +105,15 @@ class Vonmises(DistributionGpm):
         assert 0 <= x <= 2*pi
         return {self.outputs[0]: x}
 
+    def simulate_array(self, rowid, N, inputs=None):
+        DistributionGpm.simulate_array(self, rowid, N, inputs)
+        if rowid in self.data:
+            return np.repeat(self.data[rowid], N)
+        an, bn = Vonmises.posterior_hypers(
+            self.N, self.sum_sin_x, self.sum_cos_x, self.a, self.b, self.k)
+        mu = self.rng.vonmises(bn-pi, an, size=N) + pi
+        return self.rng.vonmises(mu-pi, self.k) + pi
+
     def logpdf_score(self):
         return Vonmises.calc_logpdf_marginal(
             self.N, self.sum_sin_x, self.sum_cos_x, self.a, self.b, self.k)
@@ -124,6 +143,11 @@ class Vonmises(DistributionGpm):
         return {'N': self.N, 'sum_sin_x' : self.sum_sin_x,
             'sum_cos_x' : self.sum_cos_x}
 
+    def set_suffstats(self, suffstats):
+        self.N = suffstats['N']
+        self.sum_sin_x = suffstats['sum_sin_x']
+        self.sum_cos_x = suffstats['sum_cos_x']
+
     def get_distargs(self):
         return {}
 
@@ -35,6 +35,11 @@ class RandomForest(CGpm):
     """RandomForest conditional GPM over k variables, with uniform noise model.
 
     p(x|Y,D) = \alpha*(1/k) + (1-\alpha)*RF(x|Y,D)
+
+    The forest is refit from scratch every `refit_every` transitions (default
+    1, every transition), both given in distargs. In between, `warm_trees`
+    new trees (default 0) are grown on the current data by warm starting the
+    existing forest.
     """
 
     def __init__(self, outputs, inputs, k=None, hypers=None, params=None,
@@ -52,6 +57,11 @@ class RandomForest(CGpm):
         # XXX WHATTA HACK. BayesDB passes in top-level kwargs, not in distargs.
         self.k = k if k is not None else int(distargs['k'])
         self.p = len(distargs['inputs']['stattypes'])
+        # Schedule of the forest refits.
+        self.refit_every = int(distargs.get('refit_every', 1))
+        self.warm_trees = int(distargs.get('warm_trees', 0))
+        assert self.refit_every >= 1
+        assert self.warm_trees >= 0
         # Sufficient statistics.
         self.N = 0
         self.data = Data(x=OrderedDict(), Y=OrderedDict())
@@ -62,6 +72,9 @@ class RandomForest(CGpm):
         self.regressor = params.get('forest', None)
         if self.regressor is None:
             self.regressor = RandomForestClassifier(random_state=self.rng)
+        self.n_estimators = params.get(
+            'n_estimators', self.regressor.get_params()['n_estimators'])
+        self.refit_count = params.get('refit_count', 0)
 
     def incorporate(self, rowid, observation, inputs=None):
         assert rowid not in self.data.x
@@ -91,17 +104,85 @@ class RandomForest(CGpm):
         return RandomForest.calc_predictive_logp(
             x, y, self.regressor, self.counts, self.alpha)
 
-    @gu.simulate_many
     def simulate(self, rowid, targets, constraints=None, inputs=None, N=None):
         assert targets == self.outputs
         assert not constraints
+        samples = self.simulate_array(rowid, 1 if N is None else N, inputs)
+        if N is None:
+            return {self.outputs[0]: int(samples[0])}
+        return [{self.outputs[0]: int(x)} for x in samples]
+
+    def simulate_array(self, rowid, N, inputs=None):
         if rowid in self.data.x:
-            return {self.outputs[0]: self.data.x[rowid]}
-        logps = [self.logpdf(rowid, {targets[0]: x}, None, inputs)
-            for x in xrange(self.k)
+            return np.repeat(self.data.x[rowid], N)
+        y = self.preprocess_inputs(inputs)
+        logps = RandomForest.calc_predictive_logps(
+            [y], self.regressor, self.counts, self.alpha)[0]
+        return np.asarray(gu.log_pflip(logps, size=N, rng=self.rng))
+
+    def logpdf_bulk(self, rowids, targets_list, constraints_list=None,
+            inputs_list=None):
+        """Evaluate multiple queries at once, with one forest prediction."""
+        if constraints_list is None:
+            constraints_list = [{} for i in xrange(len(rowids))]
+        if inputs_list is None:
+            inputs_list = [{} for i in xrange(len(rowids))]
+        assert len(rowids) == len(targets_list)
+        assert len(rowids) == len(constraints_list)
+        assert len(rowids) == len(inputs_list)
+        xs, Y = [], []
+        for rowid, targets, constraints, inputs in zip(
+                rowids, targets_list, constraints_list, inputs_list):
+            assert not constraints
+            assert targets.keys() == self.outputs
+            assert rowid not in self.data.x
+            Y.append(self.preprocess_inputs(inputs))
+            try:
+                xs.append(self.preprocess_targets(targets))
+            except IndexError:
+                xs.append(None)
+        logps = RandomForest.calc_predictive_logps(
+            Y, self.regressor, self.counts, self.alpha)
+        return [
+            logps[i, x] if x is not None else -float('inf')
+            for i, x in enumerate(xs)
+        ]
+
+    def simulate_bulk(self, rowids, targets_list, constraints_list=None,
+            inputs_list=None, Ns=None):
+        """Evaluate multiple queries at once, with one forest prediction."""
+        if constraints_list is None:
+            constraints_list = [{} for i in xrange(len(rowids))]
+        if inputs_list is None:
+            inputs_list = [{} for i in xrange(len(rowids))]
+        if Ns is None:
+            Ns = [None for i in xrange(len(rowids))]
+        assert len(rowids) == len(targets_list)
+        assert len(rowids) == len(constraints_list)
+        assert len(rowids) == len(inputs_list)
+        assert len(rowids) == len(Ns)
+        for targets, constraints in zip(targets_list, constraints_list):
+            assert targets == self.outputs
+            assert not constraints
+        # Predict the class probabilities of all unobserved rows at once.
+        unobserved = [
+            i for i, rowid in enumerate(rowids) if rowid not in self.data.x
         ]
-        x = gu.log_pflip(logps, rng=self.rng)
-        return {self.outputs[0]: x}
+        logps = RandomForest.calc_predictive_logps(
+            [self.preprocess_inputs(inputs_list[i]) for i in unobserved],
+            self.regressor, self.counts, self.alpha)
+        logps = dict(zip(unobserved, logps))
+        samples = []
+        for i, (rowid, N) in enumerate(zip(rowids, Ns)):
+            size = 1 if N is None else N
+            if i in logps:
+                xs = gu.log_pflip(logps[i], size=size, rng=self.rng)
+            else:
+                xs = [self.data.x[rowid]] * size
+            samples.append(
+                {self.outputs[0]: int(xs[0])} if N is None
+                else [{self.outputs[0]: int(x)} for x in xs])
+        return samples
 
     def logpdf_score(self):
         return RandomForest.calc_log_likelihood(
@@ -121,16 +202,32 @@ class RandomForest(CGpm):
         for i in xrange(num_transitions):
             # Transition noise parameter.
             alphas = np.linspace(0.01, 0.99, 30)
-            alpha_logps = [
-                RandomForest.calc_log_likelihood(
-                    self.data.x.values(), self.data.Y.values(),
-                    self.regressor, self.counts, a)
-                for a in alphas
-            ]
+            alpha_logps = RandomForest.calc_log_likelihood_grid(
+                self.data.x.values(), self.data.Y.values(),
+                self.regressor, self.counts, alphas)
             self.alpha = gu.log_pflip(alpha_logps, array=alphas, rng=self.rng)
             # Transition forest.
             if len(self.data.Y) > 0:
-                self.regressor.fit(self.data.Y.values(), self.data.x.values())
+                self._fit_forest()
+
+    def _fit_forest(self):
+        X, Y = self.data.x.values(), self.data.Y.values()
+        # Trees grown by a warm start must share the classes of the forest.
+        warm = hasattr(self.regressor, 'classes_') \
+            and set(X) == set(self.regressor.classes_) \
+            and self.refit_count + 1 < self.refit_every
+        if not warm:
+            self.regressor.set_params(
+                warm_start=False, n_estimators=self.n_estimators)
+            self.regressor.fit(Y, X)
+            self.refit_count = 0
+            return
+        if self.warm_trees > 0:
+            self.regressor.set_params(
+                warm_start=True,
+                n_estimators=len(self.regressor.estimators_)+self.warm_trees)
+            self.regressor.fit(Y, X)
+        self.refit_count += 1
 
     def set_hypers(self, hypers):
         return
@@ -141,7 +238,9 @@ class RandomForest(CGpm):
     def get_params(self):
         return {
             'forest': self.regressor,
-            'alpha': self.alpha
+            'alpha': self.alpha,
+            'n_estimators': self.n_estimators,
+            'refit_count': self.refit_count,
         }
 
     def get_suffstats(self):
@@ -152,6 +251,8 @@ class RandomForest(CGpm):
             'inputs': {'stattypes': self.stattypes},
             'k': self.k,
             'p': self.p,
+            'refit_every': self.refit_every,
+            'warm_trees': self.warm_trees,
         }
 
     @staticmethod
@@ -185,12 +286,23 @@ class RandomForest(CGpm):
     ##################
 
     def preprocess(self, targets, inputs):
+        y = self.preprocess_inputs(inputs)
+        x = self.preprocess_targets(targets)
+        return x, y
+
+    def preprocess_targets(self, targets):
         # Retrieve the value x of the targets variable.
-        if self.outputs[0] in inputs:
-            raise ValueError('Cannot specify output as input: %s' % (inputs,))
         x = targets.get(self.outputs[0], None)
         if x is None or np.isnan(x):
             raise ValueError('Invalid targets: %s' % (targets,))
+        if not (x % 1 == 0 and 0 <= x < self.k):
+            raise IndexError(
+                'RandomForest category not in [0..%s): %s.' % (self.k, x))
+        return int(x)
+
+    def preprocess_inputs(self, inputs):
+        if self.outputs[0] in inputs:
+            raise ValueError('Cannot specify output as input: %s' % (inputs,))
         # Retrieve the inputs values.
         if not set.issubset(set(self.inputs), set(inputs.keys())):
             raise ValueError('RandomForest requires inputs %s' % (self.inputs,))
@@ -201,16 +313,50 @@ class RandomForest(CGpm):
         if len(y) != self.p:
             raise ValueError(
                 'RandomForest requires input length %s: %s' % (self.p, y))
-        if not (x % 1 == 0 and 0 <= x < self.k):
-            raise IndexError(
-                'RandomForest category not in [0..%s): %s.' % (self.k, x))
-        return int(x), y
+        return y
 
     @staticmethod
     def calc_log_likelihood(X, Y, regressor, counts, alpha):
-        return sum(
-            RandomForest.calc_predictive_logp(x, y, regressor, counts, alpha)
-            for x, y in zip(X,Y))
+        return RandomForest.calc_log_likelihood_grid(
+            X, Y, regressor, counts, [alpha])[0]
+
+    @staticmethod
+    def calc_log_likelihood_grid(X, Y, regressor, counts, alphas):
+        # The forest is evaluated once on all rows, and its log probabilities
+        # are reused for every alpha.
+        alphas = np.asarray(alphas, dtype=float)
+        logp_uniform = -np.log(len(counts))
+        if len(X) == 0 or not hasattr(regressor, 'classes_'):
+            return np.full(len(alphas), len(X) * logp_uniform)
+        classes = list(regressor.classes_)
+        known = np.asarray([x in classes for x in X])
+        logps = np.full(len(alphas), np.sum(~known) * logp_uniform)
+        logps += np.sum(~known) * np.log(alphas)
+        if np.any(known):
+            Y_known = np.asarray(Y, dtype=float)[known]
+            index = [classes.index(x) for x, k in zip(X, known) if k]
+            logp_rf = regressor.predict_log_proba(Y_known)[
+                np.arange(len(index)), index]
+            logps += np.sum(np.logaddexp(
+                np.log(alphas)[:,np.newaxis] + logp_uniform,
+                np.log(1-alphas)[:,np.newaxis] + logp_rf[np.newaxis,:]),
+                axis=1)
+        return logps
+
+    @staticmethod
+    def calc_predictive_logps(Y, regressor, counts, alpha):
+        # Return the log probability of every class (columns) given each row
+        # of inputs in Y, from a single prediction of the forest.
+        logp_uniform = -np.log(len(counts))
+        if not hasattr(regressor, 'classes_'):
+            return np.full((len(Y), len(counts)), logp_uniform)
+        logps = np.full((len(Y), len(counts)), np.log(alpha) + logp_uniform)
+        if len(Y) > 0:
+            logp_rf = regressor.predict_log_proba(np.asarray(Y, dtype=float))
+            logps[:,regressor.classes_] = np.logaddexp(
+                np.log(alpha) + logp_uniform,
+                np.log(1-alpha) + logp_rf)
+        return logps
 
     @staticmethod
     def calc_predictive_logp(x, y, regressor, counts, alpha):
@@ -25,6 +25,8 @@ import numpy as np
 
 from numpy.linalg import det
 
+from scipy.linalg import cho_solve
+from scipy.linalg import solve_triangular
 from scipy.special import gammaln
 
 from cgpm.cgpm import CGpm
@@ -90,6 +92,14 @@ class LinearRegression(CGpm):
         self.b = hypers.get('b', 1.)
         self.mu = hypers.get('mu', np.zeros(self.p))
         self.V = hypers.get('V', np.eye(self.p))
+        # Prior terms of the posterior, which do not depend on the data.
+        self.V_inv = np.linalg.inv(self.V)
+        self.V_inv_mu = np.dot(self.V_inv, self.mu)
+        self.mu_V_inv_mu = np.dot(self.mu, self.V_inv_mu)
+        self.logdet_V_inv = np.linalg.slogdet(self.V_inv)[1]
+        # Sufficient statistics, and the lower Cholesky factor L of the
+        # posterior precision V_inv + X'X, maintained by rank-one updates.
+        self._rebuild_suffstats()
 
     def incorporate(self, rowid, observation, inputs=None):
         assert rowid not in self.data.x
@@ -100,22 +110,30 @@ class LinearRegression(CGpm):
         self.N += 1
         self.data.x[rowid] = x
         self.data.Y[rowid] = y
+        self._update_suffstats(x, y, 1)
 
     def unincorporate(self, rowid):
         try:
-            del self.data.x[rowid]
-            del self.data.Y[rowid]
+            x = self.data.x.pop(rowid)
+            y = self.data.Y.pop(rowid)
         except KeyError:
             raise ValueError('No such observation: %d' % rowid)
         self.N -= 1
+        self._update_suffstats(x, y, -1)
 
     def logpdf(self, rowid, targets, constraints=None, inputs=None):
         assert rowid not in self.data.x
         assert not constraints
         xt, yt = self.preprocess(targets, inputs)
-        return LinearRegression.calc_predictive_logp(
-            xt, yt, self.N, self.data.Y.values(), self.data.x.values(), self.a,
-            self.b, self.mu, self.V)
+        # Equation 19, which reduces to a Student-t with 2an degrees of
+        # freedom, location yt'mun and squared scale bn/an*(1 + yt'Vn yt).
+        an, bn = self.posterior_ab()
+        mun, _logdet, _quad = self.posterior_params()
+        u = solve_triangular(self.L, yt, lower=True)
+        s = 1. + np.dot(u, u)
+        m = np.dot(yt, mun)
+        return gammaln(an+.5) - gammaln(an) - .5*log(2*pi*bn*s) \
+            - (an+.5) * log(1. + (xt-m)**2 / (2.*bn*s))
 
     @gu.simulate_many
     def simulate(self, rowid, targets, constraints=None, inputs=None, N=None):
@@ -128,17 +146,67 @@ class LinearRegression(CGpm):
         x = self.rng.normal(np.dot(yt, b), np.sqrt(sigma2))
         return {self.outputs[0]: x}
 
+    def simulate_array(self, rowid, N, inputs=None):
+        if rowid in self.data.x:
+            return np.repeat(self.data.x[rowid], N)
+        xt, yt = self.preprocess(None, inputs)
+        an, bn = self.posterior_ab()
+        mun, _logdet, _quad = self.posterior_params()
+        # The regression w'yt for w ~ MVNormal(mun, sigma2*Vn) is univariate
+        # normal, so sample it directly rather than sampling N vectors w.
+        sigma2 = 1./self.rng.gamma(an, scale=1./bn, size=N)
+        mean = np.dot(yt, mun)
+        u = solve_triangular(self.L, yt, lower=True)
+        var = np.dot(u, u)
+        regression = self.rng.normal(mean, np.sqrt(sigma2 * var))
+        return self.rng.normal(regression, np.sqrt(sigma2))
+
     def logpdf_score(self):
-        return LinearRegression.calc_logpdf_marginal(
-            self.N, self.data.Y.values(), self.data.x.values(),
-            self.a, self.b, self.mu, self.V)
+        # Equation 19.
+        an, bn = self.posterior_ab()
+        _mun, logdet, _quad = self.posterior_params()
+        Z0 = LinearRegression.calc_log_Z_logdet(
+            self.a, self.b, self.logdet_V_inv)
+        ZN = LinearRegression.calc_log_Z_logdet(an, bn, logdet)
+        return (-self.N/2.)*LOG2PI + ZN - Z0
+
+    def logpdf_score_grid(self, hyper, grid):
+        """Return logpdf_score with hyper set to each value in grid."""
+        # Only an and bn depend on a and b, so the grid reuses the posterior.
+        a = np.asarray(grid, dtype=float) if hyper == 'a' else self.a
+        b = np.asarray(grid, dtype=float) if hyper == 'b' else self.b
+        _mun, logdet, quad = self.posterior_params()
+        an = a + self.N/2.
+        bn = b + .5 * (self.mu_V_inv_mu + self.yTy - quad)
+        Z0 = LinearRegression.calc_log_Z_logdet(a, b, self.logdet_V_inv)
+        ZN = LinearRegression.calc_log_Z_logdet(an, bn, logdet)
+        return (-self.N/2.)*LOG2PI + ZN - Z0
 
     def simulate_params(self):
-        an, bn, mun, Vn_inv = LinearRegression.posterior_hypers(
-            self.N, self.data.Y.values(), self.data.x.values(), self.a, self.b,
-            self.mu, self.V)
-        return LinearRegression.sample_parameters(
-            an, bn, mun, np.linalg.inv(Vn_inv), self.rng)
+        an, bn = self.posterior_ab()
+        mun, _logdet, _quad = self.posterior_params()
+        Vn = cho_solve((self.L, True), np.eye(self.p))
+        return LinearRegression.sample_parameters(an, bn, mun, Vn, self.rng)
+
+    def posterior_ab(self):
+        """Return the posterior hyperparameters an, bn of sigma2."""
+        _mun, _logdet, quad = self.posterior_params()
+        an = self.a + self.N/2.
+        bn = self.b + .5 * (self.mu_V_inv_mu + self.yTy - quad)
+        return an, bn
+
+    def posterior_params(self):
+        """Return the posterior mean mun, log det(Vn_inv), and mun'Vn_inv mun.
+
+        The terms do not depend on the hyperparameters a and b, so they are
+        cached until the next incorporate or unincorporate.
+        """
+        if self._posterior is None:
+            r = self.V_inv_mu + self.XTy
+            mun = cho_solve((self.L, True), r)
+            logdet = 2. * np.sum(np.log(np.diag(self.L)))
+            self._posterior = (mun, logdet, np.dot(r, mun))
+        return self._posterior
 
     ##################
     # NON-GPM METHOD #
@@ -275,6 +343,27 @@ class LinearRegression(CGpm):
             p, counts = cca['k'], int(cca['k'])+1
         return int(p), counts
 
+    def _rebuild_suffstats(self):
+        Y = np.asarray(self.data.Y.values(), dtype=float).reshape(-1, self.p)
+        x = np.asarray(self.data.x.values(), dtype=float)
+        self.XTX = np.dot(Y.T, Y)
+        self.XTy = np.dot(Y.T, x)
+        self.yTy = np.dot(x, x)
+        self.L = np.linalg.cholesky(self.V_inv + self.XTX)
+        self._posterior = None
+
+    def _update_suffstats(self, x, y, sign):
+        y = np.asarray(y, dtype=float)
+        self.XTX += sign * np.outer(y, y)
+        self.XTy += sign * x * y
+        self.yTy += sign * x**2
+        try:
+            self.L = gu.cholesky_update(self.L, y, downdate=sign<0)
+        except np.linalg.LinAlgError:
+            # Roundoff made the downdate indefinite, so factor from scratch.
+            self.L = np.linalg.cholesky(self.V_inv + self.XTX)
+        self._posterior = None
+
     @staticmethod
     def calc_predictive_logp(xs, ys, N, Y, x, a, b, mu, V):
         # Equation 19.
@@ -325,6 +414,11 @@ class LinearRegression(CGpm):
         # Equation 19.
         return gammaln(a) + log(sqrt(1./det(V_inv))) - a * np.log(b)
 
+    @staticmethod
+    def calc_log_Z_logdet(a, b, logdet_V_inv):
+        # Equation 19, given log det(V_inv).
+        return gammaln(a) - .5 * logdet_V_inv - a * np.log(b)
+
     @staticmethod
     def sample_parameters(a, b, mu, V, rng):
         sigma2 = 1./rng.gamma(a, scale=1./b)
@@ -361,4 +455,5 @@ class LinearRegression(CGpm):
         Y = ((int(k), v) for k, v in metadata['data']['Y'].iteritems())
         linreg.data = Data(x=OrderedDict(x), Y=OrderedDict(Y))
         linreg.N = metadata['N']
+        linreg._rebuild_suffstats()
         return linreg
@@ -66,6 +66,8 @@ class OrdinaryLeastSquares(CGpm):
         self.regressor = params.get('regressor', None)
         if self.regressor is None:
             self.regressor = LinearRegression()
+        # Sufficient statistics of the normal equations.
+        self._rebuild_suffstats()
 
     def incorporate(self, rowid, observation, inputs=None):
         assert rowid not in self.data.x
@@ -76,14 +78,16 @@ class OrdinaryLeastSquares(CGpm):
         self.N += 1
         self.data.x[rowid] = x
         self.data.Y[rowid] = y
+        self._update_suffstats(x, y, 1)
 
     def unincorporate(self, rowid):
         try:
-            del self.data.x[rowid]
-            del self.data.Y[rowid]
+            x = self.data.x.pop(rowid)
+            y = self.data.Y.pop(rowid)
         except KeyError:
             raise ValueError('No such observation: %d' % rowid)
         self.N -= 1
+        self._update_suffstats(x, y, -1)
 
     def logpdf(self, rowid, targets, constraints=None, inputs=None):
         assert rowid not in self.data.x
@@ -112,13 +116,20 @@ class OrdinaryLeastSquares(CGpm):
     ##################
 
     def transition(self, N=None):
-        # Transition forest.
-        if len(self.data.Y) > 0:
-            self.regressor.fit(self.data.Y.values(), self.data.x.values())
-            predictions = self.regressor.predict(self.data.Y.values())
-            self.noise = \
-                np.linalg.norm(self.data.x.values() - predictions)\
-                / np.sqrt(self.N)
+        # Solve the normal equations of the centered data from the suffstats,
+        # which gives the same minimum norm fit as LinearRegression.fit.
+        if self.N > 0:
+            Y_mean = self.Y_sum / self.N
+            x_mean = self.x_sum / self.N
+            YTY = self.YTY - self.N * np.outer(Y_mean, Y_mean)
+            YTx = self.YTx - self.N * Y_mean * x_mean
+            xTx = self.xTx - self.N * x_mean**2
+            coef = np.linalg.lstsq(YTY, YTx, rcond=None)[0]
+            self.regressor.coef_ = coef
+            self.regressor.intercept_ = x_mean - np.dot(Y_mean, coef)
+            # Residual sum of squares, which roundoff may make negative.
+            rss = xTx - 2 * np.dot(coef, YTx) + np.dot(coef, np.dot(YTY, coef))
+            self.noise = np.sqrt(max(rss, 0.) / self.N)
 
     def transition_params(self):
         return
@@ -185,6 +196,23 @@ class OrdinaryLeastSquares(CGpm):
             raise ValueError('Invalid stattype, stargs: %s, %s.' % (cct, cca))
         return int(p), counts
 
+    def _rebuild_suffstats(self):
+        Y = np.asarray(self.data.Y.values(), dtype=float).reshape(-1, self.p-1)
+        x = np.asarray(self.data.x.values(), dtype=float)
+        self.Y_sum = np.sum(Y, axis=0)
+        self.x_sum = np.sum(x)
+        self.YTY = np.dot(Y.T, Y)
+        self.YTx = np.dot(Y.T, x)
+        self.xTx = np.dot(x, x)
+
+    def _update_suffstats(self, x, y, sign):
+        y = np.asarray(y, dtype=float)
+        self.Y_sum += sign * y
+        self.x_sum += sign * x
+        self.YTY += sign * np.outer(y, y)
+        self.YTx += sign * x * y
+        self.xTx += sign * x**2
+
     def preprocess(self, targets, inputs):
         # Retrieve the value x of the target variable.
         if self.outputs[0] in inputs:
@@ -248,6 +276,7 @@ class OrdinaryLeastSquares(CGpm):
         Y = ((int(k), v) for k, v in metadata['data']['Y'].iteritems())
         ols.data = Data(x=OrderedDict(x), Y=OrderedDict(Y))
         ols.N = metadata['N']
+        ols._rebuild_suffstats()
         return ols
 
 HALF_LOG2PI = 0.5 * math.log(2 * math.pi)
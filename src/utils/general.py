@@ -56,6 +56,25 @@ def merged(*dicts):
 def mergedl(dicts):
     return merged(*dicts)
 
+def rows_from_columns(columns):
+    """Convert dict of equal-length arrays into a list of dicts, one per row.
+
+    >>> rows_from_columns({0: np.array([1., 2.]), 3: np.array([0, 1])})
+    [{0: 1.0, 3: 0}, {0: 2.0, 3: 1}]
+    """
+    keys = columns.keys()
+    values = [np.asarray(columns[k]).tolist() for k in keys]
+    return [dict(zip(keys, row)) for row in zip(*values)]
+
+def columns_from_rows(rows):
+    """Convert list of dicts with identical keys into a dict of arrays.
+
+    >>> columns_from_rows([{0: 1.0, 3: 0}, {0: 2.0, 3: 1}])
+    {0: array([1., 2.]), 3: array([0, 1])}
+    """
+    keys = rows[0].keys() if rows else []
+    return {k: np.asarray([row[k] for row in rows]) for k in keys}
+
 def lchain(*args):
     return list(itertools.chain(*args))
 
@@ -210,6 +229,25 @@ def log_nCk(n, k):
         return 0
     return log(n) + lgamma(n) - log(k) - lgamma(k) - log(n-k) - lgamma(n-k)
 
+def cholesky_update(L, v, downdate=False):
+    """Return the lower Cholesky factor of L*L' + v*v' (or - v*v') in O(p^2).
+
+    Raises np.linalg.LinAlgError if a downdate is not positive definite.
+    """
+    L = np.array(L, dtype=float)
+    v = np.array(v, dtype=float)
+    sign = -1. if downdate else 1.
+    for k in xrange(len(v)):
+        r2 = L[k,k]**2 + sign * v[k]**2
+        if not r2 > 0:
+            raise np.linalg.LinAlgError('Cholesky downdate is not positive.')
+        r = math.sqrt(r2)
+        c, s = r / L[k,k], v[k] / L[k,k]
+        L[k,k] = r
+        L[k+1:,k] = (L[k+1:,k] + sign * s * v[k+1:]) / c
+        v[k+1:] = c * v[k+1:] - s * L[k+1:,k]
+    return L
+
 def simulate_crp(N, alpha, rng=None):
     """Generates random N-length partition from the CRP with parameter alpha."""
     if rng is None:
@@ -245,6 +283,36 @@ def simulate_crp(N, alpha, rng=None):
     #     rng.shuffle(partition)
     return partition
 
+def simulate_crp_array(N, alpha, rng=None):
+    """Generates random N-length partition from the CRP with parameter alpha.
+
+    Vectorized version of `simulate_crp`, returning a numpy array. The
+    partitions have the same distribution, but not the same random stream.
+    """
+    if rng is None:
+        rng = gen_rng()
+
+    assert N > 0 and alpha > 0.
+    alpha = float(alpha)
+
+    # Customer i opens a new table with probability alpha/(i+alpha), otherwise
+    # sits with a uniformly chosen earlier customer, which is equivalent to
+    # choosing table k with probability Nk/(i+alpha). Each customer points to
+    # the customer who opened its table, resolved with pointer jumping.
+    customers = np.arange(N)
+    opens = rng.uniform(size=N) * (customers + alpha) < alpha
+    opens[0] = True
+    parent = np.where(
+        opens, customers, np.floor(rng.uniform(size=N) * customers).astype(int))
+    while True:
+        grandparent = parent[parent]
+        if np.array_equal(grandparent, parent):
+            break
+        parent = grandparent
+    # Tables are labeled in order of creation.
+    labels = np.cumsum(opens) - 1
+    return labels[parent]
+
 def simulate_crp_constrained(N, alpha, Cd, Ci, Rd, Ri, rng=None):
     """Simulates a CRP with N customers and concentration alpha. Cd is a list,
     where each entry is a list of friends. Ci is a list of tuples, where each
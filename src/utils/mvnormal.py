@@ -108,6 +108,25 @@ def logpdf(X, Mu, Sigma):
   # Convert 1x1 matrix to float.
   return float(logp)
 
+def covariance_factor(Sigma):
+  """Factor a covariance matrix Sigma once for repeated logpdf_factored."""
+  return _covariance_factor(Sigma)
+
+def logpdf_factored(X, Mu, covf):
+  """Multivariate normal log pdf of each row of an m-by-n array X.
+
+  Mu is an array of n means, or an m-by-n array of means for each row, and
+  covf is the factor of the n-by-n covariance from covariance_factor.
+  """
+  X_ = np.atleast_2d(X - Mu)
+  n = X_.shape[1]
+  assert np.all(np.isfinite(X_))
+
+  logp = -np.sum(X_ * covf.solve(X_.T).T, axis=1)/2.
+  logp -= (n/2.)*np.log(2*np.pi)
+  logp -= covf.logsqrtdet()
+  return logp
+
 def dlogpdf(X, dX, Mu, dMu, Sigma, dSigma):
   """Derivative of multivariate normal logpdf with respect to parameters.
 
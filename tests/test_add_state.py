@@ -16,11 +16,13 @@
 
 """Test suite targeting cgpm.crosscat.engine.add_state."""
 
+import numpy as np
 import pytest
 
 from cgpm.crosscat.engine import Engine
 from cgpm.dummy.twoway import TwoWay
 from cgpm.utils import general as gu
+from cgpm.utils.parallel_map import parallel_map
 
 
 def get_engine():
@@ -62,6 +64,64 @@ def test_engine_add_state_custom():
     assert new_state.views[1].Zr(2) == 1
 
 
+def test_engine_add_state_shared_dataset():
+    engine = get_engine()
+    engine.add_state(count=2, multiprocess=0)
+    engine.add_state(count=1, multiprocess=1)
+    # All states share the dataset columns of the first state.
+    X = engine.get_state(0).X
+    for state in engine.states:
+        assert all(state.X[c] is X[c] for c in state.outputs)
+    # Each state copies the columns before changing them.
+    engine.incorporate(3, {8: 1., 7: 1, 9: 2}, multiprocess=0)
+    engine.transition(N=2, multiprocess=0)
+    for state in engine.states:
+        assert state.n_rows() == 4
+        assert state.data_array().tolist()[3] == [1., 1, 2]
+
+
+def test_engine_shared_dataset_multiprocess(monkeypatch):
+    # The states are built by the workers.
+    mapped = []
+    def recording_map(f, l):
+        mapped.append(len(l))
+        return parallel_map(f, l)
+    monkeypatch.setattr('cgpm.crosscat.engine.parallel_map', recording_map)
+    rng = gu.gen_rng(2)
+    engine = Engine(
+        rng.normal(size=(20, 3)), cctypes=['normal']*3, num_states=3, rng=rng,
+        multiprocess=1)
+    engine.add_state(count=1, multiprocess=1)
+    assert mapped == [3, 1]
+    def assert_shared():
+        X = engine.get_state(0).X
+        for state in engine.states:
+            assert all(state.X[c] is X[c] for c in state.outputs)
+    assert_shared()
+    # States returned by the workers share the dataset again.
+    engine.transition(N=1, multiprocess=1)
+    assert_shared()
+    engine.incorporate(20, {0: 1., 1: 2., 2: 3.}, multiprocess=1)
+    assert_shared()
+    assert engine.get_state(3).data_array().tolist()[20] == [1., 2., 3.]
+    engine.transition(N=1, statenos=[1, 2], multiprocess=1)
+    assert_shared()
+
+
+def test_engine_add_state_warm_start():
+    engine = get_engine()
+    engine.transition(N=2, multiprocess=0)
+    engine.add_state(count=2, warm_start=1, multiprocess=0)
+    assert engine.num_states() == 6
+    state = engine.get_state(1)
+    for new_state in engine.states[4:]:
+        assert new_state.Zv() == state.Zv()
+        assert np.allclose(new_state.logpdf_score(), state.logpdf_score())
+        assert new_state.rng is not state.rng
+    with pytest.raises(ValueError):
+        engine.add_state(warm_start=1, Zv={7:0, 8:1, 9:0})
+
+
 def test_engine_add_state_kwarg_errors():
     engine = get_engine()
     with pytest.raises(ValueError):
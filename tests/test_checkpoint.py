@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 MIT Probabilistic Computing Project
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pytest
+
+from cgpm.crosscat import checkpoint
+from cgpm.crosscat.engine import Engine
+from cgpm.crosscat.state import State
+from cgpm.regressions.linreg import LinearRegression
+from cgpm.utils import general as gu
+
+
+def check_replayed(model, metadata):
+    expected = checkpoint.get_metadata(model)
+    replayed = checkpoint._normalize(metadata)
+    for key in ['Zv', 'Zrv']:
+        assert dict(replayed[key]) == dict(expected[key])
+    for key in ['hypers', 'alpha', 'view_alphas', 'diagnostics']:
+        assert replayed[key] == expected[key]
+
+
+def test_state_delta_log():
+    rng = gu.gen_rng(1)
+    data = rng.normal(size=(30, 4))
+    data[:,0] = np.exp(data[:,0])
+    state = State(data, cctypes=['normal']*4, rng=gu.gen_rng(2))
+    path = tempfile.mkdtemp(prefix='gpmcc-checkpoint')
+    try:
+        log_path = os.path.join(path, 'deltas.jsonl')
+        metadata = state.to_metadata()
+        log = checkpoint.DeltaLog(log_path, state)
+        for _i in xrange(3):
+            state.transition(N=2, checkpoint=1)
+            delta = log.append(state)
+        # The last delta does not repeat the earlier diagnostics.
+        assert len(delta['diagnostics_appended']['logscore']) == 2
+        assert len(checkpoint.read_deltas(log_path)) == 3
+        replayed = checkpoint.replay(metadata, log_path)
+    finally:
+        shutil.rmtree(path)
+    check_replayed(state, replayed)
+    state2 = State.from_metadata(replayed, rng=gu.gen_rng(3))
+    assert np.allclose(state2.logpdf_score(), state.logpdf_score())
+    # Changes to the structure require a new snapshot.
+    state.update_cctype(0, 'exponential')
+    with pytest.raises(ValueError):
+        log.append(state)
+
+
+def test_engine_delta_log():
+    rng = gu.gen_rng(1)
+    data = rng.normal(size=(20, 3))
+    engine = Engine(
+        data, cctypes=['normal']*3, num_states=3, rng=gu.gen_rng(2),
+        multiprocess=0)
+    path = tempfile.mkdtemp(prefix='gpmcc-checkpoint')
+    try:
+        log_path = os.path.join(path, 'deltas.jsonl')
+        metadata = engine.to_metadata()
+        log = checkpoint.DeltaLog(log_path, engine)
+        engine.transition(N=2, multiprocess=0)
+        log.append(engine)
+        engine.transition(N=2, multiprocess=0)
+        log.append(engine)
+        replayed = checkpoint.replay(metadata, log_path)
+    finally:
+        shutil.rmtree(path)
+    for state, state_metadata in zip(engine.states, replayed['states']):
+        check_replayed(state, state_metadata)
+    engine2 = Engine.from_metadata(replayed, rng=gu.gen_rng(3), multiprocess=0)
+    assert np.allclose(
+        engine2.logpdf_score(multiprocess=0),
+        engine.logpdf_score(multiprocess=0))
+    engine.drop_state(0)
+    with pytest.raises(ValueError):
+        log.append(engine)
+
+
+def test_composite_state_delta_log():
+    rng = gu.gen_rng(1)
+    data = rng.normal(size=(30, 3))
+    state = State(data, cctypes=['normal']*3, rng=gu.gen_rng(2))
+    linreg = LinearRegression(
+        [3], [0, 1],
+        distargs={'inputs': {'stattypes': ['normal']*2, 'statargs': [{}]*2}},
+        rng=gu.gen_rng(3))
+    for rowid, row in enumerate(data):
+        linreg.incorporate(
+            rowid, {3: row[0] + row[1] + rng.normal()}, {0: row[0], 1: row[1]})
+    state.compose_cgpm(linreg)
+    path = tempfile.mkdtemp(prefix='gpmcc-checkpoint')
+    try:
+        log_path = os.path.join(path, 'deltas.jsonl')
+        metadata = state.to_metadata()
+        log = checkpoint.DeltaLog(log_path, state)
+        state.transition(N=1)
+        state.transition_foreign(N=5, progress=False)
+        delta = log.append(state)
+        # Unchanged composed cgpms are not repeated.
+        assert len(delta['hooked_cgpms']) == 1
+        state.transition(N=1)
+        delta = log.append(state)
+        assert delta['hooked_cgpms'] == []
+        replayed = checkpoint.replay(metadata, log_path)
+    finally:
+        shutil.rmtree(path)
+    check_replayed(state, replayed)
+    assert checkpoint._normalize(replayed['hooked_cgpms'].values()) == \
+        checkpoint._normalize([linreg.to_metadata()])
+    # The last checkpoint of the log is advanced by the deltas.
+    assert log.metadata['hooked_cgpms'].values() == \
+        checkpoint._normalize([linreg.to_metadata()])
+    state2 = State.from_metadata(replayed, rng=gu.gen_rng(3))
+    assert np.allclose(state2.logpdf_score(), state.logpdf_score())
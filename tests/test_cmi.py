@@ -149,3 +149,42 @@ def test_cmi_multivariate_crash():
     # Duplicate in 3 query.
     with pytest.raises(ValueError):
         s.mutual_information([2,3,4], [1,3], {0:None}, T=10, N=10)
+
+def test_cmi_joint_crash():
+    X = np.eye(5)
+    cctypes = ['normal'] * 5
+    s = State(X, Zv={0:0, 1:0, 2:0, 3:1, 4:1}, cctypes=cctypes)
+    s.mutual_information([0], [1], {2:None}, T=10, joint=True)
+    s.mutual_information([0], [1], {2:None, 3:None, 4:0}, T=10, joint=True)
+    s.mutual_information([0,1], [0,1], {2:None}, T=10, joint=True)
+    mi, se = s.mutual_information(
+        [0], [1], {2:None}, T=10, joint=True, control_variate=True,
+        stderr=True)
+    assert se >= 0
+
+def test_cmi_joint_agrees_nested__ci_():
+    rng = gen_rng(0)
+    X = rng.multivariate_normal(
+        [0, 0, 0], [[1, .8, .5], [.8, 1, .5], [.5, .5, 1]], size=100)
+    state = State(X, cctypes=['normal']*3, Zv={0:0, 1:0, 2:0}, rng=rng)
+    state.transition(N=10, kernels=['rows', 'view_alphas', 'column_hypers'])
+    mi_nested, se_nested = state.mutual_information(
+        [0], [1], {2:None}, T=50, N=50, stderr=True)
+    mi_joint, se_joint = state.mutual_information(
+        [0], [1], {2:None}, T=2500, joint=True, stderr=True)
+    assert se_nested > 0 and se_joint > 0
+    assert abs(mi_nested - mi_joint) < 4*np.sqrt(se_nested**2 + se_joint**2)
+    mi_cv, se_cv = state.mutual_information(
+        [0], [1], {2:None}, T=2500, joint=True, control_variate=True,
+        stderr=True)
+    assert abs(mi_cv - mi_joint) < 4*se_joint
+
+def test_cmi_engine_positional_statenos():
+    X = np.eye(5)
+    engine = Engine(
+        X, cctypes=['normal']*5, num_states=3, rng=gen_rng(0), multiprocess=0)
+    mis = engine.mutual_information([0], [1], None, 10, 10, None, [0, 2], 0)
+    assert len(mis) == 2
+    mis = engine.mutual_information(
+        [0], [1], {2:None}, 10, None, None, [1], 0, joint=True)
+    assert len(mis) == 1
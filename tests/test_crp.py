@@ -392,3 +392,22 @@ def test_crp_same_table_probability():
     # Confirm no mutation has occured.
     assert crp.data == crp_data_full
     assert crp.logpdf_score() == logpdf_score_full
+
+
+def test_simulate_crp_array():
+    N, alpha = 50, 2.
+    rng = gu.gen_rng(1)
+    partitions = [
+        gu.simulate_crp_array(N, alpha, rng=rng) for _i in xrange(2000)]
+    for Z in partitions[:20]:
+        # Tables are labeled in order of creation.
+        _tables, first = np.unique(Z, return_index=True)
+        assert np.all(np.diff(first) > 0)
+    # Expected number of tables is sum_i alpha/(alpha+i).
+    num_tables = [max(Z) + 1 for Z in partitions]
+    expected = sum(alpha / (alpha + i) for i in xrange(N))
+    assert np.allclose(np.mean(num_tables), expected, atol=.2)
+    # Expected size of the first table is (N+alpha)/(1+alpha).
+    size_first = [np.sum(Z == 0) for Z in partitions]
+    assert np.allclose(
+        np.mean(size_first), (N + alpha) / (1 + alpha), rtol=.05)
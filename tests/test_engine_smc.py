@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 MIT Probabilistic Computing Project
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+
+import numpy as np
+
+from cgpm.crosscat.engine import Engine
+from cgpm.utils import general as gu
+
+
+def test_incorporate_smc():
+    rng = gu.gen_rng(1)
+    X = rng.normal(size=(20, 3))
+    engine = Engine(
+        X, num_states=4, cctypes=['normal']*3, rng=gu.gen_rng(2),
+        multiprocess=0)
+    log_weights = None
+    n_rows = 20
+    for batch in xrange(3):
+        rowids = range(n_rows, n_rows + 10)
+        observations = [dict(enumerate(x)) for x in rng.normal(size=(10, 3))]
+        log_weights = engine.incorporate_smc(
+            rowids, observations, log_weights=log_weights, multiprocess=0)
+        n_rows += 10
+        assert len(log_weights) == 4
+        assert np.allclose(gu.logsumexp(log_weights), 0)
+        assert all(state.n_rows() == n_rows for state in engine.states)
+    # Force resampling, after which the states are equally weighted and
+    # repeated states evolve independently.
+    log_weights = engine.incorporate_smc(
+        range(n_rows, n_rows + 5), [{0: 10., 1: 10., 2: 10.}]*5,
+        log_weights=[0, -50, -50, -50], ess_threshold=1, multiprocess=0)
+    assert np.allclose(log_weights, -np.log(4))
+    assert len(set(id(state) for state in engine.states)) == 4
+    assert len(set(state.rng.randint(2**31) for state in engine.states)) > 1
+
+
+def test_incorporate_smc_chain_rule_weights():
+    rng = gu.gen_rng(3)
+    X = rng.normal(size=(15, 2))
+    engine = Engine(
+        X, num_states=3, cctypes=['normal']*2, rng=gu.gen_rng(4),
+        multiprocess=0)
+    # Correlated batch, whose density is not the product of its marginals.
+    rowids = range(15, 19)
+    observations = [{0: 6., 1: -6.}, {0: 6.1, 1: -6.}, {0: 5.9, 1: -6.1},
+        {0: 6., 1: -5.9}]
+    copies = [copy.deepcopy(state) for state in engine.states]
+    chain, marginals = [], []
+    for state in copies:
+        marginals.append(sum(state.logpdf(-1, obs) for obs in observations))
+        logp = 0
+        for rowid, observation in zip(rowids, observations):
+            logp += state.logpdf(-1, observation)
+            state.incorporate(rowid, observation)
+        chain.append(logp)
+    log_weights = engine.incorporate_smc(
+        rowids, observations, ess_threshold=0, N=0, multiprocess=0)
+    assert np.allclose(log_weights, gu.log_normalize(chain))
+    assert all(c > m for c, m in zip(chain, marginals))
+    for state, state_copy in zip(engine.states, copies):
+        for v in state.views:
+            assert state.views[v].Zr() == state_copy.views[v].Zr()
@@ -264,3 +264,131 @@ def test_serialize():
     # Parameters of joint distribution [x,z].
     assert np.allclose(fact2.mu, fact.mu)
     assert np.allclose(fact2.cov, fact.cov)
+
+
+def test_logpdf_bulk_cached_conditionals():
+    rng = gu.gen_rng(3)
+    iris = sklearn.datasets.load_iris()
+    X = fillna(iris.data, .2, rng)
+
+    fact = FactorAnalysis([1,2,3,4,-5,47], None, L=2, rng=rng)
+    for i, row in enumerate(X):
+        observation = {
+            q:v for q,v in zip(fact.outputs, row) if not np.isnan(v)}
+        if observation:
+            fact.incorporate(i, observation)
+    fact.transition()
+
+    # Queries over a few signatures of target and constraint variables.
+    rowids, targets_list, constraints_list = [], [], []
+    for row in iris.data[:30]:
+        rowids.extend([None, None, None])
+        targets_list.extend([
+            {1: row[0], 2: row[1]},
+            {-5: 0.5},
+            {4: row[3]},
+        ])
+        constraints_list.extend([
+            {3: row[2]},
+            {1: row[0], 4: row[3]},
+            {},
+        ])
+    logps = fact.logpdf_bulk(rowids, targets_list, constraints_list)
+    for logp, targets, constraints in \
+            zip(logps, targets_list, constraints_list):
+        targets_r = fact.reindex(targets)
+        muG, covG = FactorAnalysis.mvn_condition(
+            fact.mu, fact.cov, targets_r.keys(), fact.reindex(constraints))
+        x = np.array(targets_r.values())
+        assert np.allclose(logp, multivariate_normal.logpdf(x, muG, covG))
+    # The queries share the conditionals of their three signatures.
+    signatures = set(
+        (tuple(sorted(fact.reindex(targets))),
+            tuple(sorted(fact.reindex(constraints))))
+        for targets, constraints in zip(targets_list, constraints_list))
+    assert len(signatures) == 3
+    assert signatures <= set(fact._conditionals)
+
+    # The score is the density of the observed entries of each row.
+    score = sum(
+        fact.logpdf(None, {
+            q:v for q,v in zip(fact.outputs, row) if not np.isnan(v)})
+        for row in X if not np.all(np.isnan(row)))
+    assert np.allclose(fact.logpdf_score(), score)
+
+    # Transition invalidates the cached conditionals.
+    fact.transition()
+    for (query, evidence), conditional in fact._conditionals.iteritems():
+        _muG, covG = FactorAnalysis.mvn_condition(
+            fact.mu, fact.cov, list(query), {e: 0 for e in evidence})
+        assert np.allclose(conditional[3], covG)
+
+
+def test_transition_missing_data_online():
+    rng = gu.gen_rng(4)
+    iris = sklearn.datasets.load_iris()
+    X = fillna(iris.data, .3, rng)
+    X = X[~np.all(np.isnan(X), axis=1)]
+    def incorporate(fact, rows):
+        for i in rows:
+            fact.incorporate(i, {
+                q:v for q,v in zip(fact.outputs, X[i]) if not np.isnan(v)})
+
+    # EM over the observed entries of all rows.
+    fact = FactorAnalysis([1,2,3,4,-5], None, L=1, rng=rng)
+    incorporate(fact, xrange(len(X)))
+    fact.transition(full=True)
+    assert np.allclose(fact._stats_n, np.sum(~np.isnan(X), axis=0))
+
+    # The fit only to the complete rows scores the data worse.
+    complete = X[~np.any(np.isnan(X), axis=1)]
+    fa = sklearn.decomposition.FactorAnalysis(n_components=1).fit(complete)
+    fact_complete = FactorAnalysis([1,2,3,4,-5], None, L=1, rng=rng, params={
+        'mux': fa.mean_,
+        'Psi': np.diag(fa.noise_variance_),
+        'W': fa.components_.T,
+    })
+    incorporate(fact_complete, xrange(len(X)))
+    assert fact_complete.logpdf_score() < fact.logpdf_score()
+
+    # Minibatch EM as rows arrive, warm started from the previous fit.
+    fact_online = FactorAnalysis([1,2,3,4,-5], None, L=1, rng=rng)
+    for rows in np.array_split(np.arange(len(X)), 5):
+        incorporate(fact_online, rows)
+        fact_online.transition(N=10, batch_size=20)
+    assert len(fact_online._expectations) == len(X)
+    fact_online.unincorporate(0)
+    fact_online.transition(full=True)
+    assert np.allclose(fact_online.logpdf_score(), fact.logpdf_score() -
+        fact.logpdf(None, {
+            q:v for q,v in zip(fact.outputs, X[0]) if not np.isnan(v)}),
+        rtol=1e-2)
+
+
+def test_transition_incremental_default(monkeypatch):
+    rng = gu.gen_rng(5)
+    iris = sklearn.datasets.load_iris()
+    fact = FactorAnalysis([1,2,3,4,-5], None, L=1, rng=rng)
+    for i, row in enumerate(iris.data[:100]):
+        fact.incorporate(i, dict(zip(fact.outputs, row)))
+    fact.transition(full=True)
+    # The E-step returns the log likelihood of its rows.
+    logp = fact.logpdf_score()
+    assert np.allclose(fact._expectation_step(range(100)), logp)
+    # By default a transition refreshes the new rows and a bounded batch of
+    # old ones, once, without scoring the whole dataset.
+    for i, row in enumerate(iris.data[100:103]):
+        fact.incorporate(100 + i, dict(zip(fact.outputs, row)))
+    refreshed = []
+    expectation_step = fact._expectation_step
+    def record(rowids):
+        refreshed.append(list(rowids))
+        return expectation_step(rowids)
+    monkeypatch.setattr(fact, '_expectation_step', record)
+    monkeypatch.setattr(fact, 'logpdf_score', None)
+    fact.transition(batch_size=10)
+    assert len(refreshed) == 1
+    assert refreshed[0][:3] == [100, 101, 102]
+    assert len(set(refreshed[0])) == 13
+    fact.transition()
+    assert len(refreshed[1]) == 100
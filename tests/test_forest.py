@@ -167,6 +167,94 @@ def test_logpdf_score():
     assert np.allclose(forest2.logpdf_score(), logscore)
 
 
+def test_log_likelihood_grid():
+    forest = RandomForest(
+        outputs=RF_OUTPUTS, inputs=RF_INPUTS,
+        distargs=RF_DISTARGS, rng=gu.gen_rng(0))
+    # Train without class 2, so that some rows have a class unseen by forest.
+    for rowid, row in enumerate(D[:25]):
+        if row[0] != 2:
+            observation = {0: row[0]}
+            inputs = {i: row[i] for i in forest.inputs}
+            forest.incorporate(rowid, observation, inputs)
+    forest.transition_params()
+    X = [int(x) for x in D[:25,0]]
+    Y = [list(row) for row in D[:25,1:]]
+    assert 2 in X
+    alphas = np.linspace(0.01, 0.99, 30)
+    logps = RandomForest.calc_log_likelihood_grid(
+        X, Y, forest.regressor, forest.counts, alphas)
+    for alpha, logp in zip(alphas, logps):
+        expected = sum(
+            RandomForest.calc_predictive_logp(
+                x, y, forest.regressor, forest.counts, alpha)
+            for x, y in zip(X, Y))
+        assert np.allclose(logp, expected)
+
+
+def test_warm_start_schedule():
+    distargs = dict(RF_DISTARGS, refit_every=3, warm_trees=2)
+    forest = RandomForest(
+        outputs=RF_OUTPUTS, inputs=RF_INPUTS,
+        distargs=distargs, rng=gu.gen_rng(0))
+    forest.regressor.set_params(n_estimators=5)
+    forest.n_estimators = 5
+    for rowid, row in enumerate(D[:25]):
+        observation = {0: row[0]}
+        inputs = {i: row[i] for i in forest.inputs}
+        forest.incorporate(rowid, observation, inputs)
+    num_trees = []
+    for _i in xrange(5):
+        forest.transition_params()
+        num_trees.append(len(forest.regressor.estimators_))
+    assert num_trees == [5, 7, 9, 5, 7]
+    # The schedule survives serialization.
+    forest2 = RandomForest.from_metadata(forest.to_metadata())
+    assert forest2.refit_every == 3
+    assert forest2.warm_trees == 2
+    for expected in [9, 5]:
+        forest.transition_params()
+        forest2.transition_params()
+        assert len(forest.regressor.estimators_) == expected
+        assert len(forest2.regressor.estimators_) == expected
+
+
+def test_bulk_queries():
+    forest = RandomForest(
+        outputs=RF_OUTPUTS, inputs=RF_INPUTS,
+        distargs=RF_DISTARGS, rng=gu.gen_rng(0))
+    for rowid, row in enumerate(D[:25]):
+        observation = {0: row[0]}
+        inputs = {i: row[i] for i in forest.inputs}
+        forest.incorporate(rowid, observation, inputs)
+    forest.transition_params()
+    rowids = [None] * (NUM_CLASSES+1) * 10
+    targets_list = [{0: x} for x in range(NUM_CLASSES+1)] * 10
+    inputs_list = [
+        {i: row[i] for i in forest.inputs}
+        for row in D[25:35] for _x in range(NUM_CLASSES+1)
+    ]
+    logps = forest.logpdf_bulk(rowids, targets_list, None, inputs_list)
+    expected = [
+        forest.logpdf(r, t, None, i)
+        for r, t, i in zip(rowids, targets_list, inputs_list)
+    ]
+    assert np.allclose(logps, expected)
+    # The category outside [0..k) has zero density.
+    assert logps[NUM_CLASSES] == -float('inf')
+    # Simulate observed and hypothetical rows.
+    samples = forest.simulate_bulk(
+        [0, None, None], [RF_OUTPUTS]*3,
+        inputs_list=[{}, inputs_list[0], inputs_list[-1]], Ns=[3, None, 5])
+    assert samples[0] == [{0: int(D[0,0])}] * 3
+    assert samples[1][0] in range(NUM_CLASSES)
+    assert len(samples[2]) == 5
+    # Sampling frequencies follow the predictive.
+    xs = forest.simulate_array(None, 5000, inputs_list[0])
+    frequencies = np.bincount(xs, minlength=NUM_CLASSES) / 5000.
+    assert np.allclose(frequencies, np.exp(logps[:NUM_CLASSES]), atol=.05)
+
+
 def test_transition_hypers():
     forest = Dim(
         outputs=RF_OUTPUTS, inputs=[-1]+RF_INPUTS, cctype='random_forest',
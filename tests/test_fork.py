@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 MIT Probabilistic Computing Project
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import numpy as np
+
+from cgpm.crosscat.state import State
+from cgpm.mixtures.dim import Dim
+from cgpm.utils import general as gu
+
+
+def get_state():
+    rng = gu.gen_rng(1)
+    data = rng.normal(size=(30, 4))
+    data[:,0] = rng.randint(0, 3, size=30)
+    data[:,3] = np.exp(data[:,3])
+    data[:3,3] = np.nan
+    state = State(
+        data, cctypes=['categorical', 'normal', 'normal', 'lognormal'],
+        distargs=[{'k': 3}, None, None, None],
+        rng=gu.gen_rng(2))
+    state.transition(N=2)
+    return state
+
+
+def get_metadata(state):
+    return json.loads(json.dumps(state.to_metadata()))
+
+
+def test_fork_shares_dataset():
+    state = get_state()
+    fork = state.fork()
+    for c in state.outputs:
+        assert fork.X[c] is state.X[c]
+    assert fork.views[fork.Zv(0)].X is fork.X
+    assert np.allclose(fork.logpdf_score(), state.logpdf_score())
+    # Updating the fork copies only the columns it changes.
+    fork.force_cell(0, {3: 1.})
+    assert fork.X[3] is not state.X[3]
+    assert fork.X[1] is state.X[1]
+    assert np.isnan(state.X[3][0])
+
+
+def test_fork_isolated():
+    state = get_state()
+    metadata = get_metadata(state)
+    fork = state.fork(rng=gu.gen_rng(3))
+    fork.incorporate(30, {0: 1, 1: 0.5, 2: -1., 3: 2.})
+    fork.transition(N=3)
+    assert get_metadata(state) == metadata
+    assert state.n_rows() == 30
+    assert fork.n_rows() == 31
+    # Updating the parent does not change the fork either.
+    metadata_fork = get_metadata(fork)
+    state.transition(N=3)
+    state.incorporate(30, {0: 2, 1: 1.5})
+    assert get_metadata(fork) == metadata_fork
+    # Both remain valid states.
+    for s in [state, fork]:
+        assert np.allclose(
+            s.logpdf_score(),
+            State.from_metadata(s.to_metadata()).logpdf_score())
+
+
+def test_dim_fork():
+    dim = Dim(
+        outputs=[0], inputs=[-1], cctype='normal_trunc',
+        distargs={'l': -1, 'h': 3}, rng=gu.gen_rng(1))
+    dim.transition_hyper_grids([-.5, 2.])
+    for rowid, x in enumerate([-.5, .5, 1., 2.]):
+        dim.incorporate(rowid, {0: x}, {-1: rowid % 2})
+    fork = dim.fork()
+    assert fork.clusters[0].data is dim.clusters[0].data
+    fork.unincorporate(0)
+    fork.incorporate(4, {0: 1.5}, {-1: 1})
+    assert sorted(dim.clusters[0].data) == [0, 2]
+    assert sorted(dim.clusters[1].data) == [1, 3]
+    assert dim.clusters[1].N == 2
+    assert sorted(fork.clusters[0].data) == [2]
+    assert sorted(fork.clusters[1].data) == [1, 3, 4]
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 MIT Probabilistic Computing Project
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from cgpm.crosscat.state import State
+from cgpm.mixtures.dim import Dim
+from cgpm.utils import config as cu
+from cgpm.utils import general as gu
+
+
+CCTYPES_DISTARGS = [
+    ('bernoulli', None, [0, 1, 1, 0, 1, 0]),
+    ('categorical', {'k': 4}, [0, 1, 3, 3, 2, 1]),
+    ('crp', None, [0, 0, 1, 2, 1, 0]),
+    ('exponential', None, [.1, 1.2, 3.4, .8, .2, 4.]),
+    ('geometric', None, [0, 3, 1, 2, 5, 0]),
+    ('lognormal', None, [.1, 1.2, 3.4, .8, .2, 4.]),
+    ('normal', None, [-1.2, .3, 2.1, .8, -.2, 4.]),
+    ('normal_trunc', {'l': -1, 'h': 3}, [-.2, .3, 2.1, .8, -.9, 1.]),
+    ('poisson', None, [0, 3, 1, 2, 5, 0]),
+    ('vonmises', None, [.1, 1.2, 3.4, .8, 5.2, 2.]),
+]
+
+
+@pytest.mark.parametrize('cctype, distargs, X', CCTYPES_DISTARGS)
+def test_incorporate_array_primitive(cctype, distargs, X):
+    model = cu.cctype_class(cctype)
+    looped = model([0], [], distargs=distargs, rng=gu.gen_rng(0))
+    for rowid, x in enumerate(X):
+        looped.incorporate(rowid, {0: x})
+    batched = model([0], [], distargs=distargs, rng=gu.gen_rng(0))
+    batched.incorporate_array(range(len(X)), X)
+    stats_looped = looped.get_suffstats()
+    stats_batched = batched.get_suffstats()
+    assert sorted(stats_looped) == sorted(stats_batched)
+    for stat in stats_looped:
+        assert np.allclose(stats_looped[stat], stats_batched[stat])
+    assert looped.data == batched.data
+    assert np.allclose(looped.logpdf_score(), batched.logpdf_score())
+
+
+@pytest.mark.parametrize('cctype, distargs, X', CCTYPES_DISTARGS)
+def test_incorporate_array_dim(cctype, distargs, X):
+    X = list(X) + [np.nan]
+    Z = [2, 0, 2, 1, 0, 2, 1]
+    looped = Dim([0], [-1], cctype=cctype, distargs=distargs, rng=gu.gen_rng(0))
+    batched = Dim([0], [-1], cctype=cctype, distargs=distargs, rng=gu.gen_rng(0))
+    for dim in [looped, batched]:
+        dim.transition_hyper_grids(X)
+    for rowid, (x, z) in enumerate(zip(X, Z)):
+        looped.incorporate(rowid, {0: x}, {-1: z})
+    batched.incorporate_array(range(len(X)), X, Z)
+    assert looped.Zr == batched.Zr
+    assert looped.Zi == batched.Zi
+    assert sorted(looped.clusters) == sorted(batched.clusters)
+    for k in looped.clusters:
+        assert looped.clusters[k].data == batched.clusters[k].data
+    assert np.allclose(looped.logpdf_score(), batched.logpdf_score())
+    with pytest.raises(ValueError):
+        batched.incorporate_array([0], [X[0]], [0])
+
+
+def test_incorporate_array_invalid():
+    dim = Dim([0], [-1], cctype='categorical', distargs={'k': 2})
+    with pytest.raises(ValueError):
+        dim.incorporate_array([0, 1], [0, 3], [0, 0])
+
+
+def test_state_construction_matches_incorporate():
+    rng = gu.gen_rng(1)
+    X = rng.normal(size=(50, 2))
+    X[rng.choice(50, size=5), 0] = np.nan
+    X[:, 1] = rng.randint(0, 3, size=50)
+    Zr = rng.randint(0, 4, size=50)
+    state = State(
+        X, cctypes=['normal', 'categorical'], distargs=[None, {'k': 3}],
+        Zv={0: 0, 1: 0}, Zrv={0: list(Zr)}, rng=gu.gen_rng(2))
+    view = state.views[0]
+    for c in [0, 1]:
+        dim = view.dims[c]
+        for k, cluster in dim.clusters.iteritems():
+            rows = [r for r in xrange(50) if Zr[r] == k and not np.isnan(X[r,c])]
+            assert sorted(cluster.data) == rows
+            assert cluster.N == len(rows)
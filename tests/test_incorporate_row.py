@@ -141,3 +141,76 @@ def test_incorporate_session():
     # Remove the incorporated rowid.
     state.unincorporate(state.n_rows()-1)
     state.transition(N=3)
+
+
+def test_incorporate_bulk():
+    state = get_state()
+    n_rows = state.n_rows()
+    rowids = range(n_rows, n_rows + 4)
+    observations = [
+        {0: 1, 1: 3, 2: 2, 3: -1, 4: -5},
+        {0: 18, 1: -7, 2: -2, 3: 11},
+        {0: 1, state.views[1].outputs[0]: 0},
+        {0: 1, 1: 3, state.views[0].outputs[0]: 7},
+    ]
+    with pytest.raises(ValueError):
+        state.incorporate_bulk([n_rows + 1], observations[:1])
+    with pytest.raises(ValueError):
+        state.incorporate_bulk(rowids[:1], [{0: np.nan}])
+    state.incorporate_bulk(rowids, observations)
+    assert state.n_rows() == n_rows + 4
+    assert np.isnan(state.X[4][n_rows+1])
+    assert state.views[1].Zr(n_rows+2) == 0
+    assert state.views[0].Zr(n_rows+3) == 7
+    for view in state.views.itervalues():
+        for dim in view.dims.itervalues():
+            for k, cluster in dim.clusters.iteritems():
+                rows = [r for r in xrange(state.n_rows())
+                    if view.Zr(r) == k and not np.isnan(state.X[dim.index][r])]
+                assert sorted(cluster.data) == rows
+    state.transition(N=2)
+
+
+def test_incorporate_bulk_assigns_clusters():
+    rng = gu.gen_rng(1)
+    X = np.concatenate((
+        rng.normal(-10, 1, size=50), rng.normal(10, 1, size=50)))
+    state = State(
+        X[:,np.newaxis], cctypes=['normal'], Zv={0: 0},
+        Zrv={0: [0]*50 + [1]*50}, rng=gu.gen_rng(2))
+    state.transition(N=2, kernels=['column_hypers'])
+    new = np.concatenate((
+        rng.normal(-10, 1, size=20), rng.normal(10, 1, size=20)))
+    state.incorporate_bulk(range(100, 140), [{0: x} for x in new])
+    view = state.views[0]
+    assert all(view.Zr(r) == view.Zr(0) for r in xrange(100, 120))
+    assert all(view.Zr(r) == view.Zr(50) for r in xrange(120, 140))
+
+
+def test_incorporate_bulk_partition_matches_sequential():
+    # The bulk assignments approximate the partition of sequential incorporate
+    # for rows between the clusters and outlying rows.
+    def incorporate(bulk, seed):
+        rng = gu.gen_rng(1)
+        X = np.concatenate((
+            rng.normal(-3, 1, size=30), rng.normal(3, 1, size=30)))
+        state = State(
+            X[:,np.newaxis], cctypes=['normal'], Zv={0: 0},
+            Zrv={0: [0]*30 + [1]*30}, rng=gu.gen_rng(seed))
+        rowids = range(60, 66)
+        observations = [{0: x} for x in [0, .5, -.5, 15, 15.5, 16]]
+        if bulk:
+            state.incorporate_bulk(rowids, observations)
+        else:
+            for rowid, observation in zip(rowids, observations):
+                state.incorporate(rowid, observation)
+        view = state.views[0]
+        Z = [view.Zr(r) for r in rowids]
+        return [
+            np.mean([z == view.Zr(0) for z in Z[:3]]),
+            len(set(Z[3:])),
+            Z[3] not in [view.Zr(0), view.Zr(30)],
+        ]
+    sequential = np.mean([incorporate(False, s) for s in xrange(150)], axis=0)
+    bulk = np.mean([incorporate(True, s) for s in xrange(150)], axis=0)
+    assert np.all(np.abs(sequential - bulk) < [.1, .25, .15])
@@ -102,6 +102,54 @@ def test_logpdf_score():
     assert linreg.logpdf_score() < 0
 
 
+def test_incremental_suffstats():
+    linreg = LinearRegression(
+        OUTPUTS, INPUTS,
+        distargs={'inputs':{'stattypes': CCTYPES, 'statargs': CCARGS}},
+        rng=gu.gen_rng(0))
+    for rowid, row in enumerate(D[:30]):
+        observation = {0: row[0]}
+        inputs = {i:row[i] for i in linreg.inputs}
+        linreg.incorporate(rowid, observation, inputs)
+    for rowid in [3, 17, 29, 0]:
+        linreg.unincorporate(rowid)
+    linreg.set_hypers({'a': 2.5, 'b': 0.7})
+    Y, x = linreg.data.Y.values(), linreg.data.x.values()
+    assert np.allclose(
+        linreg.logpdf_score(),
+        LinearRegression.calc_logpdf_marginal(
+            linreg.N, Y, x, linreg.a, linreg.b, linreg.mu, linreg.V))
+    for row in D[30:35]:
+        inputs = {i:row[i] for i in linreg.inputs}
+        xt, yt = linreg.preprocess({0: row[0]}, inputs)
+        assert np.allclose(
+            linreg.logpdf(None, {0: row[0]}, inputs=inputs),
+            LinearRegression.calc_predictive_logp(
+                xt, yt, linreg.N, Y, x, linreg.a, linreg.b, linreg.mu,
+                linreg.V))
+
+
+def test_logpdf_score_grid():
+    linreg = LinearRegression(
+        OUTPUTS, INPUTS,
+        distargs={'inputs':{'stattypes': CCTYPES, 'statargs': CCARGS}},
+        rng=gu.gen_rng(0))
+    for rowid, row in enumerate(D[:20]):
+        observation = {0: row[0]}
+        inputs = {i:row[i] for i in linreg.inputs}
+        linreg.incorporate(rowid, observation, inputs)
+    grids = LinearRegression.construct_hyper_grids(linreg.data.x.values())
+    hypers = linreg.get_hypers()
+    for hyper in ['a', 'b']:
+        logps = linreg.logpdf_score_grid(hyper, grids[hyper])
+        expected = []
+        for value in grids[hyper]:
+            linreg.set_hypers(dict(hypers, **{hyper: value}))
+            expected.append(linreg.logpdf_score())
+        linreg.set_hypers(hypers)
+        assert np.allclose(logps, expected)
+
+
 def test_logpdf_predictive():
     linreg = LinearRegression(
         OUTPUTS, INPUTS,
@@ -23,8 +23,10 @@ import pytest
 
 from scipy.stats import chisquare
 from scipy.stats import ks_2samp
+from statsmodels.nonparametric import kernel_density
 
 from cgpm.kde.mvkde import MultivariateKde
+from cgpm.kde.mvkde import _loo_loglikelihood
 from cgpm.uncorrelated.linear import Linear
 from cgpm.utils import general as gu
 from cgpm.utils import test as tu
@@ -536,3 +538,204 @@ def test_conditional_real(kde_xz):
         counts = np.bincount(samples_subpop)
         frac = sum(counts[[true_ind_a, true_ind_b]])/float(sum(counts))
         assert .8 < frac
+
+
+def test_logpdf_vectorized():
+    rng = gu.gen_rng(2)
+    data = np.column_stack((
+        rng.normal(size=40), rng.normal(size=40), rng.choice(3, size=40)))
+    data[rng.choice(40, size=8, replace=False), 0] = np.nan
+    kde = MultivariateKde(
+        [0, 1, 2], None,
+        distargs={O: {ST: [N, N, C], SA: [{}, {}, {'k': 3}]}}, rng=rng)
+    for rowid, x in enumerate(data):
+        kde.incorporate(rowid, {q: v for q, v in enumerate(x)
+            if not np.isnan(v)})
+    kde.bw = [.5, .7, .2]
+    complete = data[~np.any(np.isnan(data), axis=1)]
+
+    # Joint and conditional queries match the statsmodels estimators.
+    points = rng.normal(size=(10, 2))
+    logps_joint = kde.logpdf_bulk(
+        [None]*10, [{0: x0, 1: x1} for x0, x1 in points])
+    model = kernel_density.KDEMultivariate(
+        complete[:,:2], 'cc', bw=[.5, .7])
+    assert np.allclose(logps_joint, np.log(model.pdf(points)))
+    logps_conditional = kde.logpdf_bulk(
+        [None]*10, [{1: x1} for _x0, x1 in points],
+        [{0: x0, 2: 1} for x0, _x1 in points])
+    model = kernel_density.KDEMultivariateConditional(
+        complete[:,1:2], complete[:,[0,2]], 'c', 'cu', bw=[.7, .5, .2])
+    expected = np.log(model.pdf(
+        points[:,1:2], np.column_stack((points[:,0], np.ones(10)))))
+    assert np.allclose(logps_conditional, expected)
+
+    # The score is the density of the observed values of each row.
+    score = 0
+    for x in data:
+        observed = ~np.isnan(x)
+        members = data[np.all(~np.isnan(data[:,observed]), axis=1)]
+        model = kernel_density.KDEMultivariate(
+            members[:,observed], 'ccu' if observed[0] else 'cu',
+            bw=np.asarray(kde.bw)[observed])
+        score += np.log(model.pdf(x[observed]))
+    assert np.allclose(kde.logpdf_score(), score)
+
+    # Leaving out a row matches the estimate without that row.
+    rowids = [i for i, x in enumerate(data) if not np.any(np.isnan(x))][:5]
+    logps_out = kde.logpdf_rows(rowids, leave_out=True)
+    for rowid, logp in zip(rowids, logps_out):
+        members = np.delete(complete, rowids.index(rowid), axis=0)
+        model = kernel_density.KDEMultivariate(members, 'ccu', bw=kde.bw)
+        assert np.allclose(logp, np.log(model.pdf(data[rowid])))
+
+
+def test_kernel_tree_tolerance():
+    rng = gu.gen_rng(3)
+    data = np.column_stack((
+        rng.normal(size=300), rng.normal(size=300), rng.choice(3, size=300)))
+    distargs = {O: {ST: [N, N, C], SA: [{}, {}, {'k': 3}]}}
+    with pytest.raises(ValueError):
+        MultivariateKde([0, 1, 2], None, distargs=dict(distargs, tol=1.5))
+    kde_exact = MultivariateKde([0, 1, 2], None, distargs=distargs, rng=rng)
+    kde_tree = MultivariateKde(
+        [0, 1, 2], None, distargs=dict(distargs, tol=1e-8), rng=rng)
+    for kde in [kde_exact, kde_tree]:
+        kde.bw = [.2, .3, .1]
+        for rowid, x in enumerate(data):
+            kde.incorporate(rowid, dict(enumerate(x)))
+    # Joint and conditional densities, including a point far from the data
+    # where all truncated kernels vanish.
+    points = np.row_stack((rng.normal(size=(10, 2)), [[5, 5]]))
+    for kde in [kde_exact, kde_tree]:
+        kde.logps = kde.logpdf_bulk(
+            [None]*11, [{0: x0} for x0, _x1 in points],
+            [{1: x1, 2: 2} for _x0, x1 in points])
+        kde.logps += kde.logpdf_bulk(
+            [None]*11, [{0: x0, 1: x1} for x0, x1 in points])
+        kde.logps += kde.logpdf_rows(leave_out=True)
+    assert np.all(np.isfinite(kde_tree.logps))
+    assert np.allclose(kde_tree.logps, kde_exact.logps, atol=1e-4)
+    assert np.allclose(kde_tree.logpdf_score(), kde_exact.logpdf_score())
+    # Conditional simulation only draws exemplars near the constraints.
+    samples = kde_tree.simulate(None, [2], {0: 1.5, 1: -1.5}, N=200)
+    neighbors = data[
+        (np.abs(data[:,0] - 1.5) < 1.5) & (np.abs(data[:,1] + 1.5) < 2)]
+    frequencies = np.bincount(
+        [s[2] for s in samples], minlength=3) / 200.
+    assert np.all(frequencies[np.unique(neighbors[:,2]).astype(int)] > 0)
+
+
+def test_transition_bw_methods():
+    rng = gu.gen_rng(4)
+    z = rng.choice(3, size=150)
+    data = np.column_stack((rng.normal(size=150) + 2*z, z))
+    distargs = {O: {ST: [N, C], SA: [{}, {'k': 3}]}}
+    with pytest.raises(ValueError):
+        MultivariateKde([0, 1], None, distargs=dict(distargs, bw_method='x'))
+    def make_kde(**kwargs):
+        kde = MultivariateKde(
+            [0, 1], None, distargs=dict(distargs, **kwargs), rng=rng)
+        for rowid, x in enumerate(data):
+            kde.incorporate(rowid, dict(enumerate(x)))
+        return kde
+    model = kernel_density.KDEMultivariate(data, 'cu', bw='cv_ml')
+    # Subsampled cross validation over every row reaches the likelihood of
+    # the statsmodels selector.
+    kde = make_kde(bw_method='cv_subsample', bw_sample_size=500)
+    kde.transition()
+    assert model.loo_likelihood(np.asarray(kde.bw), func=np.log) \
+        <= model.loo_likelihood(model.bw, func=np.log) + 1e-2
+    # An exhausted time budget keeps the current bandwidths.
+    bw = list(kde.bw)
+    kde.transition(S=0)
+    assert np.allclose(kde.bw, bw)
+    # Smaller samples and binning give bandwidths of the same scale.
+    for kwargs in [
+            {'bw_method': 'cv_subsample', 'bw_sample_size': 50},
+            {'bw_method': 'cv_binned', 'bw_bins': 16},
+            {'bw_method': 'normal_reference'}]:
+        kde = make_kde(**kwargs)
+        kde.transition(N=100)
+        assert .1 < kde.bw[0] / bw[0] < 10
+        assert 0 <= kde.bw[1] < 1
+        assert kde.get_distargs()['bw_method'] == kwargs['bw_method']
+
+
+def test_logpdf_rows_leave_out_isolated():
+    rng = gu.gen_rng(5)
+    data = np.append(rng.normal(size=49), [12.])
+    distargs = {O: {ST: [N], SA: [{}]}}
+    kdes = [
+        MultivariateKde([0], None, distargs=distargs, rng=rng),
+        MultivariateKde([0], None, distargs=dict(distargs, tol=1e-6), rng=rng),
+    ]
+    # Leave-one-out density of the outlier from the other exemplars.
+    distances = (data[:-1] - data[-1])**2
+    expected = np.log(
+        np.mean(np.exp(-distances / 2.)) / np.sqrt(2*np.pi))
+    for kde in kdes:
+        kde.bw = [1.]
+        for rowid, x in enumerate(data):
+            kde.incorporate(rowid, {0: x})
+        logps = kde.logpdf_rows(leave_out=True)
+        assert np.allclose(logps[-1], expected)
+        model = kernel_density.KDEMultivariate(data[:-1], 'c', bw=[1.])
+        assert np.allclose(logps[-1], np.log(model.pdf([data[-1]])))
+    # A row moderately far from the others under the truncated kernels, each
+    # dropped kernel is at most tol times its peak.
+    kde = kdes[1]
+    kde.unincorporate(49)
+    kde.incorporate(49, {0: 7.})
+    logps = kde.logpdf_rows([49], leave_out=True)
+    pdf = model.pdf([7.])
+    assert abs(np.exp(logps[0]) - pdf) < 1e-6 / np.sqrt(2*np.pi)
+    assert abs(logps[0] - np.log(pdf)) < .1
+
+
+def test_kernel_tree_cache_bandwidths(monkeypatch):
+    rng = gu.gen_rng(6)
+    data = np.column_stack((rng.normal(size=(40, 2)), rng.choice(2, size=40)))
+    distargs = {O: {ST: [N, N, C], SA: [{}, {}, {'k': 2}]}}
+    kde_exact = MultivariateKde([0, 1, 2], None, distargs=distargs, rng=rng)
+    kde_tree = MultivariateKde(
+        [0, 1, 2], None, distargs=dict(distargs, tol=1e-8), rng=rng)
+    for kde in [kde_exact, kde_tree]:
+        for rowid, x in enumerate(data):
+            kde.incorporate(rowid, dict(enumerate(x)))
+    # Points far from the data are evaluated exactly, in blocks of points.
+    monkeypatch.setattr('cgpm.kde.kernels.KERNEL_BLOCK_SIZE', 50)
+    points = np.row_stack((rng.normal(size=(5, 2)), [[9, 9], [-9, 8]]))
+    def trees(kde):
+        return [key for key in kde._cache if key[0] == 'tree']
+    for bw in [[.2, .3, .1], [.5, .5, .2], [1., .4, .3]]:
+        for kde in [kde_exact, kde_tree]:
+            kde.bw = bw
+            kde.logps = kde.logpdf_bulk(
+                [None]*7, [{0: x0, 1: x1} for x0, x1 in points])
+            kde.logps += kde.logpdf_rows(leave_out=True)
+        assert np.allclose(kde_tree.logps, kde_exact.logps, atol=1e-4)
+        # The tree built with the previous bandwidths is replaced.
+        assert len(trees(kde_tree)) == 2
+    kde_tree.transition(N=1)
+    assert trees(kde_tree) == []
+
+
+def test_loo_loglikelihood_isolated():
+    rng = gu.gen_rng(7)
+    data = np.append(rng.normal(size=29), [12.])
+    def loo_loglikelihood(rows, bw):
+        K = np.exp(-(rows[:,np.newaxis] - rows[np.newaxis,:])**2 / (2*bw**2))
+        np.fill_diagonal(K, 0)
+        return np.sum(np.log(
+            np.sum(K, axis=1) / (len(rows) - 1) / (bw * np.sqrt(2*np.pi))))
+    # The isolated row keeps its leave-one-out density of about exp(-65).
+    assert np.allclose(
+        _loo_loglikelihood([1.], 'c', data[:,np.newaxis]),
+        loo_loglikelihood(data, 1.))
+    # Repeated rows weighted by their counts.
+    cells, counts = data[:10], np.arange(1, 11)
+    loglikelihood = _loo_loglikelihood(
+        [.5], 'c', cells[:,np.newaxis], counts.astype(float))
+    assert np.allclose(
+        loglikelihood, loo_loglikelihood(np.repeat(cells, counts), .5))
@@ -21,6 +21,8 @@ from math import log
 
 import numpy as np
 
+from sklearn.linear_model import LinearRegression
+
 from cgpm.regressions.ols import OrdinaryLeastSquares
 from cgpm.utils import config as cu
 from cgpm.utils import general as gu
@@ -135,3 +137,26 @@ def test_integration():
     logp_new = ols2.logpdf(-1, targets, None, inputs)
     assert np.allclose(logp_new, logp_old)
     ols2.simulate(-1, OLS_OUTPUTS, None, inputs)
+
+
+def test_incremental_fit():
+    ols = OrdinaryLeastSquares(
+        outputs=OLS_OUTPUTS,
+        inputs=OLS_INPUTS,
+        distargs=OLS_DISTARGS,
+        rng=gu.gen_rng(0)
+    )
+    for rowid, row in enumerate(D[:60]):
+        observation = {0: row[0]}
+        inputs = {i: row[i] for i in ols.inputs}
+        ols.incorporate(rowid, observation, inputs)
+    for rowid in [5, 17, 42]:
+        ols.unincorporate(rowid)
+    ols.transition()
+    # Compare with a full refit of the regressor on the data.
+    Y, x = ols.data.Y.values(), ols.data.x.values()
+    regressor = LinearRegression().fit(Y, x)
+    assert np.allclose(ols.regressor.coef_, regressor.coef_)
+    assert np.allclose(ols.regressor.intercept_, regressor.intercept_)
+    noise = np.linalg.norm(x - regressor.predict(Y)) / np.sqrt(ols.N)
+    assert np.allclose(ols.noise, noise)
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 MIT Probabilistic Computing Project
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from cgpm.crosscat.state import State
+from cgpm.primitives.bernoulli import Bernoulli
+from cgpm.primitives.categorical import Categorical
+from cgpm.primitives.lognormal import Lognormal
+from cgpm.primitives.normal import Normal
+from cgpm.utils import general as gu
+
+
+def test_normal_cache_matches_predictive():
+    model = Normal([0], [], rng=gu.gen_rng(1))
+    for rowid, x in enumerate([-1.2, .3, 2.1, .8]):
+        model.incorporate(rowid, {0: x})
+    for x in [-3., 0., 1.5]:
+        expected = Normal.calc_predictive_logp(
+            x, model.N, model.sum_x, model.sum_x_sq, model.m, model.r,
+            model.s, model.nu)
+        assert np.allclose(model.logpdf(None, {0: x}), expected)
+    # The cache is invalidated by changes to the suffstats and hypers.
+    before = model.logpdf(None, {0: 1.})
+    model.incorporate(10, {0: 10.})
+    assert not np.allclose(model.logpdf(None, {0: 1.}), before)
+    model.unincorporate(10)
+    assert np.allclose(model.logpdf(None, {0: 1.}), before)
+    model.set_hypers({'m': 3., 'r': 2., 's': 4., 'nu': 5.})
+    assert not np.allclose(model.logpdf(None, {0: 1.}), before)
+
+
+@pytest.mark.parametrize('model, X, queries', [
+    (Normal([0], [], rng=gu.gen_rng(1)),
+        [-1.2, .3, 2.1], [-3., 0., 1.5]),
+    (Lognormal([0], [], rng=gu.gen_rng(1)),
+        [.1, 1.2, 3.4], [-1., 0., .5, 2.]),
+    (Categorical([0], [], distargs={'k': 3}, rng=gu.gen_rng(1)),
+        [0, 1, 1], [0, 1, 2, 3, .5]),
+    (Bernoulli([0], [], rng=gu.gen_rng(1)),
+        [0, 1, 1], [0, 1, 2]),
+])
+def test_logpdf_array_matches_logpdf(model, X, queries):
+    for rowid, x in enumerate(X):
+        model.incorporate(rowid, {0: x})
+    expected = [model.logpdf(None, {0: x}) for x in queries]
+    assert np.allclose(model.logpdf_array(queries), expected)
+
+
+def test_state_logpdf_bulk_matches_logpdf():
+    rng = gu.gen_rng(2)
+    X = rng.normal(size=(20, 3))
+    X[:, 2] = rng.randint(0, 3, size=20)
+    # Queries about observed rows may only target missing cells.
+    missing = [(0, [0]), (1, [0, 1, 2]), (3, [0, 1, 2]), (5, [1, 2]),
+        (7, [0, 1])]
+    for rowid, cols in missing:
+        X[rowid, cols] = np.nan
+    state = State(
+        X, cctypes=['normal', 'normal', 'categorical'],
+        distargs=[None, None, {'k': 3}], rng=gu.gen_rng(3))
+    state.transition(N=2)
+    rowids = [0, 1, 3, 5, 20, 5, 7]
+    targets_list = [
+        {0: 1.},
+        {0: -.5, 1: .3, 2: 2},
+        {0: 1.2, 2: 1},
+        {1: np.nan},
+        {0: 1., 2: 0},
+        {2: 2},
+        {0: -2., 1: 4.},
+    ]
+    constraints_list = [None, None, {1: .2}, None, {1: .4}, None, None]
+    logps = state.logpdf_bulk(rowids, targets_list, constraints_list)
+    expected = [
+        state.logpdf(r, t, c)
+        for r, t, c in zip(rowids, targets_list, constraints_list)
+    ]
+    assert np.allclose(logps, expected)
+
+
+def test_view_cluster_weights_cache():
+    rng = gu.gen_rng(4)
+    X = rng.normal(size=(30, 3))
+    state = State(X, cctypes=['normal']*3, Zv={0:0, 1:0, 2:0}, rng=rng)
+    view = state.views[0]
+    constraints = {1: .4, 2: -1.}
+
+    def logpdf_uncached():
+        view.lp_cluster_cache.clear()
+        return state.logpdf(-1, {0: .5}, constraints)
+
+    # Repeated queries with the same constraints reuse the cluster weights.
+    first = state.logpdf(-1, {0: .5}, constraints)
+    cached = view.lp_cluster_cache.values()[0]
+    for x in [-1., 0., 1.]:
+        state.logpdf(-1, {0: x}, constraints)
+        state.simulate(-1, [0], constraints, N=2)
+    assert len(view.lp_cluster_cache) == 1
+    assert view.lp_cluster_cache.values()[0] is cached
+    assert np.allclose(first, logpdf_uncached())
+    # Changes to the row partition, alpha, or constrained dims invalidate it.
+    for transition in [
+            lambda: state.transition_view_rows(),
+            lambda: state.transition_view_alphas(),
+            lambda: state.transition_dim_hypers(cols=[2]),
+            lambda: state.incorporate(30, {0: 10., 1: 10., 2: 10.}),
+            lambda: state.unincorporate(30),]:
+        transition()
+        assert np.allclose(
+            state.logpdf(-1, {0: .5}, constraints), logpdf_uncached())
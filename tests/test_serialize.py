@@ -18,10 +18,14 @@
 
 import importlib
 import json
+import os
+import shutil
 import tempfile
 
 import numpy as np
+import pytest
 
+from cgpm.crosscat import binary
 from cgpm.crosscat.engine import Engine
 from cgpm.crosscat.state import State
 from cgpm.mixtures.view import View
@@ -82,6 +86,147 @@ def test_engine_serialize():
     serialize_generic(Engine, additional=additional)
 
 
+def test_binary_serialize():
+    data = np.random.normal(size=(50,4))
+    data[:3,1] = np.nan
+    data[:,0] = np.random.randint(0, 2, size=50)
+    engine = Engine(
+        data, cctypes=['bernoulli','normal','normal','normal'],
+        num_states=3, rng=gu.gen_rng(0))
+    engine.transition(N=2)
+    path = tempfile.mkdtemp(prefix='gpmcc-binary')
+    try:
+        engine.to_binary(path)
+        engine2 = Engine.from_binary(path, rng=gu.gen_rng(1))
+        state = engine.get_state(1)
+        state.to_binary(path)
+        state2 = State.from_binary(path, rng=gu.gen_rng(1))
+    finally:
+        shutil.rmtree(path)
+    assert engine2.num_states() == engine.num_states()
+    for s, s2 in zip(engine.states + [state], engine2.states + [state2]):
+        assert dict(s2.Zv()) == dict(s.Zv())
+        for v in s.views:
+            assert dict(s2.views[v].Zr()) == dict(s.views[v].Zr())
+        assert np.allclose(s2.alpha(), s.alpha())
+        assert np.allclose(s2.logpdf_score(), s.logpdf_score())
+        assert np.allclose(
+            s2.data_array(), s.data_array(), equal_nan=True)
+        assert s2.to_metadata()['hypers'] == s.to_metadata()['hypers']
+
+
+def test_binary_lazy_engine():
+    data = np.random.normal(size=(30,3))
+    engine = Engine(
+        data, cctypes=['normal']*3, num_states=4, rng=gu.gen_rng(0))
+    engine.transition(N=2)
+    path = tempfile.mkdtemp(prefix='gpmcc-binary')
+    try:
+        engine.to_binary(path)
+        engine2 = Engine.from_binary(
+            path, rng=gu.gen_rng(1), lazy=True, max_resident=2)
+        # Nothing is built until a state is accessed.
+        assert engine2.num_states() == 4
+        assert engine2.states.num_resident() == 0
+        assert np.allclose(
+            engine2.logpdf_score(statenos=[3], multiprocess=0),
+            engine.logpdf_score(statenos=[3], multiprocess=0))
+        assert engine2.states.num_resident() == 1
+        # The states loaded share the columns of the dataset.
+        state0, state3 = engine2.get_state(0), engine2.get_state(3)
+        assert all(state0.X[c] is state3.X[c] for c in state0.outputs)
+        # The memory budget is respected, and evicted states are rebuilt.
+        assert np.allclose(
+            engine2.logpdf_score(multiprocess=0),
+            engine.logpdf_score(multiprocess=0))
+        assert engine2.states.num_resident() == 2
+        assert np.allclose(
+            engine2.get_state(0).logpdf_score(),
+            engine.get_state(0).logpdf_score())
+        # Assigned states are kept until evicted, and deleted states dropped.
+        state = engine2.get_state(1)
+        engine2.states[1] = state
+        engine2.drop_state(0)
+        assert engine2.num_states() == 3
+        assert engine2.get_state(0) is state
+        assert [s is state for s in engine2.states[:2]] == [True, False]
+        # Transitions keep the memory budget, and the transitioned states
+        # evicted from memory are restored from their spill files.
+        engine2.transition(N=1, multiprocess=0)
+        assert isinstance(engine2.states, binary.LazyStates)
+        assert engine2.num_states() == 3
+        assert engine2.states.num_resident() <= 2
+        assert os.listdir(engine2.states.spill_dir)
+        scores = engine2.logpdf_score(multiprocess=0)
+        engine2.incorporate(30, {0: 1., 1: 2., 2: 3.}, multiprocess=0)
+        assert engine2.states.num_resident() <= 2
+        assert all(s.n_rows() == 31 for s in engine2.states)
+        engine2.unincorporate(30, multiprocess=0)
+        assert np.allclose(engine2.logpdf_score(multiprocess=0), scores)
+        assert engine2.states.num_resident() <= 2
+    finally:
+        shutil.rmtree(path)
+
+
+def test_binary_lazy_engine_simulate():
+    data = np.random.normal(size=(30,3))
+    engine = Engine(
+        data, cctypes=['normal']*3, num_states=3, rng=gu.gen_rng(0))
+    path = tempfile.mkdtemp(prefix='gpmcc-binary')
+    try:
+        engine.to_binary(path)
+        engine2 = Engine.from_binary(
+            path, rng=gu.gen_rng(1), lazy=True, max_resident=1)
+        loaded = []
+        loader = engine2.states.loader
+        def record(s):
+            loaded.append(s)
+            return loader(s)
+        engine2.states.loader = record
+        # Only the queried states are loaded.
+        engine2.simulate(-1, [0], N=3, statenos=[2], multiprocess=0)
+        assert loaded == [2]
+        # The states keep their new seeds when evicted.
+        samples0 = engine2.simulate(-1, [0], N=3, multiprocess=0)
+        samples1 = engine2.simulate(-1, [0], N=3, multiprocess=0)
+        assert engine2.states.num_resident() == 1
+        assert all(s0 != s1 for s0, s1 in zip(samples0, samples1))
+    finally:
+        shutil.rmtree(path)
+
+
+def test_suffstats_restore():
+    rng = gu.gen_rng(4)
+    data = rng.normal(size=(40,3))
+    data[:,0] = rng.randint(0, 3, size=40)
+    data[:,2] = np.exp(data[:,2])
+    data[:4,2] = np.nan
+    state = State(
+        data, cctypes=['categorical','normal','lognormal'],
+        distargs=[{'k':3}, None, None], rng=gu.gen_rng(0))
+    state.transition(N=2)
+    metadata = json.loads(json.dumps(state.to_metadata()))
+    debug = os.environ.get('GPMCCDEBUG')
+    os.environ['GPMCCDEBUG'] = '1'
+    try:
+        state2 = State.from_metadata(metadata, rng=gu.gen_rng(1))
+        assert np.allclose(state2.logpdf_score(), state.logpdf_score())
+        for dim, dim2 in zip(state.dims(), state2.dims()):
+            assert dim2.get_suffstats() == dim.get_suffstats()
+        # Restored clusters support the usual updates.
+        state2.transition(N=2)
+        state2.unincorporate(39)
+        # Inconsistent suffstats are detected in debug mode.
+        min(metadata['suffstats'][1])[1]['sum_x'] += 1.
+        with pytest.raises(AssertionError):
+            State.from_metadata(metadata, rng=gu.gen_rng(1))
+    finally:
+        if debug is None:
+            del os.environ['GPMCCDEBUG']
+        else:
+            os.environ['GPMCCDEBUG'] = debug
+
+
 def test_view_serialize():
     data = np.random.normal(size=(100,5))
     data[:,0] = 0
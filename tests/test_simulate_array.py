@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015-2016 MIT Probabilistic Computing Project
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#    http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from cgpm.crosscat.engine import Engine
+from cgpm.crosscat.state import State
+from cgpm.mixtures.dim import Dim
+from cgpm.utils import general as gu
+
+
+CCTYPES_DISTARGS = [
+    ('bernoulli', None, [0, 1, 1, 0, 1]),
+    ('categorical', {'k': 4}, [0, 1, 3, 3, 2]),
+    ('crp', None, [0, 0, 1, 2, 1]),
+    ('exponential', None, [.1, 1.2, 3.4, .8, .2]),
+    ('geometric', None, [0, 3, 1, 2, 5]),
+    ('lognormal', None, [.1, 1.2, 3.4, .8, .2]),
+    ('normal', None, [-1.2, .3, 2.1, .8, -.2]),
+    ('normal_trunc', {'l': -1, 'h': 3}, [-.2, .3, 2.1, .8, -.9]),
+    ('poisson', None, [0, 3, 1, 2, 5]),
+    ('vonmises', None, [.1, 1.2, 3.4, .8, 5.2]),
+]
+
+
+@pytest.mark.parametrize('cctype, distargs, X', CCTYPES_DISTARGS)
+def test_simulate_array_matches_simulate(cctype, distargs, X):
+    dim = Dim([0], [-1], cctype=cctype, distargs=distargs, rng=gu.gen_rng(1))
+    dim.transition_hyper_grids(X)
+    for rowid, x in enumerate(X):
+        dim.incorporate(rowid, {0: x}, {-1: rowid % 2})
+    for k in [0, 1, 2]:
+        samples_array = dim.simulate_array(None, 2000, {-1: k})
+        samples_dict = dim.simulate(None, [0], None, {-1: k}, 2000)
+        samples_dict = np.asarray([s[0] for s in samples_dict])
+        assert samples_array.shape == (2000,)
+        # Compare medians to within a generous tolerance, since the two
+        # samplers consume entropy differently.
+        iqr = np.subtract(*np.percentile(samples_dict, [75, 25]))
+        assert np.allclose(
+            np.median(samples_array), np.median(samples_dict),
+            atol=.5 + .25*iqr)
+
+
+def test_simulate_array_observed_rowid():
+    dim = Dim([0], [-1], cctype='normal', rng=gu.gen_rng(1))
+    dim.transition_hyper_grids([1., 2.])
+    dim.incorporate(0, {0: 1.}, {-1: 0})
+    cluster = dim.clusters[0]
+    assert np.all(cluster.simulate_array(0, 5) == 1.)
+
+
+def test_state_simulate_columns_order():
+    rng = gu.gen_rng(2)
+    X = np.column_stack((
+        np.concatenate((rng.normal(-10, 1, 30), rng.normal(10, 1, 30))),
+        np.concatenate((rng.normal(10, 1, 30), rng.normal(-10, 1, 30))),
+    ))
+    state = State(
+        X, cctypes=['normal', 'normal'], Zv={0:0, 1:0},
+        Zrv={0: [0]*30 + [1]*30}, rng=rng)
+    state.transition(N=10, kernels=['column_hypers'], progress=False)
+    samples = state.simulate(-1, [0, 1], N=200)
+    assert len(samples) == 200
+    # Draws in each row must come from the same cluster.
+    agree = [(s[0] < 0) != (s[1] < 0) for s in samples]
+    assert np.mean(agree) > .9
+    # Draws are not grouped by cluster.
+    signs = [s[0] < 0 for s in samples]
+    assert any(a != b for a, b in zip(signs[:100], signs[1:101]))
+
+
+def test_simulate_columnar():
+    rng = gu.gen_rng(3)
+    X = rng.normal(size=(20, 3))
+    state = State(X, cctypes=['normal']*3, rng=rng)
+    samples = state.simulate(-1, [0, 2], {1: 0.}, N=15, columnar=True)
+    assert set(samples) == set([0, 2])
+    assert all(samples[c].shape == (15,) for c in samples)
+    sample = state.simulate(3, [0, 1], columnar=True)
+    assert all(sample[c].shape == (1,) for c in sample)
+    bulk = state.simulate_bulk(
+        [-1, 2], [[0], [1, 2]], Ns=[4, 6], columnar=True)
+    assert bulk[0][0].shape == (4,)
+    assert bulk[1][2].shape == (6,)
+    # Composite states convert the network samples into columns.
+    state.update_cctype(2, 'linear_regression')
+    assert state.is_composite()
+    samples = state.simulate(-1, [0, 2], N=7, columnar=True)
+    assert all(samples[c].shape == (7,) for c in [0, 2])
+
+
+def test_engine_simulate_columnar_resample():
+    rng = gu.gen_rng(4)
+    X = rng.normal(size=(20, 3))
+    engine = Engine(
+        X, cctypes=['normal']*3, num_states=3, rng=rng, multiprocess=0)
+    samples = engine.simulate(
+        -1, [0, 1], {2: 1.}, N=10, columnar=True, multiprocess=0)
+    assert len(samples) == 3
+    resample = engine._likelihood_weighted_resample(
+        samples, -1, constraints={2: 1.}, multiprocess=0)
+    assert set(resample) == set([0, 1])
+    assert resample[0].shape == (10,)
+    values = np.concatenate([s[0] for s in samples])
+    assert all(r in values for r in resample[0])
+
+
+def test_engine_simulate_positional_statenos():
+    rng = gu.gen_rng(5)
+    X = rng.normal(size=(20, 2))
+    engine = Engine(
+        X, cctypes=['normal']*2, num_states=3, rng=rng, multiprocess=0)
+    samples = engine.simulate(-1, [0], None, None, 4, None, [0, 2], 0)
+    assert len(samples) == 2 and len(samples[0]) == 4
+    samples = engine.simulate_bulk(
+        [-1, -1], [[0], [1]], None, None, [2, 3], [1], 0)
+    assert len(samples) == 1 and map(len, samples[0]) == [2, 3]
@@ -91,8 +91,8 @@ def test_categorical_forest():
     cat_id = CCTYPES.index('categorical')
 
     # If cat_id is singleton migrate first.
+    distargs = DISTARGS[cat_id].copy()
     if len(state.view_for(cat_id).dims) == 1:
-        distargs = DISTARGS[cat_id].copy()
         state.unincorporate_dim(cat_id)
         state.incorporate_dim(
             T[:,cat_id], outputs=[cat_id], cctype='categorical',
@@ -125,7 +125,7 @@ def test_categorical_forest():
 
 def test_categorical_forest_manual_inputs_errors():
     state = State(
-        T, cctypes=CCTYPES, distargs=DISTARGS, rng=gu.gen_rng(1))
+        T, cctypes=CCTYPES, distargs=DISTARGS, rng=gu.gen_rng(2))
     state.transition(N=1, progress=False)
     cat_id = CCTYPES.index('categorical')
 